@@ -1,5 +1,4 @@
 """Output package for Pyclaw"""
 
 from __future__ import absolute_import
-import logging
 
@@ -47,10 +47,10 @@ Version: Updated for Clawpack v5.7.1.
 # use Python 3 style print function rather than Python 2 print statements:
 from __future__ import print_function 
 
-from matplotlib import image, animation
-from matplotlib import pyplot as plt
 import warnings
 
+# matplotlib is imported in the functions that use it, so that importing
+# this module does not import pyplot.
 
 def make_plotdir(plotdir='_plots', clobber=True):
     """
@@ -78,6 +78,8 @@ def save_frame(frameno, plotdir='_plots', fname_base='frame', format='png',
     the appropriate file name such as _plots/frame00001.png.
     """
 
+    from matplotlib import pyplot as plt
+
     plt.draw()
     filename = '%s/%s%s.%s' % (plotdir, fname_base, str(frameno).zfill(5), format)
     plt.savefig(filename, **kwargs)
@@ -100,6 +102,9 @@ def make_anim(plotdir, fname_pattern='frame*.png', figsize=None, dpi=None):
         make_anim_outputs_from_plotdir: creates .html, .mp4, and/or .rst files
     """
 
+    from matplotlib import pyplot as plt
+    from matplotlib import image
+    from matplotlib import animation
     import matplotlib
 
     import glob   # for finding all files matching a pattern
@@ -151,7 +156,9 @@ def animate_images(images, figsize=(10,6), dpi=None):
     """
     Convert a list of images to anim using animation.FuncAnimation.
     """
-    
+
+    from matplotlib import pyplot as plt
+    from matplotlib import animation
     import matplotlib
 
     # display each image in a new fig:
@@ -248,6 +255,8 @@ def make_mp4(anim, file_name='anim.mp4',
     Take an animation and covert to mp4 file using ffmpeg, which must be
     installed.
     """
+
+    from matplotlib import animation
     import os
 
     if not animation.writers.is_available('ffmpeg'):
@@ -264,8 +273,562 @@ def make_mp4(anim, file_name='anim.mp4',
     print("Created %s" % file_name)
 
 
+def ffmpeg_path():
+    """
+    Return the ffmpeg executable matplotlib is configured to use, or None
+    if it cannot be found.
+    """
+
+    import matplotlib
+    import shutil
+    return shutil.which(matplotlib.rcParams['animation.ffmpeg_path'])
+
+
+class FFmpegStream(object):
+    """
+    Make a movie by piping the RGBA pixels of each frame to an ffmpeg
+    process as the frames are rendered, rather than writing png files and
+    reading them back into a new figure as make_anim does.
+
+    The ffmpeg process is started when the first frame is written, since
+    the frame size is not known before.  All later frames must have the
+    same size.  If ffmpeg cannot be started or exits early, the remaining
+    frames are ignored and close returns False.
+
+    Usage:
+        stream = FFmpegStream('movie_fig2.mp4', fps=5)
+        for fig in figs:
+            stream.write_figure(fig)
+        stream.close()
+    """
+
+    def __init__(self, file_name, fps=5, codec='h264', ffmpeg=None,
+                 extra_args=('-pix_fmt', 'yuv420p')):
+        import os
+
+        if os.path.splitext(file_name)[1] != '.mp4':
+            msg = "\n*** Might not work if file extension is not .mp4"
+            warnings.warn(msg)
+        if ffmpeg is None:
+            ffmpeg = ffmpeg_path()
+        self.file_name = file_name
+        self.fps = fps
+        self.codec = codec
+        self.ffmpeg = ffmpeg
+        self.extra_args = list(extra_args)
+        self.shape = None
+        self.num_frames = 0
+        self.failed = False
+        self._proc = None
+        self._log = None
+
+    def _start(self, shape):
+        import subprocess, tempfile
+
+        self.shape = shape
+        if self.ffmpeg is None:
+            print('*** Error: ffmpeg not found, cannot create %s' \
+                  % self.file_name)
+            self.failed = True
+            return
+
+        # libx264 needs even dimensions, pad by a pixel if necessary:
+        cmd = [self.ffmpeg, '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgba',
+               '-s', '%ix%i' % (shape[1], shape[0]),
+               '-r', str(self.fps), '-i', '-',
+               '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+               '-vcodec', self.codec] + self.extra_args + [self.file_name]
+        self._log = tempfile.TemporaryFile()
+        try:
+            self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                          stdout=subprocess.DEVNULL,
+                                          stderr=self._log)
+        except OSError as e:
+            print('*** Error: unable to run %s: %s' % (self.ffmpeg, e))
+            self.failed = True
+
+    def write_rgba(self, rgba):
+        """
+        Write one frame given as an array of shape (rows, columns, 4) of
+        unsigned bytes, with the top row first.
+        """
+
+        import numpy as np
+
+        rgba = np.ascontiguousarray(rgba, dtype=np.uint8)
+        if self.shape is None:
+            self._start(rgba.shape)
+        if self.failed:
+            return
+        if rgba.shape != self.shape:
+            print('*** Error: frame %i of %s has size %s, expected %s' \
+                  % (self.num_frames, self.file_name, rgba.shape[:2],
+                     self.shape[:2]))
+            self.failed = True
+            return
+        try:
+            self._proc.stdin.write(rgba.data)
+        except OSError:
+            # ffmpeg exited, the reason is printed by close
+            self.failed = True
+            return
+        self.num_frames += 1
+
+    def write_figure(self, fig):
+        """
+        Render the matplotlib Figure fig and write its pixels as a frame.
+        """
+
+        import numpy as np
+
+        canvas = fig.canvas
+        if not hasattr(canvas, 'buffer_rgba'):
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            canvas = FigureCanvasAgg(fig)
+        canvas.draw()
+        self.write_rgba(np.asarray(canvas.buffer_rgba()))
+
+    def close(self):
+        """
+        Wait for ffmpeg to finish writing the movie.  Returns True if the
+        movie was created.
+        """
+
+        if self._proc is not None:
+            try:
+                self._proc.stdin.close()
+            except OSError:
+                pass
+            if self._proc.wait() != 0:
+                self.failed = True
+            self._proc = None
+        if self._log is not None:
+            if self.failed:
+                self._log.seek(0)
+                msg = self._log.read().decode('utf-8', 'replace').strip()
+                if msg:
+                    print('*** ffmpeg: %s' % msg)
+            self._log.close()
+            self._log = None
+        return (not self.failed) and (self.num_frames > 0)
+
+
+def png_size(file_name):
+    """
+    Return (width, height) of a png file, read from its header without
+    decoding the image.
+    """
+
+    import struct
+    with open(file_name, 'rb') as f:
+        header = f.read(24)
+    if header[:8] != b'\x89PNG\r\n\x1a\n' or header[12:16] != b'IHDR':
+        raise ValueError('%s is not a png file' % file_name)
+    return struct.unpack('>II', header[16:24])
+
+
+def make_mp4_from_pngs(filenames, file_name='anim.mp4', fps=5, codec='h264',
+                       crf=None, decode='ffmpeg', num_threads=None):
+    """
+    Make a movie from png files at their own resolution, without drawing
+    them into a matplotlib figure as make_anim does.
+
+    filenames is the list of png files in the order they are shown.  Frames
+    smaller than the largest one (e.g. when bbox_inches='tight' crops some
+    frames differently) are padded with white at the right and bottom.
+
+    codec and crf (constant rate factor, lower is better quality, None for
+    the ffmpeg default) are passed to ffmpeg.
+
+    decode='ffmpeg' gives ffmpeg a list of the files (concat demuxer) to
+    read and decode itself.  decode='python' decodes them with Pillow in
+    num_threads threads (default: number of cpus) and pipes the pixels to
+    ffmpeg, which may be faster for large frames.
+
+    Returns True if the movie was created.
+    """
+
+    import os, subprocess, tempfile
+
+    if len(filenames) == 0:
+        warnings.warn('\n*** No png files given for %s' % file_name)
+        return False
+    ffmpeg = ffmpeg_path()
+    if ffmpeg is None:
+        print("** ffmpeg must be installed to create mp4 file")
+        return False
+    if os.path.splitext(file_name)[1] != '.mp4':
+        msg = "\n*** Might not work if file extension is not .mp4"
+        warnings.warn(msg)
+
+    # size of the movie, even as libx264 requires:
+    sizes = [png_size(f) for f in filenames]
+    width = max([s[0] for s in sizes])
+    height = max([s[1] for s in sizes])
+    width += width % 2
+    height += height % 2
+
+    encode_args = ['-vcodec', codec, '-pix_fmt', 'yuv420p']
+    if crf is not None:
+        encode_args += ['-crf', str(crf)]
+
+    if decode == 'python':
+        return _pipe_pngs(filenames, file_name, fps, (height, width),
+                          encode_args, num_threads, ffmpeg)
+    elif decode != 'ffmpeg':
+        raise ValueError("decode must be 'ffmpeg' or 'python'")
+
+    list_file = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+    try:
+        list_file.write('ffconcat version 1.0\n')
+        for f in filenames:
+            path = os.path.abspath(f).replace("'", "'\\''")
+            list_file.write("file '%s'\nduration %s\n" % (path, 1./fps))
+        list_file.close()
+        cmd = [ffmpeg, '-y', '-loglevel', 'error',
+               '-f', 'concat', '-safe', '0', '-i', list_file.name,
+               '-vf', 'pad=%i:%i:0:0:color=white' % (width, height),
+               '-r', str(fps)] + encode_args + [file_name]
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE)
+    finally:
+        list_file.close()
+        os.remove(list_file.name)
+
+    if result.returncode != 0:
+        print('*** ffmpeg: %s' % result.stderr.decode('utf-8', 'replace').strip())
+        return False
+    print("Created %s" % file_name)
+    return True
+
+
+def _pipe_pngs(filenames, file_name, fps, shape, encode_args, num_threads,
+               ffmpeg):
+    """
+    Decode the png files in threads and pipe them to ffmpeg, padded to
+    shape = (height, width), for make_mp4_from_pngs.
+    """
+
+    import numpy as np
+    from PIL import Image
+
+    def decode(f):
+        # Pillow releases the GIL while decoding
+        with Image.open(f) as im:
+            rgba = np.asarray(im.convert('RGBA'))
+        if rgba.shape[:2] != shape:
+            padded = np.full(shape + (4,), 255, dtype=np.uint8)
+            padded[:rgba.shape[0], :rgba.shape[1], :] = rgba
+            rgba = padded
+        return rgba
+
+    stream = FFmpegStream(file_name, fps=fps, codec=encode_args[1],
+                          ffmpeg=ffmpeg, extra_args=encode_args[2:])
+    frames = _map_ahead(decode, filenames, num_threads)
+    for rgba in frames:
+        stream.write_rgba(rgba)
+        if stream.failed:
+            break
+    frames.close()
+    if not stream.close():
+        return False
+    print("Created %s" % file_name)
+    return True
+
+
+def _map_ahead(func, items, num_threads=None):
+    """
+    Generator giving func(item) for each item in order, like map, but
+    evaluated in num_threads threads (default: number of cpus) at most
+    2*num_threads items ahead of the one returned, so that memory use does
+    not grow with the number of items.
+    """
+
+    import os
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    if num_threads is None:
+        num_threads = os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) > 2*num_threads:
+                    yield pending.popleft().result()
+            while len(pending) > 0:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _load_on_white(file_name, size):
+    """
+    Return the image in file_name as an RGB Pillow image of the given size
+    (width, height), with the image at the top left on a white background.
+    """
+
+    from PIL import Image
+
+    frame = Image.new('RGBA', size, (255, 255, 255, 255))
+    with Image.open(file_name) as im:
+        frame.alpha_composite(im.convert('RGBA'))
+    return frame.convert('RGB')
+
+
+def make_gif_from_pngs(filenames, file_name='anim.gif', delay=20, loop=0,
+                       sample=20, dither=True, num_threads=None):
+    """
+    Make an animated gif from png files using Pillow, as
+    `convert -delay 20 frame*.png anim.gif` from ImageMagick does.
+
+    One palette of 256 colors is made from up to sample frames spread over
+    the movie and used for all frames, so that colors do not change from
+    frame to frame.  The frames are quantized to this palette in
+    num_threads threads (default: number of cpus) and written to the file
+    one at a time, so memory use does not grow with the number of frames.
+    Frames smaller than the largest one are padded with white at the right
+    and bottom, and transparent parts are shown on white.
+
+    delay is the time between frames in hundredths of a second and loop
+    the number of times the movie is repeated, 0 for forever.
+
+    Returns True if the gif was created.
+    """
+
+    import struct
+    from PIL import Image, GifImagePlugin
+
+    if len(filenames) == 0:
+        warnings.warn('\n*** No png files given for %s' % file_name)
+        return False
+
+    sizes = [png_size(f) for f in filenames]
+    size = (max([s[0] for s in sizes]), max([s[1] for s in sizes]))
+
+    def thumbnail(f):
+        im = _load_on_white(f, size)
+        return im.reduce(max(1, size[0] // 400))
+
+    # palette from a mosaic of reduced sample frames:
+    step = max(1, len(filenames) // sample)
+    thumbs = list(_map_ahead(thumbnail, filenames[::step][:sample],
+                             num_threads))
+    mosaic = Image.new('RGB', (thumbs[0].size[0],
+                               thumbs[0].size[1] * len(thumbs)))
+    for k, im in enumerate(thumbs):
+        mosaic.paste(im, (0, k * thumbs[0].size[1]))
+    palette_image = mosaic.quantize(colors=256,
+                                    method=Image.Quantize.MEDIANCUT)
+    palette = palette_image.getpalette()[:768]
+    palette = palette + [0] * (768 - len(palette))
+
+    if dither:
+        dither = Image.Dither.FLOYDSTEINBERG
+    else:
+        dither = Image.Dither.NONE
+
+    def quantize(f):
+        return _load_on_white(f, size).quantize(palette=palette_image,
+                                                dither=dither)
+
+    with open(file_name, 'wb') as gif:
+        # header with the global palette (256 colors, 8 bits each),
+        # and the extension to repeat the movie:
+        gif.write(b'GIF89a' + struct.pack('<HHBBB', size[0], size[1],
+                                          0xf7, 0, 0))
+        gif.write(bytes(palette))
+        gif.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', loop)
+                  + b'\x00')
+        for frame in _map_ahead(quantize, filenames, num_threads):
+            # frame delay, image header and compressed indices:
+            for data in GifImagePlugin.getdata(frame, duration=10*delay):
+                gif.write(data)
+        gif.write(b';')
+
+    return True
+
+
+def make_sprite_sheets(filenames, file_name_prefix='sprites',
+                       frames_per_sheet=25, columns=5, width=None,
+                       format='png', num_threads=None):
+    """
+    Pack the frames in the image files filenames into sprite sheets, each a
+    grid of up to frames_per_sheet frames with the given number of columns,
+    so that a web page can show a movie with a few large requests rather
+    than one for each frame.  See movieviewer.make_sprite_manifest.
+
+    The frames are scaled down to the given width in pixels, keeping their
+    aspect ratio, unless width is None.  Frames smaller than the largest
+    one are padded with white at the right and bottom first.  The sheets
+    are written to file_name_prefix000.png, file_name_prefix001.png, etc.
+    (or other format, e.g. 'jpg'), packed in parallel in num_threads
+    threads (default: number of cpus).
+
+    Returns the index, a dictionary with keys
+        'width', 'height': size of a frame in the sheets,
+        'sheets': list of the sheet file names, without directory,
+        'frames': list of dictionaries for each frame, with keys 'sheet'
+                  (index in sheets) and 'x', 'y' (pixels from the top left
+                  of the sheet),
+    which is also written to file_name_prefix.json.
+    """
+
+    import os, json
+    from concurrent.futures import ThreadPoolExecutor
+    from PIL import Image
+
+    if len(filenames) == 0:
+        warnings.warn('\n*** No image files given for %s' % file_name_prefix)
+        return None
+
+    sizes = [png_size(f) for f in filenames]
+    size = (max([s[0] for s in sizes]), max([s[1] for s in sizes]))
+    if (width is None) or (width >= size[0]):
+        frame_size = size
+    else:
+        frame_size = (int(width),
+                      max(1, int(round(size[1] * float(width) / size[0]))))
+    w, h = frame_size
+
+    groups = [filenames[k:k+frames_per_sheet]
+              for k in range(0, len(filenames), frames_per_sheet)]
+
+    def pack(k):
+        group = groups[k]
+        nrows = (len(group) + columns - 1) // columns
+        sheet = Image.new('RGB', (min(columns, len(group)) * w, nrows * h),
+                          (255, 255, 255))
+        for j, f in enumerate(group):
+            frame = _load_on_white(f, size)
+            if frame_size != size:
+                frame = frame.resize(frame_size, Image.LANCZOS)
+            sheet.paste(frame, ((j % columns) * w, (j // columns) * h))
+        sheet_name = '%s%s.%s' % (file_name_prefix, str(k).zfill(3), format)
+        sheet.save(sheet_name)
+        return os.path.basename(sheet_name)
+
+    if num_threads is None:
+        num_threads = os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        sheets = list(executor.map(pack, range(len(groups))))
+
+    frames = []
+    for k in range(len(filenames)):
+        j = k % frames_per_sheet
+        frames.append({'sheet': k // frames_per_sheet,
+                       'x': (j % columns) * w, 'y': (j // columns) * h})
+    index = {'width': w, 'height': h, 'sheets': sheets, 'frames': frames}
+    with open(file_name_prefix + '.json', 'w') as f:
+        json.dump(index, f)
+    return index
+
+
+def reduced_image_name(file_name, width):
+    """
+    Return the name of the copy of image file_name reduced to the given
+    width by make_reduced_images, e.g. _plots/_w400/frame0003fig1.png for
+    _plots/frame0003fig1.png.  A subdirectory is used so that the copies
+    are not taken for plots by patterns such as frame*.png.
+    """
+
+    import os
+
+    directory, name = os.path.split(file_name)
+    return os.path.join(directory, '_w%i' % width, name)
+
+
+def choose_reduced_width(widths, display_width):
+    """
+    Return the smallest of the reduced image widths that is at least
+    display_width, or None if there is none and the full image should
+    be used.
+    """
+
+    larger = [width for width in (widths or []) if width >= display_width]
+    if len(larger) == 0:
+        return None
+    return min(larger)
+
+
+def make_reduced_images(file_name, widths):
+    """
+    Write copies of the png file file_name scaled down to each of widths,
+    keeping the aspect ratio, to the files named by reduced_image_name.
+    Each copy is made from the next larger one, so that making a small
+    thumbnail and a medium size image costs little more than the medium
+    one.  Images that are already narrower are copied.
+    """
+
+    import os, shutil
+    from PIL import Image
+
+    with Image.open(file_name) as im:
+        im.load()
+    if im.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        im = im.convert('RGBA')
+    for width in sorted(widths, reverse=True):
+        reduced_name = reduced_image_name(file_name, width)
+        os.makedirs(os.path.dirname(reduced_name), exist_ok=True)
+        if width >= im.size[0]:
+            shutil.copyfile(file_name, reduced_name)
+            continue
+        height = max(1, int(round(im.size[1] * float(width) / im.size[0])))
+        im = im.resize((int(width), height), Image.LANCZOS)
+        im.save(reduced_name)
+
+
+_reduce_executor = None
+_reduce_pid = None
+_reduce_futures = []
+
+
+def make_reduced_images_later(file_name, widths):
+    """
+    Start make_reduced_images(file_name, widths) in a background thread,
+    so that e.g. plotting the next frame can go on meanwhile.  Use
+    wait_for_reduced_images to wait until all have been made.
+    """
+
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+
+    global _reduce_executor, _reduce_pid
+    if (_reduce_executor is None) or (_reduce_pid != os.getpid()):
+        # a new pool is needed in a process forked to plot in parallel
+        _reduce_executor = ThreadPoolExecutor(
+                            max_workers=min(4, os.cpu_count() or 1))
+        _reduce_pid = os.getpid()
+        del _reduce_futures[:]
+    _reduce_futures.append((file_name,
+            _reduce_executor.submit(make_reduced_images, file_name, widths)))
+
+
+def wait_for_reduced_images():
+    """
+    Wait until the images started by make_reduced_images_later are made,
+    printing a warning for those that could not be.  Returns the number
+    of files that failed.
+    """
+
+    failed = 0
+    while len(_reduce_futures) > 0:
+        file_name, future = _reduce_futures.pop(0)
+        try:
+            future.result()
+        except Exception as error:
+            print('*** Warning: could not make reduced images of %s: %s' \
+                  % (file_name, error))
+            failed += 1
+    return failed
+
+
 def read_images(plotdir, fname_pattern='*.png'):
 
+    from matplotlib import pyplot as plt
     import glob, os
     images = []
     files = glob.glob(os.path.join(plotdir, fname_pattern))
@@ -278,6 +841,8 @@ def read_images(plotdir, fname_pattern='*.png'):
 def save_images(images, figsize=(8,6), plotdir='_plots', clobber=True, \
                 fname_base='frame', format='png', verbose=False, **kwargs):
 
+    from matplotlib import pyplot as plt
+
     make_plotdir(plotdir=plotdir, clobber=clobber)
     for frameno,image in enumerate(images):
         fig = imshow_noaxes(image, figsize)
@@ -290,6 +855,8 @@ def save_images(images, figsize=(8,6), plotdir='_plots', clobber=True, \
 def save_figs(figs, plotdir='_plots', clobber=True, \
                 fname_base='frame', format='png', verbose=False, **kwargs):
 
+    from matplotlib import pyplot as plt
+
     make_plotdir(plotdir=plotdir, clobber=clobber)
     for frameno,fig in enumerate(figs):
         filename = '%s/%s%s.%s' % (plotdir, fname_base, str(frameno).zfill(5), format)
@@ -305,6 +872,8 @@ def make_image(fig, **kwargs):
     can be viewed with imshow.
     """
 
+    from matplotlib import pyplot as plt
+
     import io
     png = io.BytesIO()
     fig.savefig(png,format='png', **kwargs)
@@ -324,6 +893,8 @@ def make_images(figs, **kwargs):
     return images
 
 def imshow_noaxes(im, figsize=(8,6)):
+    from matplotlib import pyplot as plt
+
     fig = plt.figure(figsize=figsize)
     ax = plt.axes()
     plt.imshow(im)
@@ -13,8 +13,10 @@ See matplotlib._cm for the data defining various maps.
 """
 
 import numpy
-import matplotlib.colors as colors
-import matplotlib.pyplot as plt
+
+# matplotlib is imported in the functions that use it, and the colormaps
+# defined below are created on first use, so that importing this module
+# does not import matplotlib.
 
 # Clawpack tan color for plotfigure.facecolor if desired (default now 'w'):
 clawpack_tan = '#ffeebb'  
@@ -47,6 +49,8 @@ def make_colormap(color_list):
     zn = max(z)
     x0 = (z - z1) / (zn - z1)
 
+    import matplotlib.colors as colors
+
     CC = colors.ColorConverter()
     R = []
     G = []
@@ -115,6 +119,8 @@ def add_colormaps(colormaps, data_limits=[0.0,1.0], data_break=0.5,
 
     """
 
+    import matplotlib.colors as colors
+
     lhs_dict = colormaps[0]._segmentdata
     rhs_dict = colormaps[1]._segmentdata
     new_dict = dict(red=[], green=[], blue=[], alpha=[])
@@ -162,6 +168,7 @@ def add_colormaps(colormaps, data_limits=[0.0,1.0], data_break=0.5,
 def showcolors(cmap):
     #from scitools.easyviz.matplotlib_ import colorbar, clf, axes, linspace,\
                  #pcolor, meshgrid, show, colormap
+    import matplotlib.pyplot as plt
     plt.clf()
     x = numpy.linspace(0,1,21)
     X,Y = numpy.meshgrid(x,x)
@@ -192,24 +199,55 @@ def schlieren_colormap(color=[0,0,0]):
 # Some useful colormaps follow...
 # There are also many colormaps in matplotlib.cm
 
-all_white = make_colormap({0.:'w', 1.:'w'})
-all_light_red = make_colormap({0.:'#ffdddd', 1.:'#ffdddd'})
-all_light_blue = make_colormap({0.:'#ddddff', 1.:'#ddddff'})
-all_light_green = make_colormap({0.:'#ddffdd', 1.:'#ddffdd'})
-all_light_yellow = make_colormap({0.:'#ffffdd', 1.:'#ffffdd'})
-
-red_white_blue = make_colormap({0.:'r', 0.5:'w', 1.:'b'})
-blue_white_red = make_colormap({0.:'b', 0.5:'w', 1.:'r'})
-red_yellow_blue = make_colormap({0.:'r', 0.5:'#ffff00', 1.:'b'})
-blue_yellow_red = make_colormap({0.:'b', 0.5:'#ffff00', 1.:'r'})
-yellow_red_blue = make_colormap({0.:'#ffff00', 0.5:'r', 1.:'b'})
-white_red = make_colormap({0.:'w', 1.:'r'})
-white_blue = make_colormap({0.:'w', 1.:'b'})
-
-schlieren_grays = schlieren_colormap('k')
-schlieren_reds = schlieren_colormap('r')
-schlieren_blues = schlieren_colormap('b')
-schlieren_greens = schlieren_colormap('g')
+_colormap_specs = {
+    'all_white': {0.:'w', 1.:'w'},
+    'all_light_red': {0.:'#ffdddd', 1.:'#ffdddd'},
+    'all_light_blue': {0.:'#ddddff', 1.:'#ddddff'},
+    'all_light_green': {0.:'#ddffdd', 1.:'#ddffdd'},
+    'all_light_yellow': {0.:'#ffffdd', 1.:'#ffffdd'},
+
+    'red_white_blue': {0.:'r', 0.5:'w', 1.:'b'},
+    'blue_white_red': {0.:'b', 0.5:'w', 1.:'r'},
+    'red_yellow_blue': {0.:'r', 0.5:'#ffff00', 1.:'b'},
+    'blue_yellow_red': {0.:'b', 0.5:'#ffff00', 1.:'r'},
+    'yellow_red_blue': {0.:'#ffff00', 0.5:'r', 1.:'b'},
+    'white_red': {0.:'w', 1.:'r'},
+    'white_blue': {0.:'w', 1.:'b'},
+    }
+
+_schlieren_specs = {
+    'schlieren_grays': 'k',
+    'schlieren_reds': 'r',
+    'schlieren_blues': 'b',
+    'schlieren_greens': 'g',
+    }
+
+
+# Names imported by "from clawpack.visclaw.colormaps import *", listed
+# since the colormaps above are not globals until they are used:
+__all__ = ['clawpack_tan', 'make_colormap', 'add_colormaps', 'showcolors',
+           'schlieren_colormap', 'make_amrcolors'] \
+          + list(_colormap_specs.keys()) + list(_schlieren_specs.keys())
+
+
+def __getattr__(name):
+    """
+    Create the colormaps above, e.g. colormaps.red_white_blue, on first use.
+    """
+    if name in _colormap_specs:
+        cmap = make_colormap(_colormap_specs[name])
+    elif name in _schlieren_specs:
+        cmap = schlieren_colormap(_schlieren_specs[name])
+    else:
+        raise AttributeError("module %r has no attribute %r" \
+                             % (__name__, name))
+    globals()[name] = cmap
+    return cmap
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_colormap_specs.keys())
+                  + list(_schlieren_specs.keys()))
 
 
 #-------------------------------
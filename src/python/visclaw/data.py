@@ -14,7 +14,6 @@ import logging
 import clawpack.clawutil.data as clawdata
 import time
 
-import clawpack.pyclaw.controller
 
 # ============================================================================
 #  Subclass ClawPlotData containing data for plotting results
@@ -58,6 +57,7 @@ class ClawPlotData(clawdata.ClawData):
 
         # This should eventually replace all need for recording the above
         # information
+        import clawpack.pyclaw.controller
         self.add_attribute('output_controller', None)
         self.output_controller = clawpack.pyclaw.controller.OutputController(
                                            self.outdir, file_format=self.format)
@@ -70,6 +70,10 @@ class ClawPlotData(clawdata.ClawData):
         self.add_attribute('verbose',True)             # verbose output?
 
         self.add_attribute('ion',False)                # call ion() or ioff()?
+        self.add_attribute('use_pyplot',True)          # False ==> print frames using
+                                        # Figure objects with an Agg canvas
+                                        # rather than pyplot, so that frames
+                                        # can be plotted in threads
 
         self.add_attribute('printfigs',True)
         self.add_attribute('print_format','png')
@@ -91,8 +95,16 @@ class ClawPlotData(clawdata.ClawData):
         self.add_attribute('html_index_fname','_PlotIndex.html')   # name of html index file
         self.add_attribute('html_index_title','Plot Index')   # title at top of index page
         self.add_attribute('html_homelink',None)       # link to here from top of _PlotIndex.html
-        self.add_attribute('html_movie','JSAnimation') # make html with java script for movie
-        self.add_attribute('html_movie_width', 500)    # width of movie (not used?)
+        self.add_attribute('html_single_page',True)    # index page made from _PlotIndex.json
+        self.add_attribute('html_static_pages',False)  # also write a page for each plot
+        # widths of reduced copies of the png files shown in the html pages,
+        # e.g. [400, 1200], made in _plots/_w400 etc. after each plot:
+        self.add_attribute('html_reduced_widths',None)
+        # html movie of frames: 'lazy' loads the png files as needed,
+        # 'sprites' packs them in a few large images for web servers,
+        # 'JSAnimation' embeds them in the html file, '4.x' preloads them:
+        self.add_attribute('html_movie','lazy')
+        self.add_attribute('html_movie_width', 500)    # width of frames for 'sprites'
         self.add_attribute('html_movie_dpi', 100)      # dpi of movie
 
         self.add_attribute('html_eagle',False)         # use EagleClaw titles on html pages?
@@ -106,10 +118,20 @@ class ClawPlotData(clawdata.ClawData):
         self.add_attribute('kml_time_scale',1.0) # Multiply by factor to get seconds
         self.add_attribute('kml_map_topo_to_latlong',None)
         self.add_attribute('kml_user_files',[])
+        # tiles for kml_tile_images made by 'python' (kmltiles.py) or 'gdal':
+        self.add_attribute('kml_tiler','python')
 
         self.add_attribute('gif_movie',False)          # make animated gif movie of frames
 
         self.add_attribute('mp4_movie',False)         # make animated mp4 movie of frames
+        # pipe frames to ffmpeg as they are plotted rather than making the
+        # mp4 movie from the png files afterwards (not when parallel):
+        self.add_attribute('mp4_stream',False)
+        self.add_attribute('mp4_codec','h264')        # ffmpeg codec for mp4 movie
+        self.add_attribute('mp4_crf',None)            # ffmpeg quality, None ==> default
+        # redraw the png files in a figure of size figsize for the mp4 movie,
+        # rather than encoding them at their own resolution:
+        self.add_attribute('mp4_resample',False)
         self.add_attribute('movie_name_prefix', 'movie_')
         self.add_attribute('setplot',False)            # Execute setplot.py in plot routine
 
@@ -166,7 +188,20 @@ class ClawPlotData(clawdata.ClawData):
         # Default to OMP_NUM_THREADS available if defined
         self.add_attribute('num_procs', None)
         self.add_attribute('proc_frames', None)
+        # Order in which frames are handed to idle processes:
+        # 'cost' ==> largest output files first,  None ==> frame order
+        self.add_attribute('parallel_order', 'cost')
+        # How the work is distributed when parallel is True:
+        # 'multiprocessing' ==> num_procs processes on this machine,
+        # 'mpi' ==> all MPI ranks, e.g. with mpirun -n 4 (requires mpi4py)
+        self.add_attribute('parallel_backend', 'multiprocessing')
+        # Time limit in seconds for plotting one frame or gauge in parallel,
+        # None ==> no limit:
+        self.add_attribute('parallel_timeout', None)
         self.add_attribute('_parallel_todo', None)
+        # quantiles in the statistics of each frame kept in the outdir by
+        # framestats.py, used e.g. for pcolor_cmin = 'auto_global':
+        self.add_attribute('framestats_quantiles', [0.01, 0.05, 0.5, 0.95, 0.99])
 
 
         self._next_FIG = 1000
@@ -176,6 +211,18 @@ class ClawPlotData(clawdata.ClawData):
         self._figname_from_num = {}
         self._otherfignames = []
 
+        # gauges and other figures already plotted by parallel workers:
+        self._parallel_gaugenos = None
+        self._parallel_otherfignames = []
+        # keep figure files from an earlier parallel run, see plotclaw:
+        self._parallel_resume = False
+        # limits for 'auto_global' found by framestats.global_limits:
+        self._framestats_limits = {}
+        # ffmpeg streams for mp4 movies by figno, and whether png files
+        # are still needed for those figures, see plotclaw_driver:
+        self._movie_streams = {}
+        self._movie_pngs = True
+
 
     def new_plotfigure(self, name=None, figno=None, type='each_frame'):
         """
@@ -0,0 +1,439 @@
+"""
+Module framepool for rendering the figures of a single frame in parallel.
+
+The frame is read once by a FrameLoader in the calling process and its q and
+aux arrays are copied into shared memory blocks.  Each figure of the frame is
+then plotted by a separate worker process, which attaches to the shared
+arrays without copying or re-reading the output files.  This reduces the
+time needed to produce all figures of one frame, e.g. when new frames are
+plotted as they are produced by a running computation.
+
+Usage:
+------
+    >>> from clawpack.visclaw.framepool import FigurePool
+    >>> with FigurePool(outdir='_output', plotdir='_plots') as pool:
+    ...     pool.plotframe(10)
+    ...     pool.plotframe(11)
+
+The worker processes call setplot once when the pool is created and are
+reused for every frame, so only the plotting itself is done per frame.
+
+Note that each worker only creates one figure per frame, so an afterframe
+function set in setplot is called once in each worker for the figure
+plotted there.
+"""
+
+import os
+import time
+import pickle
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+
+def _shallow_copy(obj):
+    """
+    Return a shallow copy of obj that bypasses the __copy__ methods of the
+    pyclaw classes, which copy the arrays as well.
+    """
+
+    new = object.__new__(type(obj))
+    new.__dict__.update(obj.__dict__)
+    return new
+
+
+def share_frame(framesoln):
+    """
+    Copy the q and aux arrays of every state of framesoln into shared
+    memory blocks.
+
+    Returns (skeleton, descriptors, blocks) where skeleton is a copy of
+    framesoln without the arrays that can be sent to other processes,
+    descriptors gives the name, shape, dtype and order of the block for
+    each array, to be passed to attach_frame, and blocks is the list of
+    SharedMemory objects, to be closed and unlinked with release_blocks
+    when no process needs the frame any longer.
+    """
+
+    skeleton = _shallow_copy(framesoln)
+    skeleton.claw_package = None     # modules cannot be sent to processes
+    skeleton.states = []
+    descriptors = []
+    blocks = []
+
+    for state in framesoln.states:
+        state_skeleton = _shallow_copy(state)
+        state_descriptor = {}
+        for name in ['q', 'aux']:
+            array = getattr(state, name)
+            setattr(state_skeleton, name, None)
+            if array is None:
+                continue
+            if array.flags['F_CONTIGUOUS']:
+                order = 'F'
+            else:
+                order = 'C'
+            block = shared_memory.SharedMemory(create=True,
+                                               size=max(array.nbytes, 1))
+            blocks.append(block)
+            shared = np.ndarray(array.shape, dtype=array.dtype,
+                                buffer=block.buf, order=order)
+            shared[...] = array
+            state_descriptor[name] = (block.name, array.shape,
+                                      array.dtype.str, order)
+        skeleton.states.append(state_skeleton)
+        descriptors.append(state_descriptor)
+
+    return skeleton, descriptors, blocks
+
+
+def _attach_block(name):
+    """
+    Attach to an existing shared memory block without taking ownership of
+    it, so that it is not unlinked when this process exits.
+    """
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # track argument is only available starting in Python 3.13.
+        # Before that the block is registered again with the resource
+        # tracker, which is harmless as long as worker processes share the
+        # tracker of the process that created the block, see FigurePool.
+        return shared_memory.SharedMemory(name=name)
+
+
+def attach_frame(skeleton, descriptors):
+    """
+    Attach to the shared memory blocks created by share_frame and set the
+    q and aux arrays of the states of skeleton to views of the shared data.
+
+    Returns (framesoln, blocks) where blocks must be kept alive while
+    framesoln is used and then closed with release_blocks(blocks, unlink=False).
+    """
+
+    framesoln = _shallow_copy(skeleton)
+    framesoln.states = []
+    blocks = []
+
+    for state_skeleton, state_descriptor in zip(skeleton.states, descriptors):
+        state = _shallow_copy(state_skeleton)
+        for name, (block_name, shape, dtype, order) in \
+                state_descriptor.items():
+            block = _attach_block(block_name)
+            blocks.append(block)
+            array = np.ndarray(shape, dtype=np.dtype(dtype),
+                               buffer=block.buf, order=order)
+            array.flags.writeable = False
+            setattr(state, name, array)
+        framesoln.states.append(state)
+
+    return framesoln, blocks
+
+
+def release_blocks(blocks, unlink=True):
+    """
+    Close the shared memory blocks and, in the process that created them,
+    also unlink them so the memory is freed.
+    """
+
+    for block in blocks:
+        block.close()
+        if unlink:
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class FrameLoader(object):
+    """
+    Service that reads each frame once and publishes it in shared memory
+    for worker processes.
+
+    publish(frameno, num_consumers) reads the frame from every outdir used
+    in plotdata, copies the patch arrays into shared memory blocks and also
+    stores the pickled patch metadata in a shared block.  The returned
+    handle is small and can be sent to any number of worker processes,
+    which call attach_published(handle) to get the Solution objects with
+    q and aux arrays that are views of the shared data (no copy), and then
+    detach_published(blocks) when done.
+
+    Each published frame has a reference count equal to num_consumers.
+    The process that published the frame calls release(frameno) when a
+    consumer is finished and the blocks are freed when the count reaches
+    zero.  close() frees all frames that are still published.
+    """
+
+    def __init__(self, plotdata):
+        self.plotdata = plotdata
+        self._frames = {}    # frameno -> [refcount, blocks]
+        self._handles = {}   # frameno -> handle returned by publish
+
+    def publish(self, frameno, num_consumers=1):
+        """
+        Read frame frameno and publish it in shared memory.
+        Returns the handle to be passed to attach_published.
+        """
+
+        plotdata = self.plotdata
+        plotdata.set_outdirs()
+        if len(plotdata._outdirs) == 0:
+            plotdata._outdirs = [plotdata.outdir]
+
+        if frameno in self._frames:
+            # already published, just add the new consumers:
+            self._frames[frameno][0] += num_consumers
+            return self._handles[frameno]
+
+        all_blocks = []
+        meta = []
+        try:
+            for outdir in plotdata._outdirs:
+                framesoln = plotdata.getframe(frameno, outdir, refresh=True)
+                skeleton, descriptors, blocks = share_frame(framesoln)
+                all_blocks += blocks
+
+                metadata = pickle.dumps((skeleton, descriptors),
+                                        protocol=pickle.HIGHEST_PROTOCOL)
+                meta_block = shared_memory.SharedMemory(create=True,
+                                                        size=len(metadata))
+                all_blocks.append(meta_block)
+                meta_block.buf[:len(metadata)] = metadata
+                meta.append((meta_block.name, len(metadata)))
+        except:
+            release_blocks(all_blocks)
+            raise
+
+        handle = (frameno, meta)
+        self._frames[frameno] = [num_consumers, all_blocks]
+        self._handles[frameno] = handle
+        return handle
+
+    def release(self, frameno):
+        """
+        Decrement the reference count of frame frameno and free its shared
+        memory blocks if no consumers are left.
+        """
+
+        entry = self._frames.get(frameno, None)
+        if entry is None:
+            print('*** Warning: Frame %s is not published' % frameno)
+            return
+        entry[0] -= 1
+        if entry[0] <= 0:
+            release_blocks(entry[1])
+            del self._frames[frameno]
+            del self._handles[frameno]
+
+    def published(self):
+        """
+        Return the list of frame numbers currently held in shared memory.
+        """
+        return sorted(self._frames.keys())
+
+    def close(self):
+        """
+        Free the shared memory for all frames still published.
+        """
+        for frameno in list(self._frames.keys()):
+            release_blocks(self._frames[frameno][1])
+        self._frames = {}
+        self._handles = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def attach_published(handle):
+    """
+    Attach to a frame published by FrameLoader.publish.
+
+    Returns (framesolns, blocks) where framesolns is the list of Solution
+    objects, one for each outdir, with arrays in shared memory.  The blocks
+    must be kept alive while the solutions are used and then passed to
+    detach_published.
+    """
+
+    frameno, meta = handle
+    framesolns = []
+    all_blocks = []
+    try:
+        for meta_name, meta_size in meta:
+            meta_block = _attach_block(meta_name)
+            all_blocks.append(meta_block)
+            skeleton, descriptors = \
+                    pickle.loads(bytes(meta_block.buf[:meta_size]))
+            framesoln, blocks = attach_frame(skeleton, descriptors)
+            framesolns.append(framesoln)
+            all_blocks += blocks
+    except:
+        release_blocks(all_blocks, unlink=False)
+        raise
+
+    return framesolns, all_blocks
+
+
+def detach_published(blocks):
+    """
+    Close the shared memory blocks attached by attach_published, without
+    freeing them.  Freeing is done by FrameLoader.release.
+    """
+    release_blocks(blocks, unlink=False)
+
+
+def _plot_figure(task):
+    """
+    Plot one figure of a published frame in a worker process.
+    Returns (frameno, figno, elapsed time).
+    """
+
+    from clawpack.visclaw import frametools, plotclaw
+
+    figno, handle = task
+    frameno = handle[0]
+    plotdata = plotclaw._worker_plotdata
+
+    t_start = time.time()
+    framesolns, blocks = attach_published(handle)
+    try:
+        plotdata.print_fignos = [figno]
+        frametools.plot_frame(framesolns, plotdata, frameno)
+    finally:
+        # drop references to the shared arrays before closing the blocks:
+        framesolns = None
+        detach_published(blocks)
+
+    return (frameno, figno, time.time() - t_start)
+
+
+class FigurePool(object):
+    """
+    Pool of worker processes that each plot one figure of a frame, with
+    the frame read once by a FrameLoader and shared between the workers.
+
+    Arguments are as in plotclaw.plotclaw.  If num_procs is None the value
+    of the environment variable OMP_NUM_THREADS is used, but no more
+    processes are started than there are each_frame figures.
+    """
+
+    def __init__(self, outdir='.', plotdir='_plots', setplot='setplot.py',
+                 format='ascii', num_procs=None):
+
+        from clawpack.visclaw.data import ClawPlotData
+        from clawpack.visclaw import frametools, plotclaw
+
+        if type(setplot) not in [str, bool]:
+            raise ValueError("FigurePool requires setplot to be given " \
+                             + "as the name of a file")
+
+        plotdata = ClawPlotData(file_format=format)
+        plotdata.outdir = os.path.abspath(outdir)
+        plotdata.plotdir = os.path.abspath(plotdir)
+        plotdata.setplot = setplot
+        plotdata.format = format
+        plotdata = frametools.call_setplot(setplot, plotdata, verbose=False)
+        plotdata.save_frames = False
+        plotdata = frametools.set_show(plotdata)
+        self.plotdata = plotdata
+        self.loader = FrameLoader(plotdata)
+
+        if not os.path.isdir(plotdata.plotdir):
+            os.makedirs(plotdata.plotdir)
+
+        self.fignos = []
+        for figname in plotdata._fignames:
+            plotfigure = plotdata.plotfigure_dict[figname]
+            if plotfigure._show and (plotfigure.type == 'each_frame'):
+                if (plotdata.print_fignos == 'all') or \
+                        (plotfigure.figno in plotdata.print_fignos):
+                    self.fignos.append(plotfigure.figno)
+
+        if num_procs is None:
+            num_procs = int(os.environ.get("OMP_NUM_THREADS", 1))
+        self.num_procs = max(1, min(num_procs, len(self.fignos)))
+
+        # start the resource tracker before the workers so that they all
+        # use the same one as the process that creates the shared blocks:
+        resource_tracker.ensure_running()
+
+        self._pool = multiprocessing.Pool(self.num_procs,
+                                          initializer=plotclaw._init_worker,
+                                          initargs=(plotdata.outdir,
+                                                    plotdata.plotdir,
+                                                    setplot, format))
+
+    def plotframe(self, frameno, verbose=False):
+        """
+        Read frame frameno once and plot all of its figures in parallel.
+        Returns the list of figure numbers plotted.
+        """
+
+        results = self.plotframes([frameno], verbose=verbose)
+        return [figno for (frameno, figno, elapsed) in results]
+
+    def plotframes(self, framenos, verbose=False):
+        """
+        Plot all figures of each frame in framenos.  The next frame is read
+        and published while the figures of the previous one are plotted,
+        so at most two frames are held in shared memory at any time.
+        Returns a list of (frameno, figno, elapsed time).
+        """
+
+        results = []
+        pending = []
+        try:
+            for frameno in framenos:
+                t_start = time.time()
+                handle = self.loader.publish(frameno, len(self.fignos))
+                if verbose:
+                    print('Frame %i: published in %.2f seconds' \
+                          % (frameno, time.time() - t_start))
+                for figno in self.fignos:
+                    pending.append(self._pool.apply_async(_plot_figure,
+                                                          ((figno, handle),)))
+                # wait for the previous frame before reading ahead:
+                while len(pending) > len(self.fignos):
+                    results.append(self._collect(pending.pop(0), verbose))
+            while len(pending) > 0:
+                results.append(self._collect(pending.pop(0), verbose))
+        finally:
+            # free any frames still published if a figure failed:
+            self.loader.close()
+
+        return results
+
+    def _collect(self, async_result, verbose):
+        """
+        Wait for one figure and release its reference to the frame.
+        """
+
+        frameno, figno, elapsed = async_result.get()
+        self.loader.release(frameno)
+        if verbose:
+            print('    Frame %i figure %i: %.2f seconds' \
+                  % (frameno, figno, elapsed))
+        return (frameno, figno, elapsed)
+
+    def close(self):
+        """
+        Shut down the worker processes and free any shared frames.
+        """
+        self._pool.close()
+        self._pool.join()
+        self.loader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.terminate()
+            self._pool.join()
+            self.loader.close()
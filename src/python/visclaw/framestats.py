@@ -0,0 +1,446 @@
+"""
+Module framestats: statistics of the output frames, stored in the outdir.
+
+frametools.var_minmax used to read all frames again each time it was
+called, e.g. from a setplot choosing color limits that are the same for all
+frames.  Here the minimum, maximum, mean and some quantiles of each variable
+are computed for each frame, for each AMR level and for all levels together,
+and kept in the file _framestats.json in the outdir.  The quantiles are
+approximate, from a QuantileSketch (see quantilesketch.py) that is stored
+too, so that quantiles over several frames are found by merging the
+sketches of the frames without reading them again.  With them are stored
+the modification time and size of the output files of the frame, and a frame
+is only read again when these have changed.  The frames that need to be
+read are read in a pool of processes.
+
+A variable is a component of q given by its number, or a function of
+current_data as the plot_var of a ClawPlotItem.  Functions are stored under
+their module and name, so a function in setplot.py that is changed should
+also be renamed (or the file removed); lambdas and nested functions are
+computed each time and not stored.
+
+A ClawPlotItem with e.g. pcolor_cmin = 'auto_global' uses global_limits for
+color limits that are the same in all frames, and with e.g.
+pcolor_cmin = 'global_p2' and pcolor_cmax = 'global_p98' the 2nd and 98th
+percentiles over all frames from global_quantiles, which a few extreme
+cells do not change.
+"""
+
+import os
+import json
+
+import numpy as np
+
+# File in the outdir in which the statistics are stored:
+stats_file = '_framestats.json'
+
+# Default quantiles stored for each variable:
+default_quantiles = [0.01, 0.05, 0.5, 0.95, 0.99]
+
+# ClawPlotItem attributes that may be set to 'auto_global':
+limit_attributes = ['pcolor_cmin', 'pcolor_cmax', 'imshow_cmin',
+                    'imshow_cmax', 'fill_cmin', 'fill_cmax']
+
+# Relative accuracy of the quantiles, see quantilesketch.QuantileSketch:
+relative_accuracy = 0.01
+
+_version = 2
+
+
+def var_key(var):
+    """
+    Return the name under which statistics of var are stored, the number of
+    a component of q as a string or 'module.name' for a function, or None
+    if var is a function that cannot be named this way.
+    """
+
+    if isinstance(var, (int, np.integer)):
+        return str(int(var))
+    name = getattr(var, '__qualname__', getattr(var, '__name__', None))
+    module = getattr(var, '__module__', None)
+    if (name is None) or (module is None) or ('<' in name):
+        return None
+    return '%s.%s' % (module, name)
+
+
+def frame_signature(outdir, frameno, file_prefix='fort'):
+    """
+    The latest modification time and the total size of the output files
+    of frame frameno, used to tell if the stored statistics are current.
+    """
+
+    from clawpack.visclaw import frametools
+
+    files = frametools.frame_files(frameno, outdir, file_prefix)
+    if len(files) == 0:
+        return None
+    return [max([os.path.getmtime(f) for f in files]),
+            sum([os.path.getsize(f) for f in files])]
+
+
+def _current_data(solution, state, frameno):
+    # the attributes of current_data that plot_var functions use, as set
+    # by frametools.plot_frame:
+    import clawpack.clawutil.data as clawdata
+
+    patch = state.patch
+    current_data = clawdata.ClawData()
+    current_data.add_attribute('user', {})
+    current_data.add_attribute('frameno', frameno)
+    current_data.add_attribute('t', solution.t)
+    current_data.add_attribute('framesoln', solution)
+    current_data.add_attribute('patch', patch)
+    current_data.add_attribute('level', patch.level)
+    current_data.add_attribute('q', state.q)
+    current_data.add_attribute('aux', state.aux)
+    current_data.add_attribute('var', None)
+    names = ['x', 'y', 'z']
+    for i, dim in enumerate(patch.dimensions):
+        current_data.add_attribute(names[i], patch.grid.p_centers[i])
+        current_data.add_attribute('d' + names[i], patch.delta[i])
+        current_data.add_attribute(names[i] + 'lower', dim.lower)
+        current_data.add_attribute(names[i] + 'upper', dim.upper)
+    return current_data
+
+
+def _values(var, solution, state, frameno):
+    if isinstance(var, (int, np.integer)):
+        values = state.q[var, ...]
+    else:
+        values = var(_current_data(solution, state, frameno))
+    return values
+
+
+def summarize(sketch, quantiles=default_quantiles):
+    """
+    The statistics of the values counted in sketch, a QuantileSketch: a
+    dictionary with the 'min', 'max', 'mean', the number of
+    values 'count', the list of 'quantiles' and the 'sketch' itself as
+    from QuantileSketch.to_dict, or with 'count' 0 only if it is empty.
+    """
+
+    if sketch.count == 0:
+        return {'count': 0}
+    return {'min': sketch.min,
+            'max': sketch.max,
+            'mean': sketch.sum / sketch.count,
+            'count': int(sketch.count),
+            'quantiles': [float(v) for v in sketch.quantile(quantiles)],
+            'sketch': sketch.to_dict()}
+
+
+def frame_stats(outdir, frameno, vars, file_prefix='fort',
+                file_format='ascii', quantiles=default_quantiles):
+    """
+    Read frame frameno from outdir and return its statistics, a dictionary
+    with the time 't', the 'signature' of its files (see frame_signature)
+    and 'vars', a dictionary with an entry for each var in vars, under
+    var_key(var), with an entry from summarize for each level (under str
+    of the level) and for all levels together (under 'all').
+    """
+
+    from clawpack.pyclaw import solution as pyclaw_solution
+    from clawpack.visclaw.quantilesketch import QuantileSketch, merge
+
+    signature = frame_signature(outdir, frameno, file_prefix)
+    solution = pyclaw_solution.Solution(frameno, path=outdir,
+                                        file_prefix=file_prefix,
+                                        file_format=file_format)
+    levels = sorted(set([state.patch.level for state in solution.states]))
+    stats = {}
+    for var in vars:
+        # one pass over the patches, without collecting their values:
+        sketches = dict((level, QuantileSketch(relative_accuracy))
+                        for level in levels)
+        for state in solution.states:
+            sketches[state.patch.level].add(_values(var, solution, state,
+                                                    frameno))
+        var_stats = dict((str(level), summarize(sketches[level], quantiles))
+                         for level in levels)
+        var_stats['all'] = summarize(merge(sketches.values()), quantiles)
+        stats[var_key(var) or repr(var)] = var_stats
+    return {'t': float(solution.t), 'signature': signature, 'vars': stats}
+
+
+def _frame_stats_task(args):
+    try:
+        return args[1], frame_stats(*args), None
+    except Exception as error:
+        return args[1], None, '%s: %s' % (type(error).__name__, error)
+
+
+def read_stats(outdir):
+    """
+    Return the statistics stored in outdir, a dictionary with the
+    'quantiles' used and 'frames', a dictionary with the results of
+    frame_stats under str of the frame numbers.
+    """
+
+    fname = os.path.join(outdir, stats_file)
+    try:
+        with open(fname) as f:
+            stats = json.load(f)
+    except (IOError, OSError, ValueError):
+        stats = {}
+    if stats.get('version') != _version:
+        stats = {'version': _version, 'frames': {}}
+    return stats
+
+
+def _write_stats(outdir, stats):
+    # replace the file only when the new one is complete:
+    fname = os.path.join(outdir, stats_file)
+    tmpname = '%s.%i.tmp' % (fname, os.getpid())
+    try:
+        with open(tmpname, 'w') as f:
+            json.dump(stats, f)
+        os.replace(tmpname, fname)
+    except (IOError, OSError) as error:
+        print('*** Warning: could not write %s: %s' % (fname, error))
+
+
+def update_stats(outdir, framenos, vars, file_prefix='fort',
+                 file_format='ascii', quantiles=default_quantiles,
+                 num_procs=1, verbose=True):
+    """
+    Return the statistics stored in outdir (see read_stats), first
+    computing them for the frames in framenos where they are missing or
+    out of date, in num_procs processes, and storing them.
+
+    Variables that cannot be stored (see var_key) are computed but only
+    returned.
+    """
+
+    import pickle
+    import multiprocessing
+
+    if file_prefix is None:
+        file_prefix = 'fort'
+    quantiles = [float(q) for q in quantiles]
+    stats = read_stats(outdir)
+    if stats.get('quantiles') != quantiles:
+        stats = {'version': _version, 'quantiles': quantiles, 'frames': {}}
+    frames = stats['frames']
+
+    todo = []
+    for frameno in framenos:
+        entry = frames.get(str(frameno))
+        signature = frame_signature(outdir, frameno, file_prefix)
+        if (entry is None) or (entry['signature'] != signature):
+            entry = {'signature': signature, 'vars': {}}
+            frames[str(frameno)] = entry
+        missing = [var for var in vars if (var_key(var) is None)
+                   or (var_key(var) not in entry['vars'])]
+        if len(missing) > 0:
+            todo.append((outdir, frameno, missing, file_prefix, file_format,
+                         quantiles))
+    if len(todo) == 0:
+        return stats
+
+    if verbose:
+        print('Computing statistics of %i frames' % len(todo))
+    num_procs = min(num_procs or 1, len(todo))
+    if multiprocessing.current_process().daemon:
+        # in a worker of parallel plotting, which cannot start processes
+        num_procs = 1
+    if num_procs > 1:
+        try:
+            pickle.dumps(vars)
+        except Exception:
+            # e.g. functions defined in a setplot module loaded from file
+            num_procs = 1
+    if num_procs > 1:
+        pool = multiprocessing.Pool(num_procs)
+        try:
+            results = pool.map(_frame_stats_task, todo, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_frame_stats_task(args) for args in todo]
+
+    temporary = {}
+    for frameno, result, error in results:
+        if error is not None:
+            print('*** Warning: statistics of frame %s not computed: %s'
+                  % (frameno, error))
+            continue
+        entry = frames[str(frameno)]
+        entry['t'] = result['t']
+        for key, var_stats in result['vars'].items():
+            if key in [var_key(var) for var in vars]:
+                entry['vars'][key] = var_stats
+            else:
+                temporary.setdefault(str(frameno), {})[key] = var_stats
+    _write_stats(outdir, stats)
+
+    for frameno, var_stats in temporary.items():
+        # returned but not stored:
+        frames[frameno] = dict(frames[frameno])
+        frames[frameno]['vars'] = dict(frames[frameno]['vars'], **var_stats)
+    return stats
+
+
+def var_stats(stats, var, frameno, level='all'):
+    """
+    The statistics of var in frame frameno for level (default all levels)
+    from stats as returned by update_stats, None if there are none.
+    """
+
+    key = var_key(var) or repr(var)
+    entry = stats['frames'].get(str(frameno), {}).get('vars', {}).get(key)
+    if entry is None:
+        return None
+    return entry.get(str(level))
+
+
+def _frame_entries(plotdata, var, outdir, level):
+    # statistics of var for level in each frame of the most recent run:
+    from clawpack.visclaw import frametools
+
+    file_prefix = plotdata.file_prefix or 'fort'
+    framenos = frametools.only_most_recent('all', outdir, file_prefix,
+                                           verbose=False)
+    stats = update_stats(outdir, framenos, [var], file_prefix,
+                         plotdata.format, plotdata.framestats_quantiles,
+                         plotdata.num_procs or 1)
+    entries = [var_stats(stats, var, frameno, level) for frameno in framenos]
+    return [entry for entry in entries
+            if (entry is not None) and (entry['count'] > 0)]
+
+
+def global_limits(plotdata, var, outdir=None, level='all'):
+    """
+    Return (vmin, vmax), the minimum and maximum of var over all frames of
+    the most recent run in outdir (default plotdata.outdir), for one level
+    or all levels, updating the stored statistics if needed with
+    plotdata.num_procs processes.
+
+    Used for color limits 'auto_global'.  The result is also kept in
+    plotdata so that each frame plotted does not check the files again.
+    """
+
+    outdir = os.path.abspath(outdir or plotdata.outdir)
+    cache = plotdata._framestats_limits
+    key = (outdir, var_key(var) or id(var), str(level), 'limits')
+    if key not in cache:
+        entries = _frame_entries(plotdata, var, outdir, level)
+        if len(entries) == 0:
+            print('*** Warning: no values of %s found for global limits'
+                  % (var_key(var) or var))
+            cache[key] = (None, None)
+        else:
+            cache[key] = (min([entry['min'] for entry in entries]),
+                          max([entry['max'] for entry in entries]))
+    return cache[key]
+
+
+def global_sketch(plotdata, var, outdir=None, level='all'):
+    """
+    Return a QuantileSketch of all values of var in all frames of the most
+    recent run in outdir (default plotdata.outdir), for one level or all
+    levels, merged from the sketches of the frames in the stored
+    statistics, which are updated if needed as for global_limits.
+    """
+
+    from clawpack.visclaw.quantilesketch import QuantileSketch, merge
+
+    outdir = os.path.abspath(outdir or plotdata.outdir)
+    entries = _frame_entries(plotdata, var, outdir, level)
+    return merge([QuantileSketch.from_dict(entry['sketch'])
+                  for entry in entries])
+
+
+def global_quantiles(plotdata, var, quantiles, outdir=None, level='all'):
+    """
+    Return the approximate quantiles of var (a number between 0 and 1 or
+    a list of them) over all frames, see global_sketch, e.g.
+
+        >>> vmin, vmax = global_quantiles(plotdata, 0, [0.02, 0.98])
+
+    for the 2nd and 98th percentiles of q[0].  The result is also kept in
+    plotdata as for global_limits.
+    """
+
+    outdir = os.path.abspath(outdir or plotdata.outdir)
+    cache = plotdata._framestats_limits
+    key = (outdir, var_key(var) or id(var), str(level), 'sketch')
+    if key not in cache:
+        cache[key] = global_sketch(plotdata, var, outdir, level)
+    result = cache[key].quantile(quantiles)
+    if np.ndim(result) > 0:
+        return [float(v) for v in result]
+    return result
+
+
+def is_global_limit(value):
+    """
+    True if value is a color limit computed by limit_value:
+    'auto_global' or 'global_p' followed by a percentile, e.g. 'global_p98'.
+    """
+
+    return isinstance(value, str) and \
+        ((value == 'auto_global') or value.startswith('global_p'))
+
+
+def limit_value(plotdata, var, value, upper, outdir=None):
+    """
+    The color limit of var given by value (see is_global_limit), the
+    minimum (upper False) or maximum (upper True) over all frames for
+    'auto_global' and the percentile for e.g. 'global_p98'.
+    """
+
+    if value == 'auto_global':
+        return global_limits(plotdata, var, outdir)[1 if upper else 0]
+    try:
+        percentile = float(value[len('global_p'):])
+    except ValueError:
+        raise ValueError("Unrecognized color limit %s, use 'auto_global' "
+                         "or e.g. 'global_p98'" % value)
+    return global_quantiles(plotdata, var, percentile / 100., outdir)
+
+
+def auto_global_vars(plotdata):
+    """
+    Return the list of plot_var of the items of plotdata that use
+    color limits 'auto_global' or percentiles over all frames, with the
+    outdir of each: a list of (outdir, plot_var).
+    """
+
+    found = []
+    for figname in plotdata._fignames:
+        plotfigure = plotdata.plotfigure_dict[figname]
+        for axesname in plotfigure._axesnames:
+            plotaxes = plotfigure.plotaxes_dict[axesname]
+            for itemname in plotaxes._itemnames:
+                plotitem = plotaxes.plotitem_dict[itemname]
+                limits = []
+                for name in limit_attributes:
+                    limits.append(getattr(plotitem, name, None))
+                    limits += list(getattr(plotitem, 'amr_' + name, None)
+                                   or [])
+                if any([is_global_limit(v) for v in limits]):
+                    outdir = plotitem.outdir or plotdata.outdir
+                    if (outdir, plotitem.plot_var) not in found:
+                        found.append((outdir, plotitem.plot_var))
+    return found
+
+
+def update_plot_stats(plotdata):
+    """
+    Compute the statistics needed for all items of plotdata using global
+    color limits (see is_global_limit), with plotdata.num_procs processes, e.g. before
+    parallel plotting so that each process finds them stored.
+    """
+
+    from clawpack.visclaw import frametools
+
+    file_prefix = plotdata.file_prefix or 'fort'
+    outdir_vars = {}
+    for outdir, var in auto_global_vars(plotdata):
+        outdir_vars.setdefault(outdir, []).append(var)
+    for outdir, vars in outdir_vars.items():
+        framenos = frametools.only_most_recent('all', outdir, file_prefix,
+                                               verbose=False)
+        update_stats(outdir, framenos, vars, file_prefix, plotdata.format,
+                     plotdata.framestats_quantiles, plotdata.num_procs or 1)
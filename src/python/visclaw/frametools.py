@@ -20,22 +20,44 @@ if sys.version_info[0] >= 3:
 import clawpack.clawutil.data as clawdata
 from clawpack.visclaw.data import ClawPlotData
 from clawpack.visclaw import setplot_default
-from clawpack.pyclaw import Solution
 
 import numpy as np
-import matplotlib.pyplot as plt
 from numpy import ma
-from clawpack.visclaw import colormaps
-from matplotlib.colors import Normalize, LightSource
 
-# This routine is from matplotlib/lib/matplotlib/colors.py
-# from v3.1.1.
-# https://matplotlib.org/3.1.1/_modules/matplotlib/colors.html
-def _vector_magnitude(arr):
-    sum_sq = 0
-    for i in range(arr.shape[-1]):
-        sum_sq += np.square(arr[..., i, np.newaxis])
-    return np.sqrt(sum_sq)
+# matplotlib and pyclaw are imported in the functions that use them, so that
+# importing this module does not import the full plotting stack.
+
+def hillshade_intensity(z, dx, dy, vertical_exaggeration=1.,
+                        azdeg=315, altdeg=45):
+    """
+    Return the illumination intensity, between 0 and 1, of the surface z
+    with rows along y and columns along x (e.g. var.T for a patch) lit
+    from the direction given by azdeg and altdeg as for
+    matplotlib.colors.LightSource.
+
+    This is LightSource.hillshade without its contrast stretch, so that the
+    values are consistent across all patches, computed in place in the
+    gradient arrays rather than through an array of normal vectors.
+    """
+
+    from matplotlib.colors import LightSource
+
+    lx, ly, lz = LightSource(azdeg=azdeg, altdeg=altdeg).direction
+    e_dy, e_dx = np.gradient(z, dy, dx)
+    if vertical_exaggeration != 1:
+        e_dx *= vertical_exaggeration
+        e_dy *= vertical_exaggeration
+
+    # intensity = (lz - lx*e_dx - ly*e_dy) / sqrt(1 + e_dx**2 + e_dy**2):
+    magnitude = np.hypot(e_dx, e_dy)
+    np.hypot(magnitude, 1., out=magnitude)
+    intensity = e_dx
+    intensity *= -lx
+    e_dy *= ly
+    intensity -= e_dy
+    intensity += lz
+    intensity /= magnitude
+    return np.clip(intensity, 0, 1, out=intensity)
 
 
 #==============================================================================
@@ -55,6 +77,7 @@ def plotframe(frameno, plotdata, verbose=False, simple=False, refresh=False):
     if verbose:  print('    Plotting frame %s ... '  % frameno)
 
     if simple:
+        from clawpack.pyclaw import Solution
         plotfun = plotdata.setplot
         sol = Solution(frameno,path=plotdata.outdir,file_format=plotdata.format)
         plotfun(sol)
@@ -87,6 +110,38 @@ def plotframe(frameno, plotdata, verbose=False, simple=False, refresh=False):
     plot_frame(framesolns, plotdata, frameno,verbose=verbose)
 
 
+#==============================================================================
+def plotframes_threaded(framenos, plotdata, num_threads=None, verbose=False):
+#==============================================================================
+    """
+    Plot and print the frames in the list framenos using a pool of
+    num_threads threads (by default the number of cpus), all sharing the
+    plotdata object already set up by setplot.
+
+    The frames are plotted with plotdata.use_pyplot = False, so functions
+    such as afteraxes must plot on current_data.axes rather than using
+    pyplot.  Returns the list of frame numbers plotted.
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    if num_threads is None:
+        num_threads = os.cpu_count()
+
+    use_pyplot = plotdata.use_pyplot
+    plotdata.use_pyplot = False
+    try:
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            futures = [executor.submit(plotframe, frameno, plotdata, verbose)
+                       for frameno in framenos]
+            for future in futures:
+                future.result()   # raises any exception in plotframe
+    finally:
+        plotdata.use_pyplot = use_pyplot
+
+    return list(framenos)
+
+
 #==============================================================================
 def plot_frame(framesolns,plotdata,frameno=0,verbose=False):
 #==============================================================================
@@ -96,8 +151,20 @@ def plot_frame(framesolns,plotdata,frameno=0,verbose=False):
     This routine checks input and then calls plotitemN for the
     proper space dimension.  Framesolns is a list of solutions at the same time
     but usually from different output directories.
+
+    If plotdata.use_pyplot is False (and not plotting interactively), the
+    figures are matplotlib Figure objects with an Agg canvas that are not
+    registered with pyplot, and all plotting is done on the axes objects.
+    Several frames can then be plotted at the same time from different
+    threads, see plotframes_threaded.  Functions such as afteraxes should
+    then plot on current_data.axes (the axes object), rather than using
+    pyplot functions that act on the current pyplot figure.
     """
 
+    import matplotlib.pyplot as plt
+
+    use_pyplot = plotdata.use_pyplot or (plotdata.mode() == 'iplotclaw')
+
     if type(framesolns) is not list:
         framesolns = [framesolns]
 
@@ -114,6 +181,8 @@ def plot_frame(framesolns,plotdata,frameno=0,verbose=False):
     current_data.add_attribute('var',None)
     current_data.add_attribute('plotaxes',None)
     current_data.add_attribute('plotfigure',None)
+    current_data.add_attribute('figure',None)   # matplotlib Figure and Axes
+    current_data.add_attribute('axes',None)     # being plotted on
 
     # call beforeframe if present, which might define additional
     # attributes in current_data or otherwise set up plotting for this
@@ -134,6 +203,7 @@ def plot_frame(framesolns,plotdata,frameno=0,verbose=False):
 
     plotted_fignos = []
     kml_fignos = []
+    figures = {}     # Figure object for each figno plotted
 
     plotdata = set_show(plotdata)   # set _show attributes for which figures
                                     # and axes should be shown.
@@ -168,11 +238,18 @@ def plot_frame(framesolns,plotdata,frameno=0,verbose=False):
             plotfigure.kwargs['figsize'] = plotfigure.figsize
 
         # create figure and set handle:
-        plotfigure._handle = plt.figure(num=figno, **plotfigure.kwargs)
+        if use_pyplot:
+            fig = plt.figure(num=figno, **plotfigure.kwargs)
+
+            #plt.ioff()
+            if plotfigure.clf_each_frame:
+                plt.clf()
+        else:
+            fig = new_figure(**plotfigure.kwargs)
 
-        #plt.ioff()
-        if plotfigure.clf_each_frame:
-            plt.clf()
+        plotfigure._handle = fig
+        figures[figno] = fig
+        current_data.figure = fig
 
         plotaxes_dict = plotfigure.plotaxes_dict
 
@@ -190,11 +267,14 @@ def plot_frame(framesolns,plotdata,frameno=0,verbose=False):
 
             # create the axes:
             axescmd = getattr(plotaxes,'axescmd','subplot(1,1,1)')
-            axescmd = 'plotaxes._handle = plt.%s' % axescmd
-            exec(axescmd)
+            ax = new_axes(fig, axescmd, use_pyplot)
+            plotaxes._handle = ax
 
             current_data.plotaxes = plotaxes
             current_data.plotfigure = plotaxes._plotfigure
+            current_data.axes = ax
+            item_pobjs = {}   # most recent plot object of each item
+            current_data.add_attribute('patchedges', {})
 
             beforeaxes = getattr(plotaxes,'beforeaxes',None)
             current_data = run_str_or_func(beforeaxes,current_data)
@@ -351,7 +431,12 @@ def plot_frame(framesolns,plotdata,frameno=0,verbose=False):
                                 plotitem_fun = plotitem1
                             elif num_dim == 2:
                                 plotitem_fun = plotitem2
-                            current_data = plotitem_fun(framesoln,plotitem,current_data,stateno)
+                            current_data.add_attribute('pobj',None)
+                            current_data = plotitem_fun(framesoln,plotitem,
+                                                current_data,stateno,ax=ax)
+                            pobj = getattr(current_data,'pobj',None)
+                            if pobj is not None:
+                                item_pobjs[itemname] = pobj
 
                             if verbose:
                                 print('      Plotted  plotitem ', itemname)
@@ -365,6 +450,9 @@ def plot_frame(framesolns,plotdata,frameno=0,verbose=False):
 
             # end of loop over framesolns
 
+            draw_patch_edges(ax, current_data.patchedges)
+            current_data.add_attribute('patchedges', None)
+
 
             for itemname in plotaxes._itemnames:
                 plotitem = plotaxes.plotitem_dict[itemname]
@@ -377,7 +465,8 @@ def plot_frame(framesolns,plotdata,frameno=0,verbose=False):
                         # Build colorbar for Google Earth (now done in setplot.py)
                         pass
                     elif plotitem.has_attribute('add_colorbar') and plotitem.add_colorbar:
-                        pobj = plotitem._current_pobj # most recent plot object
+                        # most recent plot object:
+                        pobj = item_pobjs.get(itemname, plotitem._current_pobj)
                         # set dictionary values for keywords explicitly set:
                         if plotitem.colorbar_shrink is not None:
                             plotitem.colorbar_kwargs['shrink'] = \
@@ -389,7 +478,10 @@ def plot_frame(framesolns,plotdata,frameno=0,verbose=False):
                             plotitem.colorbar_kwargs['extend'] = \
                                     plotitem.colorbar_extend
 
-                        cbar = plt.colorbar(pobj, **plotitem.colorbar_kwargs)
+                        colorbar_kwargs = dict(plotitem.colorbar_kwargs)
+                        if 'cax' not in colorbar_kwargs:
+                            colorbar_kwargs.setdefault('ax', ax)
+                        cbar = fig.colorbar(pobj, **colorbar_kwargs)
 
                         if plotitem.has_attribute('colorbar_tick_labels'):
                             if plotitem.colorbar_tick_labels is not None:
@@ -449,22 +541,22 @@ def plot_frame(framesolns,plotdata,frameno=0,verbose=False):
 
                 if plotaxes.title_fontsize is not None:
                     plotaxes.title_kwargs['fontsize'] = plotaxes.title_fontsize
-                plt.title(title_str, **plotaxes.title_kwargs)
+                ax.set_title(title_str, **plotaxes.title_kwargs)
 
             # call an afteraxes function if present:
             afteraxes =  getattr(plotaxes, 'afteraxes', None)
             current_data = run_str_or_func(afteraxes,current_data)
 
             if plotaxes.scaled:
-                plt.axis('scaled')
+                ax.axis('scaled')
             elif plotaxes.image:
-                plt.axis('image')
+                ax.axis('image')
 
             # set axes limits:
             if (plotfigure.use_for_kml and plotfigure.kml_use_figure_limits):
                 if (plotfigure.kml_xlimits is not None) & (type(plotfigure.kml_xlimits) is not str):
                     try:
-                        plt.xlim(plotfigure.kml_xlimits[0], plotfigure.kml_xlimits[1])
+                        ax.set_xlim(plotfigure.kml_xlimits[0], plotfigure.kml_xlimits[1])
                     except:
                         print(" ")
                         print("*** KML error : Set plotfigure.kml_xlimits")
@@ -473,7 +565,7 @@ def plot_frame(framesolns,plotdata,frameno=0,verbose=False):
 
                 if (plotfigure.kml_ylimits is not None) & (type(plotfigure.kml_ylimits) is not str):
                     try:
-                        plt.ylim(plotfigure.kml_ylimits[0], plotfigure.kml_ylimits[1])
+                        ax.set_ylim(plotfigure.kml_ylimits[0], plotfigure.kml_ylimits[1])
                     except:
                         print(" ")
                         print("*** KML error : Set plotfigure.kml_ylimits")
@@ -482,45 +574,45 @@ def plot_frame(framesolns,plotdata,frameno=0,verbose=False):
             else:
                 if (plotaxes.xlimits is not None) & (type(plotaxes.xlimits) is not str):
                     try:
-                        plt.xlim(plotaxes.xlimits[0], plotaxes.xlimits[1])
+                        ax.set_xlim(plotaxes.xlimits[0], plotaxes.xlimits[1])
                     except:
                         pass  # let axis be set automatically
                 if (plotaxes.ylimits is not None) & (type(plotaxes.ylimits) is not str):
                     try:
-                        plt.ylim(plotaxes.ylimits[0], plotaxes.ylimits[1])
+                        ax.set_ylim(plotaxes.ylimits[0], plotaxes.ylimits[1])
                     except:
                         pass  # let axis be set automatically
 
             if plotaxes.useOffset is not None:
-                plt.ticklabel_format(useOffset = plotaxes.useOffset)
+                ax.ticklabel_format(useOffset = plotaxes.useOffset)
 
             if plotaxes.grid:
-                plt.grid(**plotaxes.grid_kwargs)
+                ax.grid(**plotaxes.grid_kwargs)
 
             if plotaxes.xticks_fontsize is not None:
                 plotaxes.xticks_kwargs['fontsize'] = plotaxes.xticks_fontsize
             if plotaxes.xticks_kwargs != {}:
-                plt.xticks(**plotaxes.xticks_kwargs)
+                set_ticks(ax, 'x', **plotaxes.xticks_kwargs)
 
             if plotaxes.yticks_fontsize is not None:
                 plotaxes.yticks_kwargs['fontsize'] = plotaxes.yticks_fontsize
             if plotaxes.yticks_kwargs != {}:
-                plt.yticks(**plotaxes.yticks_kwargs)
+                set_ticks(ax, 'y', **plotaxes.yticks_kwargs)
 
             if plotaxes.xlabel is not None:
                 if plotaxes.xlabel_fontsize is not None:
                     plotaxes.xlabel_kwargs['fontsize'] = plotaxes.xlabel_fontsize
-                plt.xlabel(plotaxes.xlabel, **plotaxes.xlabel_kwargs)
+                ax.set_xlabel(plotaxes.xlabel, **plotaxes.xlabel_kwargs)
             if plotaxes.ylabel is not None:
                 if plotaxes.ylabel_fontsize is not None:
                     plotaxes.ylabel_kwargs['fontsize'] = plotaxes.ylabel_fontsize
-                plt.ylabel(plotaxes.ylabel, **plotaxes.ylabel_kwargs)
+                ax.set_ylabel(plotaxes.ylabel, **plotaxes.ylabel_kwargs)
 
             if plotaxes.aspect_latitude is not None:
-                plt.gca().set_aspect(1./np.cos(plotaxes.aspect_latitude \
+                ax.set_aspect(1./np.cos(plotaxes.aspect_latitude \
                             * np.pi/180))
             elif plotaxes.aspect is not None:
-                plt.gca().set_aspect(plotaxes.aspect)
+                ax.set_aspect(plotaxes.aspect)
 
             # end of loop over plotaxes
         # end of loop over plotfigures
@@ -532,9 +624,10 @@ def plot_frame(framesolns,plotdata,frameno=0,verbose=False):
 
     if plotdata.mode() == 'iplotclaw':
         plt.ion()
-    for figno in plotted_fignos:
-        plt.figure(figno)
-        plt.draw()
+    if use_pyplot:
+        for figno in plotted_fignos:
+            plt.figure(figno)
+            plt.draw()
 
     if verbose:
         print('    Done with plotframe for frame %i at time %g' % (frameno,t))
@@ -546,18 +639,30 @@ def plot_frame(framesolns,plotdata,frameno=0,verbose=False):
         for figname in plotdata._fignames:
             plotfigure = plotdata.plotfigure_dict[figname]
             figno = plotfigure.figno
-            if figno in plotted_fignos:
-                if figno in kml_fignos:
-                    printfig(frameno=frameno, figno=figno,\
-                             file_prefix=plotdata.file_prefix,\
-                             format=plotdata.print_format, plotdir=plotdata.plotdir,\
-                             verbose=verbose,kml_fig=True,kml_dpi=plotfigure.kml_dpi,
-                             kml_figsize=plotfigure.kml_figsize)
-                else:
-                    printfig(frameno=frameno, figno=figno,\
-                             file_prefix=plotdata.file_prefix,\
-                             format=plotdata.print_format, plotdir=plotdata.plotdir,\
-                             verbose=verbose,kml_fig=False)
+            if figno not in plotted_fignos:
+                continue
+            stream = getattr(plotdata, '_movie_streams', {}).get(figno, None)
+            if stream is not None:
+                # frame of an mp4 movie piped to ffmpeg, see plotclaw_driver
+                stream.write_figure(figures[figno])
+                if not plotdata._movie_pngs:
+                    if use_pyplot:
+                        plt.close(figures[figno])
+                    continue
+            if figno in kml_fignos:
+                printfig(frameno=frameno, figno=figno,\
+                         file_prefix=plotdata.file_prefix,\
+                         format=plotdata.print_format, plotdir=plotdata.plotdir,\
+                         verbose=verbose,kml_fig=True,kml_dpi=plotfigure.kml_dpi,
+                         kml_figsize=plotfigure.kml_figsize,
+                         fig=figures[figno], use_pyplot=use_pyplot)
+            else:
+                printfig(frameno=frameno, figno=figno,\
+                         file_prefix=plotdata.file_prefix,\
+                         format=plotdata.print_format, plotdir=plotdata.plotdir,\
+                         verbose=verbose,kml_fig=False,
+                         fig=figures[figno], use_pyplot=use_pyplot,
+                         reduced_widths=plotdata.html_reduced_widths)
 
     return current_data
     # end of plotframe
@@ -567,6 +672,10 @@ def run_str_or_func(str_or_func,current_data):
     if str_or_func is None:
         return current_data
     if isinstance(str_or_func, str):
+        # strings may use plt and colormaps as when these were imported
+        # at the top of this module:
+        import matplotlib.pyplot as plt
+        from clawpack.visclaw import colormaps
         exec(str_or_func)
     else:
         output = str_or_func(current_data)
@@ -575,6 +684,66 @@ def run_str_or_func(str_or_func,current_data):
     return current_data
 
 
+def new_figure(**kwargs):
+    """
+    Return a matplotlib Figure with an Agg canvas that is not managed by
+    pyplot, so it is not shown, does not need to be closed, and can be
+    used in a thread other than the main thread.  kwargs are passed to
+    Figure, e.g. figsize, dpi, facecolor.
+    """
+
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    kwargs = dict(kwargs)
+    kwargs.pop('num', None)
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def new_axes(fig, axescmd='subplot(1,1,1)', use_pyplot=True):
+    """
+    Create the axes specified by axescmd, a string such as 'subplot(2,1,1)'
+    or 'axes([0.1,0.1,0.8,0.8])' as used for plotaxes.axescmd, and return
+    the Axes object.  If use_pyplot is False, subplot and axes are evaluated
+    as fig.add_subplot and fig.add_axes.
+    """
+
+    if use_pyplot:
+        import matplotlib.pyplot as plt
+        return eval('plt.%s' % axescmd)
+
+    def axes(*args, **kwargs):
+        if len(args) == 0 and 'rect' not in kwargs:
+            return fig.add_subplot(1,1,1, **kwargs)
+        return fig.add_axes(*args, **kwargs)
+
+    def subplot2grid(shape, loc, rowspan=1, colspan=1, **kwargs):
+        gs = fig.add_gridspec(shape[0], shape[1])
+        return fig.add_subplot(gs[loc[0]:loc[0]+rowspan,
+                                  loc[1]:loc[1]+colspan], **kwargs)
+
+    namespace = {'subplot': fig.add_subplot, 'axes': axes,
+                 'subplot2grid': subplot2grid, 'np': np}
+    return eval(axescmd, namespace)
+
+
+def set_ticks(ax, axis='x', ticks=None, labels=None, minor=False, **kwargs):
+    """
+    Set the ticks of the x or y axis of ax, with the arguments of
+    plt.xticks or plt.yticks, e.g. as set in plotaxes.xticks_kwargs.
+    """
+
+    if ticks is not None:
+        getattr(ax, 'set_%sticks' % axis)(ticks, minor=minor)
+    if labels is not None:
+        getattr(ax, 'set_%sticklabels' % axis)(labels, minor=minor, **kwargs)
+    else:
+        for label in getattr(ax, 'get_%sticklabels' % axis)(minor=minor):
+            label.update(kwargs)
+
+
 def params_dict(plotitem, base_params, level_params, level):
     """
     Create a dictionary containing the plot parameters.
@@ -600,7 +769,7 @@ def params_dict(plotitem, base_params, level_params, level):
     return pp
 
 #==================================================================
-def plotitem1(framesoln, plotitem, current_data, stateno):
+def plotitem1(framesoln, plotitem, current_data, stateno, ax=None):
 #==================================================================
     """
     Make a 1d plot for a single plot item for the solution in framesoln.
@@ -611,8 +780,13 @@ def plotitem1(framesoln, plotitem, current_data, stateno):
     modified current_data for use in other plotitems or in afteraxes or
     afterframe.
 
+    The item is plotted on the axes ax, by default the current pyplot axes.
     """
 
+    if ax is None:
+        import matplotlib.pyplot as plt
+        ax = plt.gca()
+
     plotdata = plotitem._plotdata
 
     state = framesoln.states[stateno]
@@ -734,8 +908,8 @@ def plotitem1(framesoln, plotitem, current_data, stateno):
                 else:
                     size = 1
 
-                # use plt.scatter instead.
-                pobj=plt.scatter(
+                # use scatter instead.
+                pobj=ax.scatter(
                     p_centers,var,
                     s=size,
                     c=color_var,
@@ -744,18 +918,18 @@ def plotitem1(framesoln, plotitem, current_data, stateno):
                     norm=pp['plot_norm'],
                     **pp['kwargs'])
             else:
-                pobj=plt.plot(p_centers,var,pp['plotstyle'],**pp['kwargs'])
+                pobj=ax.plot(p_centers,var,pp['plotstyle'],**pp['kwargs'])
 
         elif pp['plot_type'] == '1d_semilogy':
-            pobj=plt.semilogy(p_centers,var,pp['plotstyle'], **pp['kwargs'])
+            pobj=ax.semilogy(p_centers,var,pp['plotstyle'], **pp['kwargs'])
 
         elif pp['plot_type'] == '1d_fill_between':
             if pp['fill_where']:
                 pp['fill_where'] = pp['fill_where'].replace('plot_var','var')
                 pp['fill_where'] = pp['fill_where'].replace('plot_var2','var2')
-                pobj=plt.fill_between(p_centers,var,var2,pp['fill_where'],**pp['kwargs'])
+                pobj=ax.fill_between(p_centers,var,var2,pp['fill_where'],**pp['kwargs'])
             else:
-                pobj=plt.fill_between(p_centers,var,var2,**pp['kwargs'])
+                pobj=ax.fill_between(p_centers,var,var2,**pp['kwargs'])
 
         elif pp['plot_type'] == '1d_pwconst':
 
@@ -768,13 +942,13 @@ def plotitem1(framesoln, plotitem, current_data, stateno):
                 (2*medges,))
             xc_edges2 = xc_edges2[1:-1]  # discard first and last
             var2 = np.reshape(np.vstack((var,var)).T, (2*mcells,))
-            pobj=plt.plot(xc_edges2,var2,pp['plotstyle'],**pp['kwargs'])
+            pobj=ax.plot(xc_edges2,var2,pp['plotstyle'],**pp['kwargs'])
 
         elif pp['plot_type'] == '1d_gauge_trace':
 
             gauget = gaugesoln.t
             gaugeq = gaugesoln.q[3,:]
-            pobj=plt.plot(gauget, gaugeq)
+            pobj=ax.plot(gauget, gaugeq)
 
             # interpolate to the current time t:
             try:
@@ -785,7 +959,7 @@ def plotitem1(framesoln, plotitem, current_data, stateno):
             except IndexError:
                 qt = gaugeq[0]
                 print("Warning: t out of range")
-            plt.plot([t], [qt], 'ro')
+            ax.plot([t], [qt], 'ro')
 
         elif pp['plot_type'] == '1d_empty':
             # no plot to create (user might make one in afteritem or
@@ -800,6 +974,7 @@ def plotitem1(framesoln, plotitem, current_data, stateno):
     if pp['afterpatch']:
         if isinstance(pp['afterpatch'], str):
             # a string to be executed
+            import matplotlib.pyplot as plt
             exec(pp['afterpatch'])
         else:
             # assume it's a function
@@ -821,6 +996,7 @@ def plotitem1(framesoln, plotitem, current_data, stateno):
 
     try:
         plotitem._current_pobj = pobj
+        current_data.add_attribute('pobj',pobj)
     except NameError:
         pass # if no plot was done
 
@@ -828,7 +1004,107 @@ def plotitem1(framesoln, plotitem, current_data, stateno):
 
 
 #==================================================================
-def plotitem2(framesoln, plotitem, current_data, stateno):
+def patch_outline(X_edge, Y_edge):
+#==================================================================
+    """
+    The boundary of a patch with cell corners X_edge, Y_edge as one closed
+    polyline, an array of (x,y) points, for a LineCollection.
+    """
+
+    X_edge = ma.filled(ma.asarray(X_edge, dtype=float), np.nan)
+    Y_edge = ma.filled(ma.asarray(Y_edge, dtype=float), np.nan)
+    x = np.concatenate([X_edge[:,0], X_edge[-1,1:], X_edge[-2::-1,-1],
+                        X_edge[0,-2::-1]])
+    y = np.concatenate([Y_edge[:,0], Y_edge[-1,1:], Y_edge[-2::-1,-1],
+                        Y_edge[0,-2::-1]])
+    return np.column_stack([x, y])
+
+
+def draw_patch_edges(ax, patchedges):
+    """
+    Draw the patch outlines collected by plotitem2 in the dictionary
+    patchedges, with values (color, linewidth, list of outlines), as one
+    LineCollection for each.
+    """
+
+    from matplotlib.collections import LineCollection
+
+    for color, linewidth, outlines in patchedges.values():
+        if len(outlines) > 0:
+            ax.add_collection(LineCollection(outlines, colors=color,
+                                             linewidths=linewidth))
+
+
+_CellEdges = None
+
+def _cell_edges_class():
+    # the LineCollection subclass is made on first use, so that importing
+    # this module does not import matplotlib
+    global _CellEdges
+    if _CellEdges is None:
+        from matplotlib.collections import LineCollection
+
+        class CellEdges(LineCollection):
+            """
+            The cell edges of a patch, not drawn when the cells are less
+            than min_pixels pixels wide in the figure, where the lines
+            would only darken the plot and take long to draw.
+            """
+
+            def __init__(self, segments, spacing, min_pixels=1, **kwargs):
+                LineCollection.__init__(self, segments, **kwargs)
+                self.spacing = spacing
+                self.min_pixels = min_pixels
+
+            def draw(self, renderer):
+                if self.axes is not None:
+                    corners = self.axes.transData.transform(
+                                    [[0., 0.], list(self.spacing)])
+                    pixels = np.abs(corners[1] - corners[0])
+                    if np.min(pixels) < self.min_pixels:
+                        return
+                LineCollection.draw(self, renderer)
+
+        _CellEdges = CellEdges
+    return _CellEdges
+
+
+def cell_edges(X_edge, Y_edge, mapped=True, **kwargs):
+    """
+    Return the edges of all cells of a patch with cell corners X_edge,
+    Y_edge as a single collection to add to the axes, rather than a line or
+    pcolor edges for each.  For a grid that is not mapped the lines are
+    straight and only their ends are used.  The lines are left out when
+    drawing if they would be denser than the pixels of the figure.
+    kwargs are passed to LineCollection.
+    """
+
+    X_edge = ma.filled(ma.asarray(X_edge, dtype=float), np.nan)
+    Y_edge = ma.filled(ma.asarray(Y_edge, dtype=float), np.nan)
+    if mapped:
+        points = np.stack([X_edge, Y_edge], axis=-1)
+        segments = list(points) + list(points.transpose(1,0,2))
+        spacing = np.nanmedian(np.hypot(np.diff(X_edge, axis=0),
+                                        np.diff(Y_edge, axis=0)))
+        spacing = min(spacing, np.nanmedian(np.hypot(np.diff(X_edge, axis=1),
+                                                     np.diff(Y_edge, axis=1))))
+        spacing = (spacing, spacing)
+    else:
+        x = X_edge[:,0]
+        y = Y_edge[0,:]
+        segments = np.empty((len(x) + len(y), 2, 2))
+        segments[:len(x),:,0] = x[:,None]
+        segments[:len(x),0,1] = y[0]
+        segments[:len(x),1,1] = y[-1]
+        segments[len(x):,0,0] = x[0]
+        segments[len(x):,1,0] = x[-1]
+        segments[len(x):,:,1] = y[:,None]
+        spacing = (np.min(np.abs(np.diff(x))), np.min(np.abs(np.diff(y))))
+    return _cell_edges_class()(segments, spacing, **kwargs)
+
+
+#==================================================================
+def plotitem2(framesoln, plotitem, current_data, stateno, ax=None):
 #==================================================================
     """
     Make a 2d plot for a single plot item for the solution in framesoln.
@@ -839,8 +1115,16 @@ def plotitem2(framesoln, plotitem, current_data, stateno):
     modified current_data for use in other plotitems or in afteraxes or
     afterframe.
 
+    The item is plotted on the axes ax, by default the current pyplot axes.
     """
 
+    from matplotlib.colors import Normalize
+    from clawpack.visclaw import colormaps
+
+    if ax is None:
+        import matplotlib.pyplot as plt
+        ax = plt.gca()
+
     plotdata = plotitem._plotdata
 
     state = framesoln.states[stateno]
@@ -883,6 +1167,18 @@ def plotitem2(framesoln, plotitem, current_data, stateno):
         # if this item does not have a mapping, check for a global mapping:
         pp['mapc2p'] = getattr(plotdata, 'mapc2p', None)
 
+    # color limits that are the same in all frames, 'auto_global' or
+    # percentiles such as 'global_p98':
+    for name in ['pcolor_cmin','pcolor_cmax','imshow_cmin','imshow_cmax',
+                 'fill_cmin','fill_cmax']:
+        if isinstance(pp[name], str) and (pp[name] != 'auto'):
+            from clawpack.visclaw import framestats
+            if framestats.is_global_limit(pp[name]):
+                pp[name] = framestats.limit_value(plotdata, pp['plot_var'],
+                                                  pp[name],
+                                                  name.endswith('max'),
+                                                  plotitem.outdir)
+
     # turn patch background color into a colormap for use with pcolor cmd:
     pp['patch_bgcolormap'] = colormaps.make_colormap({0.: pp['patch_bgcolor'], \
                                              1.: pp['patch_bgcolor']})
@@ -917,35 +1213,34 @@ def plotitem2(framesoln, plotitem, current_data, stateno):
 
     # pcolormesh is much faster but cannot be used with masked coordinate arrays
     if ma.isMaskedArray(X_edge) or ma.isMaskedArray(Y_edge):
-        pc_cmd = 'pcolor'
-        pc_mth = plt.pcolor
+        pc_mth = ax.pcolor
     else:
-        pc_cmd = 'pcolormesh'
-        pc_mth = plt.pcolormesh
+        pc_mth = ax.pcolormesh
+
+    def add_cell_edges(pobj):
+        # cell edges as one collection, at the level of the patch plot so
+        # that finer patches plotted later cover them:
+        ax.add_collection(cell_edges(X_edge, Y_edge, pp['MappedGrid'],
+                                     colors=pp['celledges_color'],
+                                     linewidths=pp['celledges_linewidth'],
+                                     zorder=pobj.get_zorder()))
 
     if pp['plot_type'] == '2d_pcolor':
 
-        pcolor_cmd = "plotitem._current_pobj = plt."+pc_cmd+"(X_edge, Y_edge, var, \
-                        cmap=pp['pcolor_cmap']"
+        pcolor_kwargs = {'cmap': pp['pcolor_cmap'], 'shading': 'flat'}
 
-        if pp['celledges_show']:
-            pcolor_cmd += ", edgecolors=pp['celledges_color']"
-            pcolor_cmd += ", linewidths=pp['celledges_linewidth']"
-        else:
-            pcolor_cmd += ", shading='flat'"
-        
         if 'rasterized' not in pp['kwargs']:
-            pcolor_cmd += ", rasterized=True"
-        
-        pcolor_cmd += ", **pp['kwargs'])"
+            pcolor_kwargs['rasterized'] = True
 
         if not var_all_masked:
-            exec(pcolor_cmd)
-
+            pobj = pc_mth(X_edge, Y_edge, var, **pcolor_kwargs,
+                          **pp['kwargs'])
+            if pp['celledges_show']:
+                add_cell_edges(pobj)
 
             if (pp['pcolor_cmin'] not in ['auto',None]) and \
                      (pp['pcolor_cmax'] not in ['auto',None]):
-                plt.clim(pp['pcolor_cmin'], pp['pcolor_cmax'])
+                pobj.set_clim(pp['pcolor_cmin'], pp['pcolor_cmax'])
         else:
             #print '*** Not doing pcolor on totally masked array'
             pass
@@ -964,22 +1259,15 @@ def plotitem2(framesoln, plotitem, current_data, stateno):
                 color_norm = pp['imshow_norm']
          
             xylimits = (X_edge[0,0],X_edge[-1,-1],Y_edge[0,0],Y_edge[-1,-1])
-            pobj = plt.imshow(np.flipud(var.T), extent=xylimits, \
+            # var.T is a view, with rows along y from the bottom:
+            pobj = ax.imshow(var.T, origin='lower', extent=xylimits, \
                     cmap=pp['imshow_cmap'], interpolation='nearest', \
                     norm=color_norm, \
                     alpha=pp["imshow_alpha"]
                     )
 
             if pp['celledges_show']:
-                # This draws cell edges for this level.
-                # Note that these will still be visible when imshow is used
-                # for finer levels, so imshow doesn't look as good as pcolor
-                # when you only want to show celledges on coarse levels.
-                # There doesn't seem to be an easy way to fix this.
-                pobj = plt.plot(X_edge, Y_edge, color=pp['celledges_color'], 
-                                           linewidth=pp['celledges_linewidth'])
-                pobj = plt.plot(X_edge.T, Y_edge.T, color=pp['celledges_color'], 
-                                           linewidth=pp['celledges_linewidth'])
+                add_cell_edges(pobj)
 
         else:
             #print '*** Not doing imshow on totally masked array'
@@ -1003,80 +1291,71 @@ def plotitem2(framesoln, plotitem, current_data, stateno):
                 levels_set = True
 
 
-        if pp['celledges_show']:
-            pobj = pc_mth(X_edge, Y_edge, np.zeros(var.shape), \
-                    cmap=pp['patch_bgcolormap'], 
-                    edgecolors=pp['celledges_color'],
-                    linewidths=pp['celledges_linewidth'])
-        elif pp['patch_bgcolor'] != 'w':
+        if pp['celledges_show'] or (pp['patch_bgcolor'] != 'w'):
             pobj = pc_mth(X_edge, Y_edge, np.zeros(var.shape), \
                     cmap=pp['patch_bgcolormap'], edgecolors='None')
+            if pp['celledges_show']:
+                add_cell_edges(pobj)
 
         if pp['plot_type'] == '2d_contour':
-            # create the contour command:
-            contourcmd = "pobj = plt.contour(X_center, Y_center, var, "
+            # set the contour arguments:
             if levels_set:
-                contourcmd += "pp['contour_levels']"
+                levels = pp['contour_levels']
             else:
-                contourcmd += "pp['contour_nlevels']"
+                levels = pp['contour_nlevels']
 
+            contour_kwargs = {}
             if pp['contour_cmap']:
                 if (pp['kwargs'] is None) or ('cmap' not in pp['kwargs']):
-                    contourcmd += ", cmap = pp['contour_cmap']"
+                    contour_kwargs['cmap'] = pp['contour_cmap']
             elif pp['contour_colors']:
                 if (pp['kwargs'] is None) or ('colors' not in pp['kwargs']):
-                    contourcmd += ", colors = pp['contour_colors']"
-
-            contourcmd += ", **pp['kwargs'])"
+                    contour_kwargs['colors'] = pp['contour_colors']
 
             if (pp['contour_show'] and not var_all_masked):
                 # may suppress plotting at coarse levels
-                exec(contourcmd)
+                pobj = ax.contour(X_center, Y_center, var, levels,
+                                  **contour_kwargs, **pp['kwargs'])
 
 
         if pp['plot_type'] == '2d_contourf':
 
-            # create the contourf command:
-            contourcmd = "pobj = plt.contourf(X_center, Y_center, var, "
+            # set the contourf arguments:
             if levels_set:
-                contourcmd += "pp['contour_levels']"
+                levels = pp['contour_levels']
             else:
-                contourcmd += "pp['contour_nlevels']"
+                levels = pp['contour_nlevels']
 
+            contour_kwargs = {}
             if pp['fill_cmap']:
                 if (pp['kwargs'] is None) or ('cmap' not in pp['kwargs']):
-                    contourcmd += ", cmap = pp['fill_cmap']"
+                    contour_kwargs['cmap'] = pp['fill_cmap']
             elif pp['fill_colors']:
                 if (pp['kwargs'] is None) or ('colors' not in pp['kwargs']):
-                    contourcmd += ", colors = pp['fill_colors']"
+                    contour_kwargs['colors'] = pp['fill_colors']
 
 
             if (pp['kwargs'] is None) or ('extend' not in pp['kwargs']):
-                contourcmd += ", extend = 'both'"
-
-            contourcmd += ", **pp['kwargs'])"
+                contour_kwargs['extend'] = 'both'
 
 
             if (not var_all_masked):
                 # may suppress plotting at coarse levels
-                exec(contourcmd)
+                pobj = ax.contourf(X_center, Y_center, var, levels,
+                                   **contour_kwargs, **pp['kwargs'])
 
                 if pp['fill_cmap'] and \
                          (pp['fill_cmin'] not in ['auto',None]) and \
                          (pp['fill_cmax'] not in ['auto',None]):
-                    plt.clim(pp['fill_cmin'], pp['fill_cmax'])
+                    pobj.set_clim(pp['fill_cmin'], pp['fill_cmax'])
 
 
     elif pp['plot_type'] == '2d_patch':
         # plot only the patches, no data:
+        pobj = pc_mth(X_edge, Y_edge, np.zeros(var.shape), \
+                cmap=pp['patch_bgcolormap'], shading='flat')
         if pp['celledges_show']:
-            pobj = pc_mth(X_edge, Y_edge, np.zeros(var.shape), \
-                    cmap=pp['patch_bgcolormap'], 
-                    edgecolors=pp['celledges_color'],
-                    linewidths=pp['celledges_linewidth'])
-        else:
-            pobj = pc_mth(X_edge, Y_edge, np.zeros(var.shape), \
-                    cmap=pp['patch_bgcolormap'], shading='flat')
+            add_cell_edges(pobj)
 
 
     elif pp['plot_type'] == '2d_schlieren':
@@ -1087,28 +1366,23 @@ def plotitem2(framesoln, plotitem, current_data, stateno):
         (vx,vy) = np.gradient(var)
         vs = np.sqrt(vx**2 + vy**2)
 
-        pcolor_cmd = "pobj = plt.pcolormesh(X_edge, Y_edge, vs, \
-                        cmap=pp['schlieren_cmap']"
-
-        if pp['celledges_show']:
-            pcolor_cmd += ", edgecolors=pp['celledges_color']"
-        else:
-            pcolor_cmd += ", edgecolors='None'"
-
-        pcolor_cmd += ", **pp['kwargs'])"
+        pcolor_kwargs = {'cmap': pp['schlieren_cmap'], 'edgecolors': 'None'}
 
         if not var_all_masked:
-            exec(pcolor_cmd)
+            pobj = ax.pcolormesh(X_edge, Y_edge, vs, **pcolor_kwargs,
+                                 **pp['kwargs'])
+            if pp['celledges_show']:
+                add_cell_edges(pobj)
 
             if (pp['schlieren_cmin'] not in ['auto',None]) and \
                      (pp['schlieren_cmax'] not in ['auto',None]):
-                plt.clim(pp['schlieren_cmin'], pp['schlieren_cmax'])
+                pobj.set_clim(pp['schlieren_cmin'], pp['schlieren_cmax'])
 
     elif pp['plot_type'] == '2d_quiver':
         if pp['quiver_coarsening'] > 0:
             var_x = get_var(state,pp['quiver_var_x'],current_data)
             var_y = get_var(state,pp['quiver_var_y'],current_data)
-            Q = plt.quiver(X_center[::pp['quiver_coarsening'],::pp['quiver_coarsening']],
+            Q = ax.quiver(X_center[::pp['quiver_coarsening'],::pp['quiver_coarsening']],
                              Y_center[::pp['quiver_coarsening'],::pp['quiver_coarsening']],
                              var_x[::pp['quiver_coarsening'],::pp['quiver_coarsening']],
                              var_y[::pp['quiver_coarsening'],::pp['quiver_coarsening']],
@@ -1122,7 +1396,7 @@ def plotitem2(framesoln, plotitem, current_data, stateno):
                 else:
                     key_scale = pp['quiver_key_scale']
                 label = r"%s %s" % (str(np.ceil(key_scale)),pp['quiver_key_units'])
-                plt.quiverkey(Q,pp['quiver_key_label_x'],pp['quiver_key_label_y'],
+                ax.quiverkey(Q,pp['quiver_key_label_x'],pp['quiver_key_label_y'],
                                 key_scale,label,**pp['quiver_key_kwargs'])
 
     elif pp['plot_type'] == '2d_empty':
@@ -1145,35 +1419,16 @@ def plotitem2(framesoln, plotitem, current_data, stateno):
             azdeg=pp['hillshade_azimuth_degree']
             altdeg = pp['hillshade_altitude_degree']
 
-            ls = LightSource(azdeg=azdeg, altdeg=altdeg)
-            # typically would do the following:
-            #  hs = ls.hillshade(z, vert_exag=ve, dx=dx, dy=dy)
-
-            # but here we need to calculate the hillshade by hand so that the values
-            # are consistent across all patches. The matplotlib code applies a 
-            # contrast stretch that we don't want. 
-   
-            # This code was modified from:
-            # https://matplotlib.org/3.1.1/_modules/matplotlib/colors.html#LightSource
-            z = np.flipud(var.T)
-            dx = current_data.dx
-            dy = current_data.dy
-            
-            e_dy, e_dx = np.gradient(ve * z, -dy, dx)
-            normal = np.empty(z.shape + (3,)).view(type(z))
-            normal[..., 0] = -e_dx
-            normal[..., 1] = -e_dy
-            normal[..., 2] = 1
-            normal /= _vector_magnitude(normal)
-            intensity = normal.dot(ls.direction)
-
-            # contrast stretch was applied here, code was deleted from the matplotlib routines.
-
-            intensity = np.clip(intensity, 0, 1)
-            hs = intensity
+            # typically would use LightSource.hillshade, but here we need
+            # the values to be consistent across all patches, without the
+            # contrast stretch it applies.  var.T is a view with rows along
+            # y from the bottom, hence origin='lower':
+            hs = hillshade_intensity(var.T, current_data.dx, current_data.dy,
+                                     ve, azdeg, altdeg)
 
             xylimits = (X_edge[0, 0], X_edge[-1, -1], Y_edge[0, 0], Y_edge[-1, -1])
-            pobj = plt.imshow(hs, cmap="gray", vmin=0, vmax=1, extent=xylimits)
+            pobj = ax.imshow(hs, cmap="gray", vmin=0, vmax=1, extent=xylimits,
+                             origin='lower')
             color_norm = Normalize(pp['imshow_cmin'],pp['imshow_cmax'],clip=True)
 
         else:
@@ -1191,19 +1446,25 @@ def plotitem2(framesoln, plotitem, current_data, stateno):
     # plot patch patch edges if desired:
 
     if pp['patchedges_show']:
-        for i in [0, X_edge.shape[0]-1]:
-            X1 = X_edge[i,:]
-            Y1 = Y_edge[i,:]
-            plt.plot(X1, Y1, color=pp['patchedges_color'], linewidth=pp['patchedges_linewidth'])
-        for i in [0, X_edge.shape[1]-1]:
-            X1 = X_edge[:,i]
-            Y1 = Y_edge[:,i]
-            plt.plot(X1, Y1, color=pp['patchedges_color'], linewidth=pp['patchedges_linewidth'])
+        # plot_frame collects the outlines of all patches of a level in
+        # current_data.patchedges and draws them together at the end:
+        patchedges = getattr(current_data, 'patchedges', None)
+        draw_now = patchedges is None
+        if draw_now:
+            patchedges = {}
+        key = (id(plotitem), patch.level)
+        if key not in patchedges:
+            patchedges[key] = (pp['patchedges_color'],
+                               pp['patchedges_linewidth'], [])
+        patchedges[key][2].append(patch_outline(X_edge, Y_edge))
+        if draw_now:
+            draw_patch_edges(ax, patchedges)
 
 
     if pp['afterpatch']:
         try:
             if isinstance(pp['afterpatch'], str):
+                import matplotlib.pyplot as plt
                 exec(pp['afterpatch'])
             else:
                 # assume it's a function
@@ -1229,6 +1490,7 @@ def plotitem2(framesoln, plotitem, current_data, stateno):
 
     try:
         plotitem._current_pobj = pobj
+        current_data.add_attribute('pobj',pobj)
     except NameError:
         pass # if no pobj generated
 
@@ -1259,7 +1521,8 @@ def get_var(state, plot_var, current_data):
 def printfig(fname='',frameno='', figno='', file_prefix='fort',
              format='png', plotdir='.',
              verbose=True, kml_fig=False, kml_dpi=None, kml_figsize=None,
-             bbox_inches='tight',close_fig=True):
+             bbox_inches='tight',close_fig=True, fig=None, use_pyplot=True,
+             reduced_widths=None):
 #------------------------------------------------------------------------
     """
     Save the current plot to file fname or standard name from frame/fig.
@@ -1271,8 +1534,18 @@ def printfig(fname='',frameno='', figno='', file_prefix='fort',
     number frameno passed in, J is the figure number figno passed in,
     and the extension ext is determined by format.
     If figno='' then the figJ part is omitted.
+
+    If fig is a Figure it is saved rather than pyplot figure figno.  If
+    use_pyplot is False, fig is not a pyplot figure and is not closed.
+
+    If reduced_widths is a list of widths in pixels, copies of a png file
+    scaled down to these widths are made in the background for use by the
+    html pages, see animation_tools.make_reduced_images_later.
     """
 
+    if use_pyplot or (fig is None):
+        import matplotlib.pyplot as plt
+
     if file_prefix == 'fort':
         # usual case:
         png_prefix = 'frame'
@@ -1289,14 +1562,14 @@ def printfig(fname='',frameno='', figno='', file_prefix='fort',
         fname = splitfname[0] + '.%s' % format
     if figno=='':
         figno = 1
-    plt.figure(figno)
+    if fig is None:
+        fig = plt.figure(figno)
     if plotdir != '.':
         fname = os.path.join(plotdir,fname)
     if verbose:  print('    Saving plot to file ', fname)
     if kml_fig:
         # from webpage : https://robotics.usc.edu/~ampereir/wordpress/?p=626
         # This was added so that in KML, axes, tick labels, etc do not get printed.
-        fig = plt.gcf()
         fig.patch.set_alpha(0)
         a = fig.gca()
         a.set_position([0.,0.,1.0,1.0])
@@ -1306,21 +1579,40 @@ def printfig(fname='',frameno='', figno='', file_prefix='fort',
         a.set_xticks([])
         a.set_yticks([])
 
-        plt.axis('off')
+        a.axis('off')
 
         if kml_figsize is not None:
             fig.set_size_inches(kml_figsize[0],kml_figsize[1])
         a.set_frame_on(False)
-        plt.subplots_adjust(top = 1, bottom = 0, right = 1, left = 0, 
+        fig.subplots_adjust(top = 1, bottom = 0, right = 1, left = 0, 
                         hspace = 0, wspace = 0)
-        plt.margins(0,0)
-        plt.savefig(fname, transparent=True, bbox_inches='tight',dpi=kml_dpi)
+        a.margins(0,0)
+        fig.savefig(fname, transparent=True, bbox_inches='tight',dpi=kml_dpi)
     else:
-        plt.savefig(fname, bbox_inches=bbox_inches)
+        fig.savefig(fname, bbox_inches=bbox_inches)
+        if reduced_widths and (os.path.splitext(fname)[1] == '.png'):
+            from clawpack.visclaw import animation_tools
+            animation_tools.make_reduced_images_later(fname, reduced_widths)
 
-    if close_fig:
+    if close_fig and use_pyplot:
         # to avoid running out of memory when making many plots
-        plt.close(figno)
+        plt.close(fig)
+
+
+def png_filenames(framenos, figno, file_prefix='fort', plotdir='.'):
+    """
+    Return the names of the png files that printfig wrote for figure figno
+    at each frame in framenos, leaving out any that do not exist.
+    """
+
+    if file_prefix == 'fort':
+        png_prefix = 'frame'
+    else:
+        png_prefix = file_prefix + 'frame'
+    fnames = [os.path.join(plotdir, '%s%sfig%s.png' \
+                           % (png_prefix, str(frameno).zfill(4), figno))
+              for frameno in framenos]
+    return [fname for fname in fnames if os.path.isfile(fname)]
 
 
 #======================================================================
@@ -1348,7 +1640,17 @@ def printframes(plotdata=None, verbose=True):
     """
     from clawpack.visclaw import plotpages
 
-    if 'matplotlib' not in sys.modules:
+    with plotpages.redirect_output(getattr(plotdata, 'msgfile', '')):
+        return _printframes(plotdata, verbose)
+
+
+def _printframes(plotdata, verbose):
+
+    from clawpack.visclaw import plotpages
+
+    try:
+        import matplotlib
+    except ImportError:
         print('*** Error: matplotlib not found, no plots will be done')
         return plotdata
 
@@ -1373,7 +1675,6 @@ def printframes(plotdata=None, verbose=True):
         outdir = plotdata.outdir       # directory containing fort.* files
         plotdir = plotdata.plotdir     # where to put png and html files
         overwrite = plotdata.overwrite # ok to overwrite?
-        msgfile = plotdata.msgfile     # where to write error messages
     except AttributeError:
         print('*** Error in printframes: plotdata missing attribute')
         print('  *** plotdata = ',plotdata)
@@ -1395,23 +1696,13 @@ def printframes(plotdata=None, verbose=True):
     fignos = fignos_to_show
 
 
-    rootdir = os.getcwd()
-
-    try:
-        os.chdir(rundir)
-    except OSError:
-        print('*** Error: cannot move to run directory ',rundir)
-        print('rootdir = ',rootdir)
+    if not os.path.isdir(rundir):
+        print('*** Error: cannot find run directory ',rundir)
         return plotdata
 
 
-    if msgfile != '':
-        sys.stdout = open(msgfile, 'w')
-        sys.stderr = sys.stdout
-
-
     try:
-        plotpages.cd_plotdir(plotdata)
+        plotpages.prepare_plotdir(plotdir, overwrite, verbose=False)
     except:
         print("*** Error, aborting plotframes")
         return plotdata
@@ -1433,22 +1724,20 @@ def printframes(plotdata=None, verbose=True):
     # Create each of the figures
     #---------------------------
 
-    try:
-        os.chdir(outdir)
-    except OSError:
-        print('*** Error printframes: cannot move to outdir = ',outdir)
+    if not os.path.isdir(outdir):
+        print('*** Error printframes: cannot find outdir = ',outdir)
         return plotdata
 
 
     fortfile = {}
     frametimes = {}
 
-    for file in glob.glob('fort.q*'):
-        frameno = int(file[6:])
+    for file in glob.glob(os.path.join(outdir, 'fort.q*')):
+        frameno = int(os.path.basename(file)[6:])
         fortfile[frameno] = file
 
     if len(fortfile) == 0:
-        print('*** No fort.q files found in directory ', os.getcwd())
+        print('*** No fort.q files found in directory ', outdir)
         return plotdata
 
     # Discard frames that are not from latest run, based on
@@ -1481,8 +1770,6 @@ def printframes(plotdata=None, verbose=True):
     plotdata.timeframes_fignos = fignos
     plotdata.timeframes_fignames = fignames
 
-    os.chdir(plotdir)
-
     if plotdata.html:
         plotpages.timeframes2html(plotdata)
 
@@ -1504,30 +1791,31 @@ def printframes(plotdata=None, verbose=True):
 
     if plotdata.gif_movie:
         print('Making gif movies.  This may take some time....')
+        from clawpack.visclaw import animation_tools
         for figno in fignos:
+            pngfiles = png_filenames(framenos, figno, plotdata.file_prefix,
+                                     plotdir)
             try:
-                os.system('convert -delay 20 frame*fig%s.png moviefig%s.gif' \
-                   % (figno,figno))
-                print('    Created moviefig%s.gif' % figno)
+                created = animation_tools.make_gif_from_pngs(pngfiles,
+                                os.path.join(plotdir, 'moviefig%s.gif' % figno))
             except:
+                created = False
+            if created:
+                print('    Created moviefig%s.gif' % figno)
+            else:
                 print('*** Error creating moviefig%s.gif' % figno)
 
-    os.chdir(rootdir)
-
     # print out pointers to html index page:
     path_to_html_index = os.path.join(os.path.abspath(plotdata.plotdir), \
                                plotdata.html_index_fname)
     plotpages.print_html_pointers(path_to_html_index)
 
-    # reset stdout for future print statements
-    sys.stdout = sys.__stdout__
-
     return plotdata
     # end of printframes
 
 
 #------------------------------------------------------------------
-def var_limits(plotdata,vars,padding=0.1):
+def var_limits(plotdata,vars,padding=0.1,percentiles=None):
 #------------------------------------------------------------------
     """
     Determine range of values encountered in data for all frames
@@ -1555,6 +1843,11 @@ def var_limits(plotdata,vars,padding=0.1):
                 v2 = vmax + padding*(vmax-vmin)
             to give some space above and below the min and max.
 
+    If percentiles = (p1, p2) is given, e.g. (2, 98), varmin[var] and
+    varmax[var] are these percentiles of var over all frames instead, for
+    components of q, so that a few extreme cells do not set the limits.
+    They are approximate, see framestats.global_quantiles.
+
     """
 
     varlim = {}
@@ -1564,6 +1857,10 @@ def var_limits(plotdata,vars,padding=0.1):
     for var in vars:
         varmin[var] = vmin[var]['all']   # min over all frames
         varmax[var] = vmax[var]['all']   # max over all frames
+        if (percentiles is not None) and isinstance(var,int):
+            from clawpack.visclaw import framestats
+            varmin[var], varmax[var] = framestats.global_quantiles(plotdata,
+                    var, [percentiles[0]/100., percentiles[1]/100.])
         v1 = varmin[var] - padding*(varmax[var]-varmin[var])
         v2 = varmax[var] + padding*(varmax[var]-varmin[var])
         varlim[var] = [v1,v2]
@@ -1603,6 +1900,10 @@ def var_minmax(plotdata,framenos,vars):
        varmin['machnumber']['all'] is the minimum of machnumber
            over all patches in all frames.
 
+    The min and max of components of q are taken from the statistics
+    kept in the outdir by framestats.update_stats, so frames are only read
+    again if they changed, using plotdata.num_procs processes.
+
     """
 
     framenos = only_most_recent(framenos, plotdata.outdir)
@@ -1624,6 +1925,31 @@ def var_minmax(plotdata,framenos,vars):
             varmin[var][frameno] = np.inf
             varmax[var][frameno] = -np.inf
 
+    # components of q: use the statistics stored in the outdir, computed
+    # in parallel only for frames that are new or changed:
+    q_vars = [var for var in vars if isinstance(var,int)]
+    if len(q_vars) > 0:
+        from clawpack.visclaw import framestats
+        stats = framestats.update_stats(plotdata.outdir, framenos, q_vars,
+                                        plotdata.file_prefix, plotdata.format,
+                                        plotdata.framestats_quantiles,
+                                        plotdata.num_procs or 1)
+        for var in q_vars:
+            for frameno in framenos:
+                var_stats = framestats.var_stats(stats, var, frameno)
+                if (var_stats is not None) and (var_stats['count'] > 0):
+                    varmin[var][frameno] = var_stats['min']
+                    varmax[var][frameno] = var_stats['max']
+                varmin[var]['all'] = min(varmin[var]['all'], \
+                                         varmin[var][frameno])
+                varmax[var]['all'] = max(varmax[var]['all'], \
+                                         varmax[var][frameno])
+
+    # functions of q, x, y, t are computed here:
+    vars = [var for var in vars if not isinstance(var,int)]
+    if len(vars) == 0:
+        return (varmin, varmax)
+
     for frameno in framenos:
         solution = plotdata.getframe(frameno, plotdata.outdir)
         num_dim = solution.num_dim
@@ -1675,28 +2001,25 @@ def only_most_recent(framenos,outdir='.',prefix='fort',verbose=True):
     Returns the filtered list.
     """
 
-    startdir = os.getcwd()
-    if outdir != '.':
-        try:
-            os.chdir(outdir)
-        except OSError:
-            print("*** Could not chdir to ", outdir)
-            return framenos
+    if not os.path.isdir(outdir):
+        print("*** Could not find directory ", outdir)
+        return framenos
 
     fortfile = {}
-    for file in glob.glob(prefix + '.q*'):
+    for file in glob.glob(os.path.join(outdir, prefix + '.q*')):
         frameno = int(file[-4:])
         fortfile[frameno] = file
 
     #DK: In PetClaw, we don't output fort.q* files.  Instead count the
     #claw.pkl* files.
     if len(fortfile) == 0:
-        for file in glob.glob('claw.pkl*'):
-            frameno = int(file[8:])
+        for file in glob.glob(os.path.join(outdir, 'claw.pkl*')):
+            frameno = int(os.path.basename(file)[8:])
             fortfile[frameno] = file
 
     if len(fortfile) == 0:
-        print('*** No fort.q or claw.pkl files found in directory ', os.getcwd())
+        print('*** No fort.q or claw.pkl files found in directory ',
+              os.path.abspath(outdir))
         framenos = []
         return framenos
 
@@ -1729,9 +2052,76 @@ def only_most_recent(framenos,outdir='.',prefix='fort',verbose=True):
         # compute intersection of framenos and newframes:
         framenos = list(set(framenos).intersection(set(newframes)))
     framenos.sort()
-    os.chdir(startdir)
     return framenos
 
+#------------------------------------------------------------------
+def frame_files(frameno,outdir='.',prefix='fort'):
+#------------------------------------------------------------------
+
+    """
+    Return the output files of frame frameno in outdir, e.g. fort.q0003,
+    fort.t0003 and fort.b0003 for frame 3, but not fort.q10003 of
+    frame 10003.
+    """
+
+    import re
+
+    pattern = os.path.join(outdir, '%s.*%s' % (prefix, str(frameno).zfill(4)))
+    files = []
+    for fname in glob.glob(pattern):
+        # all digits at the end are the frame number:
+        digits = re.search(r'[0-9]+$', os.path.basename(fname)).group()
+        if int(digits) == frameno:
+            files.append(fname)
+    return files
+
+#------------------------------------------------------------------
+def frame_costs(framenos,outdir='.',prefix='fort'):
+#------------------------------------------------------------------
+
+    """
+    Estimate the relative cost of plotting each frame in framenos.
+
+    The estimate is the total size in bytes of all output files for the
+    frame (e.g. fort.q0003, fort.b0003, fort.a0003, fort.t0003), which
+    grows with the number of patches and cells in the frame.  It is only
+    used to decide the order in which frames are handed out to parallel
+    plotting processes, so no files are read.
+
+    Returns a dictionary with keys given by frame numbers.
+    """
+
+    costs = {}
+    for frameno in framenos:
+        costs[frameno] = sum([os.path.getsize(f) for f in
+                              frame_files(frameno, outdir, prefix)])
+    return costs
+
+#------------------------------------------------------------------
+def load_setplot_module(name, directory):
+#------------------------------------------------------------------
+    """
+    Import the module name from directory and return it.
+
+    If the file name.py is in directory, a new module object is created from
+    it each time rather than reloading the module in sys.modules, so that
+    setplot files with the same module name in different directories, e.g.
+    used by plotting jobs running at the same time, do not replace each
+    other.
+    """
+
+    path = os.path.join(directory, name + '.py')
+    if not os.path.isfile(path):
+        setplot_module = __import__(name)
+        reload(setplot_module)
+        return setplot_module
+
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(name, path)
+    setplot_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(setplot_module)
+    return setplot_module
+
 #------------------------------------------------------------------------
 def call_setplot(setplot, plotdata, verbose=True):
 #------------------------------------------------------------------
@@ -1774,8 +2164,8 @@ def call_setplot(setplot, plotdata, verbose=True):
         # Attempt to import whatever was handed to us and parsed above
         try:
             sys.path.insert(0,setplot_module_dir)
-            setplot_module = __import__(setplot_module_name)
-            reload(setplot_module)
+            setplot_module = load_setplot_module(setplot_module_name,
+                                                 setplot_module_dir)
             setplot = setplot_module.setplot
             if not isinstance(setplot,types.FunctionType):
                 raise ImportError("Failed importing %s.setplot" % setplot_module_name)
@@ -1825,6 +2215,8 @@ def call_setplot(setplot, plotdata, verbose=True):
 #------------------------------------------------------------------
 def clawpack_header():
 #------------------------------------------------------------------
+    import matplotlib.pyplot as plt
+
     plt.axes([.3, .8, .98, 1.])
     plt.text(.1,.13,'Clawpack Plots',fontsize=30,color='brown')
     plt.axis('off')
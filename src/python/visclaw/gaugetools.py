@@ -13,18 +13,29 @@ import clawpack.clawutil.data as clawdata
 from clawpack.visclaw.frametools import set_show
 
 plotter = 'matplotlib'
-if plotter == 'matplotlib':
-    if 'matplotlib' not in sys.modules:
-        try:
-            import matplotlib
-            matplotlib.use('Agg')  # Use an image backend
-        except:
-            print("*** Error: problem importing matplotlib")
 
-try:
-    import pylab
-except:
-    print("*** Error: problem importing pylab")
+
+def _import_pylab():
+    """
+    Import pylab when it is first needed rather than when this module is
+    imported, using an image backend unless matplotlib is already in use.
+    """
+
+    if plotter == 'matplotlib':
+        if 'matplotlib' not in sys.modules:
+            try:
+                import matplotlib
+                matplotlib.use('Agg')  # Use an image backend
+            except:
+                print("*** Error: problem importing matplotlib")
+
+    try:
+        import pylab
+    except:
+        print("*** Error: problem importing pylab")
+        raise
+    return pylab
+
 
 # Gauge solution class
 class GaugeSolution(object):
@@ -124,6 +135,8 @@ def plotgauge(gaugeno, plotdata, verbose=False):
 
     """
 
+    pylab = _import_pylab()
+
     if verbose:  
         gaugesoln = plotdata.getgauge(gaugeno)
         print('    Plotting gauge %s  at x = %s, y = %s ... '  \
@@ -375,7 +388,8 @@ def plotgauge(gaugeno, plotdata, verbose=False):
         for figno in plotted_fignos:
             printfig(gaugeno=gaugeno, figno=figno, \
                     format=plotdata.print_format, plotdir=plotdata.plotdir,\
-                    verbose=verbose)
+                    verbose=verbose,
+                    reduced_widths=plotdata.html_reduced_widths)
 
     return current_data
 
@@ -397,6 +411,8 @@ def plotgauge1(gaugesoln, plotitem, current_data):
 
     """
 
+    pylab = _import_pylab()
+
     if not gaugesoln.is_valid():
         import warnings
         warnings.warn("Gauge has not been initialized properly.")
@@ -531,7 +547,7 @@ def plot_gauge_locations(plotdata, gaugenos='all', mapc2p=None, \
 
 #------------------------------------------------------------------------
 def printfig(fname='',gaugeno='', figno='', format='png', plotdir='.', \
-             verbose=True):
+             verbose=True, reduced_widths=None):
 #------------------------------------------------------------------------
     """
     Save the current plot to file fname or standard name from gauge/fig.
@@ -543,8 +559,14 @@ def printfig(fname='',gaugeno='', figno='', format='png', plotdir='.', \
     number gaugeno passed in, J is the figure number figno passed in,
     and the extension ext is determined by format.  
     If figno='' then the figJ part is omitted.
+
+    If reduced_widths is a list of widths in pixels, copies of a png file
+    scaled down to these widths are made in the background for use by the
+    html pages, see animation_tools.make_reduced_images_later.
     """
 
+    pylab = _import_pylab()
+
     if fname == '':
         fname = 'gauge' + str(gaugeno).rjust(4,'0') 
         if isinstance(figno,int):
@@ -559,6 +581,9 @@ def printfig(fname='',gaugeno='', figno='', format='png', plotdir='.', \
        fname = os.path.join(plotdir,fname)
     if verbose:  print('    Saving plot to file ', fname)
     pylab.savefig(fname)
+    if reduced_widths and (os.path.splitext(fname)[1] == '.png'):
+        from clawpack.visclaw import animation_tools
+        animation_tools.make_reduced_images_later(fname, reduced_widths)
 
 
 #======================================================================
@@ -582,13 +607,23 @@ def printgauges(plotdata=None, verbose=True):
     If plotdata.setplot is a function then this function will be used.
     """
 
+    from clawpack.visclaw import plotpages
+
+    with plotpages.redirect_output(getattr(plotdata, 'msgfile', '')):
+        return _printgauges(plotdata, verbose)
+
+
+def _printgauges(plotdata, verbose):
+
     import glob
     from clawpack.visclaw.data import ClawPlotData
 
     from clawpack.visclaw import plotpages
 
 
-    if 'matplotlib' not in sys.modules:
+    try:
+        import matplotlib
+    except ImportError:
         print('*** Error: matplotlib not found, no plots will be done')
         return plotdata
         
@@ -614,7 +649,6 @@ def printgauges(plotdata=None, verbose=True):
         outdir = plotdata.outdir       # directory containing fort.* files
         plotdir = plotdata.plotdir     # where to put png and html files
         overwrite = plotdata.overwrite # ok to overwrite?
-        msgfile = plotdata.msgfile     # where to write error messages
     except:
         print('*** Error in printframes: plotdata missing attribute')
         print('  *** plotdata = ',plotdata)
@@ -649,23 +683,13 @@ def printgauges(plotdata=None, verbose=True):
             fignos_each_run.append(figno)
         
 
-    rootdir = os.getcwd()
-
-    try:
-        os.chdir(rundir)
-    except:
-        print('*** Error: cannot move to run directory ',rundir)
-        print('rootdir = ',rootdir)
+    if not os.path.isdir(rundir):
+        print('*** Error: cannot find run directory ',rundir)
         return plotdata
 
 
-    if msgfile != '':
-        sys.stdout = open(msgfile, 'w')
-        sys.stderr = sys.stdout
-
-
     try:
-        plotpages.cd_plotdir(plotdata)
+        plotpages.prepare_plotdir(plotdir, overwrite, verbose=False)
     except:
         print("*** Error, aborting plotframes")
         return plotdata
@@ -687,10 +711,8 @@ def printgauges(plotdata=None, verbose=True):
     # Create each of the figures
     #---------------------------
 
-    try:
-        os.chdir(outdir)
-    except:
-        print('*** Error printframes: cannot move to outdir = ',outdir)
+    if not os.path.isdir(outdir):
+        print('*** Error printframes: cannot find outdir = ',outdir)
         return plotdata
 
 
@@ -698,15 +720,15 @@ def printgauges(plotdata=None, verbose=True):
     pngfile = {}
     frametimes = {}
 
-    import glob
-    for file in glob.glob('fort.q*'):
+    for file in glob.glob(os.path.join(outdir, 'fort.q*')):
+        file = os.path.basename(file)
         frameno = int(file[7:10])
         fortfile[frameno] = file
         for figno in fignos_each_frame:
             pngfile[frameno,figno] = 'frame' + file[-4:] + 'fig%s.png' % figno
     
     if len(fortfile) == 0:
-        print('*** No fort.q files found in directory ', os.getcwd())
+        print('*** No fort.q files found in directory ', outdir)
         return plotdata
     
     # Discard frames that are not from latest run, based on
@@ -741,8 +763,6 @@ def printgauges(plotdata=None, verbose=True):
     # Make html files for time frame figures:
     # ---------------------------------------
 
-    os.chdir(plotdir)
-
     if plotdata.html:
         plotpages.timeframes2html(plotdata)
     
@@ -770,24 +790,25 @@ def printgauges(plotdata=None, verbose=True):
     
     if plotdata.gif_movie:
         print('Making gif movies.  This may take some time....')
+        from clawpack.visclaw import animation_tools
+        from clawpack.visclaw.frametools import png_filenames
         for figno in fignos_each_frame:
+            pngfiles = png_filenames(framenos, figno, plotdir=plotdir)
             try:
-                os.system('convert -delay 20 frame*fig%s.png moviefig%s.gif' \
-                   % (figno,figno))
-                print('    Created moviefig%s.gif' % figno)
+                created = animation_tools.make_gif_from_pngs(pngfiles,
+                                os.path.join(plotdir, 'moviefig%s.gif' % figno))
             except:
+                created = False
+            if created:
+                print('    Created moviefig%s.gif' % figno)
+            else:
                 print('*** Error creating moviefig%s.gif' % figno)
-    
-    os.chdir(rootdir)
 
     # print out pointers to html index page:
     path_to_html_index = os.path.join(os.path.abspath(plotdata.plotdir), \
                                plotdata.html_index_fname)
     plotpages.print_html_pointers(path_to_html_index)
 
-    # reset stdout for future print statements
-    sys.stdout = sys.__stdout__
-
     return plotdata
     # end of printframes
 
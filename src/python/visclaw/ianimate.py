@@ -56,9 +56,12 @@ def ianimate(frame_list,plotdata=None,ivar=0,varname=None,**kargs):
 
     elif ndim == 2:
         fig = plt.figure(figsize=(4,4))
-        xc, yc = frame.state.grid.p_centers
+        # q[ivar,:,:].T is a view with rows along y from the bottom, and
+        # the extent is that of the cells, not of their centers:
+        xlower, ylower = frame.state.grid.lower
+        xupper, yupper = frame.state.grid.upper
         im = plt.imshow(frame.q[ivar,:,:].T,
-                        extent=[xc.min(), xc.max(), yc.min(), yc.max()],
+                        extent=[xlower, xupper, ylower, yupper],
                         interpolation='nearest',origin='lower',cmap=cmap)
         if xlim: plt.xlim(xlim)
         if ylim: plt.ylim(ylim)
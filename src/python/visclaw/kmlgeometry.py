@@ -0,0 +1,254 @@
+"""
+Module kmlgeometry: outlines of AMR patches and regions as KML and GeoJSON.
+
+plotclaw2kml used to make one pykml Placemark per patch per frame for the
+patch borders in levels.kml, which is slow and makes files Google Earth is
+slow to show when there are thousands of patches.  Here the rectangles of
+all patches of a level are handled together with NumPy: the edges shared by
+two patches cancel, and the remaining boundary segments are joined into
+polygons, so adjacent patches give one polygon, possibly with holes, and
+each level of each frame is written as a single MultiGeometry.
+
+The polygons are lists of rings, the outer boundary first and then any
+holes, each an array of (x, y) vertices with the first vertex repeated at
+the end.  Outer boundaries are counterclockwise and holes clockwise, as
+GeoJSON (RFC 7946) requires.
+
+kml_multigeometry and geojson_feature format them, and GeoJSONWriter
+writes a FeatureCollection one feature at a time, so that the files for
+all frames need not be held in memory.
+"""
+
+import json
+import numpy as np
+
+
+def wrap_longitudes(x1, x2):
+    """
+    Return x1, x2 (arrays of the west and east edges of rectangles) shifted
+    by 360 degrees to -180 to 180 if both are east of 180 or both west of
+    -180, so that Google Earth shows them when zooming.
+    """
+
+    x1 = np.array(x1, dtype=float)
+    x2 = np.array(x2, dtype=float)
+    shift = np.where(x1 > 180, -360., np.where(x2 < -180, 360., 0.))
+    return x1 + shift, x2 + shift
+
+
+def _segments(position, lower, upper, side):
+    """
+    Boundary segments along lines position = constant of rectangles with
+    edges from lower to upper, side +1 where the rectangle is on the
+    positive side of the line and -1 where it is on the negative side.
+    Returns arrays of the position, start and end along the line and of
+    the side the inside is on, with the edges shared by two rectangles
+    removed.
+    """
+
+    # coverage of each line from events at the ends of the edges, sorted
+    # along each line; the sum of the events of each line is zero, so a
+    # cumulative sum over all of them gives the coverage on each line
+    position = np.concatenate([position, position])
+    along = np.concatenate([lower, upper])
+    weight = np.concatenate([side, -side])
+    order = np.lexsort((along, position))
+    position = position[order]
+    along = along[order]
+    coverage = np.cumsum(weight[order])
+
+    boundary = (coverage[:-1] != 0) & (position[:-1] == position[1:]) \
+               & (along[:-1] < along[1:])
+    k = np.nonzero(boundary)[0]
+    return position[k], along[k], along[k+1], np.sign(coverage[k])
+
+
+def _rings(x1, x2, y1, y2, decimals):
+    x1, x2, y1, y2 = [np.round(np.asarray(a, dtype=float), decimals)
+                      for a in (x1, x2, y1, y2)]
+    keep = (x2 > x1) & (y2 > y1)
+    x1, x2, y1, y2 = x1[keep], x2[keep], y1[keep], y2[keep]
+    n = len(x1)
+    if n == 0:
+        return []
+    ones = np.ones(n)
+
+    # horizontal edges: bottom (inside above, going east) and top (inside
+    # below, going west); vertical edges: left (inside east, going south)
+    # and right (inside west, going north), so the inside is on the left:
+    hy, ha, hb, hs = _segments(np.concatenate([y1, y2]),
+                               np.concatenate([x1, x1]),
+                               np.concatenate([x2, x2]),
+                               np.concatenate([ones, -ones]))
+    vx, va, vb, vs = _segments(np.concatenate([x1, x2]),
+                               np.concatenate([y1, y1]),
+                               np.concatenate([y2, y2]),
+                               np.concatenate([ones, -ones]))
+
+    start = np.concatenate([np.where(hs > 0, ha, hb)[:,None],
+                            hy[:,None]], axis=1)
+    end = np.concatenate([np.where(hs > 0, hb, ha)[:,None],
+                          hy[:,None]], axis=1)
+    start = np.concatenate([start, np.column_stack([vx,
+                                    np.where(vs > 0, vb, va)])])
+    end = np.concatenate([end, np.column_stack([vx,
+                                    np.where(vs > 0, va, vb)])])
+    nedges = len(start)
+
+    # number the vertices, and list the edges leaving each of them:
+    vertices, index = np.unique(np.concatenate([start, end]), axis=0,
+                                return_inverse=True)
+    index = index.reshape(-1)
+    first, last = index[:nedges], index[nedges:]
+    direction = np.sign(end - start).astype(int)
+    outgoing = {}
+    for e in np.argsort(first, kind='stable'):
+        outgoing.setdefault(first[e], []).append(e)
+
+    used = np.zeros(nedges, dtype=bool)
+    rings = []
+    for e0 in range(nedges):
+        if used[e0]:
+            continue
+        ring = [e0]
+        used[e0] = True
+        e = e0
+        while last[e] != first[e0]:
+            candidates = [c for c in outgoing[last[e]] if not used[c]]
+            if len(candidates) > 1:
+                # where two patches only touch at a corner, turn left to
+                # keep their outlines separate
+                dx, dy = direction[e]
+                turns = {(-dy, dx): 0, (dx, dy): 1, (dy, -dx): 2}
+                candidates.sort(key=lambda c:
+                                turns.get(tuple(direction[c]), 3))
+            e = candidates[0]
+            used[e] = True
+            ring.append(e)
+        # leave out vertices in the middle of straight lines:
+        turn = [k for k in range(len(ring)) if
+                tuple(direction[ring[k]]) != tuple(direction[ring[k-1]])]
+        points = vertices[first[[ring[k] for k in turn]]]
+        rings.append(np.vstack([points, points[:1]]))
+    return rings
+
+
+def _area(ring):
+    x, y = ring[:,0], ring[:,1]
+    return 0.5 * np.sum(x[:-1]*y[1:] - x[1:]*y[:-1])
+
+
+def _inside(point, ring):
+    x, y = ring[:-1,0], ring[:-1,1]
+    xn, yn = ring[1:,0], ring[1:,1]
+    crosses = (y > point[1]) != (yn > point[1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xcross = x + (point[1] - y) * (xn - x) / (yn - y)
+    return np.count_nonzero(crosses & (point[0] < xcross)) % 2 == 1
+
+
+def merge_rectangles(x1, x2, y1, y2, decimals=8):
+    """
+    Return the outline of the union of the rectangles [x1,x2] x [y1,y2],
+    given as arrays, as a list of polygons (see the module docstring).
+    The rectangles must not overlap, as the patches of one AMR level do
+    not.  Coordinates are rounded to decimals digits so that edges shared
+    by two rectangles match.
+    """
+
+    rings = _rings(x1, x2, y1, y2, decimals)
+    outers = [ring for ring in rings if _area(ring) > 0]
+    holes = [ring for ring in rings if _area(ring) < 0]
+    polygons = [[ring] for ring in outers]
+    if len(holes) > 0:
+        # each hole belongs to the smallest outline around a point just
+        # inside the patch along its first edge:
+        depth = 0.5 * min(np.min(np.asarray(x2) - np.asarray(x1)),
+                          np.min(np.asarray(y2) - np.asarray(y1)))
+        areas = [_area(ring) for ring in outers]
+        for hole in holes:
+            d = hole[1] - hole[0]
+            d = d / np.hypot(d[0], d[1])
+            point = 0.5*(hole[0] + hole[1]) + depth * np.array([-d[1], d[0]])
+            around = [k for k in range(len(outers))
+                      if _inside(point, outers[k])]
+            if len(around) > 0:
+                polygons[min(around, key=lambda k: areas[k])].append(hole)
+    return polygons
+
+
+def rectangle(x1, x2, y1, y2):
+    """The polygon for one rectangle, as from merge_rectangles."""
+    return [np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2], [x1, y1]],
+                     dtype=float)]
+
+
+def _kml_coordinates(ring, elev):
+    return ' '.join(['%.10g,%.10g,%g' % (x, y, elev) for (x, y) in ring])
+
+
+def kml_polygon(polygon, elev=0, indent=''):
+    """Return the KML Polygon element for polygon, as a string."""
+
+    text = ['%s<Polygon>\n' % indent,
+            '%s  <tessellate>1</tessellate>\n' % indent,
+            '%s  <altitudeMode>clampToGround</altitudeMode>\n' % indent]
+    for k, ring in enumerate(polygon):
+        tag = 'outerBoundaryIs' if k == 0 else 'innerBoundaryIs'
+        text.append('%s  <%s><LinearRing><coordinates>%s</coordinates>'
+                    '</LinearRing></%s>\n'
+                    % (indent, tag, _kml_coordinates(ring, elev), tag))
+    text.append('%s</Polygon>\n' % indent)
+    return ''.join(text)
+
+
+def kml_multigeometry(polygons, elev=0, indent=''):
+    """Return a KML MultiGeometry element with the polygons, as a string."""
+
+    return '%s<MultiGeometry>\n%s%s</MultiGeometry>\n' \
+        % (indent, ''.join([kml_polygon(polygon, elev, indent + '  ')
+                            for polygon in polygons]), indent)
+
+
+def geojson_feature(polygons, properties=None):
+    """
+    Return a GeoJSON Feature (a dictionary) with the polygons as a
+    MultiPolygon and the given properties.
+    """
+
+    return {'type': 'Feature',
+            'properties': properties or {},
+            'geometry': {'type': 'MultiPolygon',
+                         'coordinates': [[ring.tolist() for ring in polygon]
+                                         for polygon in polygons]}}
+
+
+class GeoJSONWriter(object):
+    """
+    Write a GeoJSON FeatureCollection to file_name one feature at a time,
+    see geojson_feature.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._file = open(file_name, 'w')
+        self._file.write('{"type": "FeatureCollection", "features": [\n')
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, feature):
+        if self._count > 0:
+            self._file.write(',\n')
+        json.dump(feature, self._file)
+        self._count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.write('\n]}\n')
+            self._file.close()
+            self._file = None
@@ -0,0 +1,255 @@
+"""
+Module kmltiles: cut png images into tile pyramids for Google Earth.
+
+For figures with plotfigure.kml_tile_images = True, plotpages.plotclaw2kml
+used to run gdal_translate, gdalwarp and gdal2tiles.py for each frame.  The
+images are always axis-aligned rectangles in longitude and latitude, so the
+tiles of the geodetic profile of gdal2tiles (EPSG:4326, 256 pixel tiles,
+2 tiles around the world at zoom level 0) can be cut from them directly
+with Pillow, which is done here.  The tiles are written to z/x/y.png in the
+output directory, numbered from the south west as by gdal2tiles, with a
+z/x/y.kml file for each showing the tile and linking to the tiles of the
+next level as regions, and a doc.kml file linking to the tiles of the
+coarsest level.
+
+tile_images tiles many images in a pool of processes.
+"""
+
+import os
+import math
+
+resampling_methods = ['near', 'bilinear', 'average', 'lanczos']
+
+
+def _resample(resampling):
+    from PIL import Image
+    return {'near': Image.NEAREST,
+            'bilinear': Image.BILINEAR,
+            'average': Image.BOX,
+            'lanczos': Image.LANCZOS}[resampling]
+
+
+def tile_degrees(zoom):
+    """Width and height in degrees of the geodetic tiles at level zoom."""
+    return 180.0 / 2**zoom
+
+
+def zoom_levels(width, height, west, south, east, north, tile_size=256):
+    """
+    Return the coarsest and finest zoom levels (minzoom, maxzoom) for an
+    image of width x height pixels covering the given longitudes and
+    latitudes, as chosen by gdal2tiles: at maxzoom the tile pixels are no
+    larger than the image pixels, and at minzoom the image is at most
+    about one tile.
+    """
+
+    pixel = min((east - west) / float(width), (north - south) / float(height))
+    maxzoom = max(0, int(math.ceil(math.log(180.0/tile_size/pixel, 2)
+                                   - 1e-9)))
+    size = pixel * max(width, height) / tile_size
+    minzoom = max(0, int(math.floor(math.log(180.0/tile_size/size, 2))))
+    return min(minzoom, maxzoom), maxzoom
+
+
+def _tile_bounds(zoom, tx, ty):
+    d = tile_degrees(zoom)
+    return (-180.0 + tx*d, -90.0 + ty*d, -180.0 + (tx+1)*d, -90.0 + (ty+1)*d)
+
+
+def _lat_lon_box(tag, bounds, indent):
+    west, south, east, north = bounds
+    return ('%s<%s>\n'
+            '%s  <north>%.14f</north>\n'
+            '%s  <south>%.14f</south>\n'
+            '%s  <east>%.14f</east>\n'
+            '%s  <west>%.14f</west>\n'
+            '%s</%s>\n') % (indent, tag, indent, north, indent, south,
+                            indent, east, indent, west, indent, tag)
+
+
+def _network_link(zoom, tx, ty, href, indent):
+    return ('%s<NetworkLink>\n'
+            '%s  <name>%i/%i/%i</name>\n'
+            '%s  <Region>\n'
+            '%s'
+            '%s    <Lod>\n'
+            '%s      <minLodPixels>128</minLodPixels>\n'
+            '%s      <maxLodPixels>-1</maxLodPixels>\n'
+            '%s    </Lod>\n'
+            '%s  </Region>\n'
+            '%s  <Link>\n'
+            '%s    <href>%s</href>\n'
+            '%s    <viewRefreshMode>onRegion</viewRefreshMode>\n'
+            '%s  </Link>\n'
+            '%s</NetworkLink>\n') \
+        % (indent, indent, zoom, tx, ty, indent,
+           _lat_lon_box('LatLonAltBox', _tile_bounds(zoom, tx, ty),
+                        indent + '    '),
+           indent, indent, indent, indent, indent, indent, indent, href,
+           indent, indent, indent)
+
+
+def _tile_kml(zoom, tx, ty, children, leaf):
+    bounds = _tile_bounds(zoom, tx, ty)
+    text = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+            '<kml xmlns="http://www.opengis.net/kml/2.2">\n',
+            '  <Document>\n',
+            '    <name>%i/%i/%i.kml</name>\n' % (zoom, tx, ty),
+            '    <Region>\n',
+            _lat_lon_box('LatLonAltBox', bounds, '      '),
+            '      <Lod>\n',
+            '        <minLodPixels>128</minLodPixels>\n',
+            '        <maxLodPixels>%i</maxLodPixels>\n' % (-1 if leaf else 1024),
+            '      </Lod>\n',
+            '    </Region>\n',
+            '    <GroundOverlay>\n',
+            '      <drawOrder>%i</drawOrder>\n' % zoom,
+            '      <Icon>\n',
+            '        <href>%i.png</href>\n' % ty,
+            '      </Icon>\n',
+            _lat_lon_box('LatLonBox', bounds, '      ')]
+    text.append('    </GroundOverlay>\n')
+    for (cx, cy) in children:
+        text.append(_network_link(zoom+1, cx, cy, '../../%i/%i/%i.kml'
+                                  % (zoom+1, cx, cy), '    '))
+    text.append('  </Document>\n</kml>\n')
+    return ''.join(text)
+
+
+def _save_tile(tile_dir, zoom, tx, ty, tile):
+    directory = os.path.join(tile_dir, str(zoom), str(tx))
+    os.makedirs(directory, exist_ok=True)
+    tile.save(os.path.join(directory, '%i.png' % ty))
+
+
+def tile_image(png_file, tile_dir, west, south, east, north,
+               resampling='near', tile_size=256, name=None):
+    """
+    Cut the image png_file, covering the given longitudes and latitudes,
+    into the geodetic tile pyramid with KML files described in the module
+    docstring, written to the directory tile_dir.
+
+    The finest tiles are cut from the image with the given resampling,
+    one of resampling_methods, and the coarser tiles are made from the
+    four tiles of the next finer level.  Tiles with no visible pixels are
+    left out.  name is used in doc.kml, by default the file name.
+
+    Returns the number of tiles written.
+    """
+
+    import numpy as np
+    from PIL import Image
+
+    if resampling not in resampling_methods:
+        raise ValueError('resampling must be one of %s' % resampling_methods)
+    resample = _resample(resampling)
+    if name is None:
+        name = os.path.basename(png_file)
+
+    with Image.open(png_file) as im:
+        image = im.convert('RGBA')
+    sx, sy = image.size
+    minzoom, maxzoom = zoom_levels(sx, sy, west, south, east, north,
+                                   tile_size)
+    T = tile_size
+    d = tile_degrees(maxzoom)
+
+    # finest level, cut from the image:
+    tiles = set()
+    tx_range = range(int(math.floor((west + 180.0) / d)),
+                     int(math.ceil((east + 180.0) / d)))
+    ty_range = range(int(math.floor((south + 90.0) / d)),
+                     int(math.ceil((north + 90.0) / d)))
+    for tx in tx_range:
+        for ty in ty_range:
+            tw, ts, te, tn = _tile_bounds(maxzoom, tx, ty)
+            x0, x1 = max(west, tw), min(east, te)
+            y0, y1 = max(south, ts), min(north, tn)
+            # pixels of the tile covered by the image:
+            dx0 = int(round((x0 - tw) / d * T))
+            dx1 = int(round((x1 - tw) / d * T))
+            dy0 = int(round((tn - y1) / d * T))
+            dy1 = int(round((tn - y0) / d * T))
+            if (dx1 <= dx0) or (dy1 <= dy0):
+                continue
+            box = ((x0 - west) / (east - west) * sx,
+                   (north - y1) / (north - south) * sy,
+                   (x1 - west) / (east - west) * sx,
+                   (north - y0) / (north - south) * sy)
+            part = image.resize((dx1 - dx0, dy1 - dy0), resample, box=box)
+            if not np.asarray(part)[:,:,3].any():
+                continue
+            tile = Image.new('RGBA', (T, T), (0, 0, 0, 0))
+            tile.paste(part, (dx0, dy0))
+            _save_tile(tile_dir, maxzoom, tx, ty, tile)
+            tiles.add((tx, ty))
+
+    levels = {maxzoom: tiles}
+    for zoom in range(maxzoom-1, minzoom-1, -1):
+        # each tile from the (up to) four tiles below it, with y upwards:
+        parents = set((tx // 2, ty // 2) for (tx, ty) in levels[zoom+1])
+        for (px, py) in parents:
+            quad = Image.new('RGBA', (2*T, 2*T), (0, 0, 0, 0))
+            for i in range(2):
+                for j in range(2):
+                    if (2*px+i, 2*py+j) in levels[zoom+1]:
+                        with Image.open(os.path.join(tile_dir, str(zoom+1),
+                                    str(2*px+i), '%i.png' % (2*py+j))) as im:
+                            quad.paste(im, (i*T, (1-j)*T))
+            _save_tile(tile_dir, zoom, px, py, quad.resize((T, T), resample))
+        levels[zoom] = parents
+
+    for zoom in levels:
+        for (tx, ty) in levels[zoom]:
+            children = []
+            if zoom < maxzoom:
+                children = sorted((cx, cy) for (cx, cy) in levels[zoom+1]
+                                  if (cx // 2, cy // 2) == (tx, ty))
+            with open(os.path.join(tile_dir, str(zoom), str(tx),
+                                   '%i.kml' % ty), 'w') as f:
+                f.write(_tile_kml(zoom, tx, ty, children, zoom == maxzoom))
+
+    with open(os.path.join(tile_dir, 'doc.kml'), 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<kml xmlns="http://www.opengis.net/kml/2.2">\n'
+                '  <Document>\n'
+                '    <name>%s</name>\n'
+                '    <open>1</open>\n' % name.replace('&', '&amp;')
+                                             .replace('<', '&lt;'))
+        for (tx, ty) in sorted(levels[minzoom]):
+            f.write(_network_link(minzoom, tx, ty, '%i/%i/%i.kml'
+                                  % (minzoom, tx, ty), '    '))
+        f.write('  </Document>\n</kml>\n')
+
+    return sum([len(level) for level in levels.values()])
+
+
+def _tile_job(job):
+    try:
+        return (job['png_file'], tile_image(**job), None)
+    except Exception as error:
+        return (job['png_file'], 0, '%s: %s' % (type(error).__name__, error))
+
+
+def tile_images(jobs, num_procs=None):
+    """
+    Run tile_image for each job in the list jobs, dictionaries of its
+    arguments, in a pool of num_procs processes (default: number of cpus).
+
+    Returns a list of tuples (png_file, number of tiles, error) in the
+    order of jobs, with error None or a message if tiling failed.
+    """
+
+    import multiprocessing
+
+    if num_procs is None:
+        num_procs = os.cpu_count() or 1
+    num_procs = min(num_procs, len(jobs))
+    if num_procs <= 1:
+        return [_tile_job(job) for job in jobs]
+    pool = multiprocessing.Pool(num_procs)
+    try:
+        return pool.map(_tile_job, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,234 @@
+"""
+Module kmzfile: write kmz (zip) files, compressing the entries in parallel.
+
+zipfile.ZipFile compresses the entries one at a time as they are written.
+KMZFile instead compresses them in a pool of threads (zlib releases the GIL
+while compressing) and writes them to the file in order as they are done,
+at most a few entries behind, so memory use does not grow with the size of
+the file.  Files that are already compressed, such as png images, are
+stored rather than deflated, which makes them much faster to add and the
+kmz file hardly larger.  Entries are written straight from the source
+files, so they do not need to be copied to a directory with the layout of
+the kmz file first.
+
+The files written are ordinary zip files, using the zip64 extensions when
+the file is larger than 4 GB or has more than 65535 entries.
+
+Used by plotpages.plotclaw2kml.
+"""
+
+import os
+import time
+import zlib
+import struct
+from collections import deque
+
+# extensions of files that are stored rather than deflated:
+stored_extensions = ['.png', '.jpg', '.jpeg', '.gif', '.kmz', '.zip', '.gz']
+
+# sizes and counts from which the zip64 extensions are used, and the
+# values then written in the fields for them:
+_ZIP64_LIMIT = 0xffffffff
+_ZIP64_COUNT_LIMIT = 0xffff
+_MAX32 = 0xffffffff
+_MAX16 = 0xffff
+
+
+def _dos_time(timestamp):
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    return (((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday,
+            (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2))
+
+
+def _compress(data, deflate, compresslevel):
+    crc = zlib.crc32(data) & 0xffffffff
+    if deflate:
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+        data = compressor.compress(data) + compressor.flush()
+    return crc, data
+
+
+class KMZFile(object):
+    """
+    A kmz file being written, e.g.
+
+        >>> kmz = KMZFile('_GoogleEarth.kmz')
+        >>> kmz.writestr('doc.kml', kml_text)
+        >>> kmz.write('frame0000fig1.png', 'fig1/frame0000fig1.png')
+        >>> kmz.close()
+
+    The data of each entry is read when it is added, so the source files
+    may be removed afterwards, and compressed in the background in
+    num_threads threads (default: number of cpus).
+    """
+
+    def __init__(self, file_name, num_threads=None, compresslevel=6):
+        from concurrent.futures import ThreadPoolExecutor
+
+        if num_threads is None:
+            num_threads = os.cpu_count() or 1
+        self.file_name = file_name
+        self.compresslevel = compresslevel
+        self._num_threads = num_threads
+        self._executor = ThreadPoolExecutor(max_workers=num_threads)
+        self._pending = deque()
+        self._entries = []      # central directory records
+        self._names = set()
+        self._file = open(file_name, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def writestr(self, arcname, data, date_time=None):
+        """
+        Add an entry arcname with contents data, bytes or a str written as
+        utf-8, and modification time date_time (default: now).
+        """
+
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if date_time is None:
+            date_time = time.time()
+        deflate = (os.path.splitext(arcname)[1].lower()
+                   not in stored_extensions) and (len(data) > 0)
+        self._add(arcname, data, deflate, date_time)
+
+    def write(self, file_name, arcname=None):
+        """
+        Add the file file_name as entry arcname, by default file_name
+        itself.  Directories are added as directory entries only, see
+        write_tree.
+        """
+
+        if arcname is None:
+            arcname = file_name
+        if os.path.isdir(file_name):
+            self._add(arcname.rstrip('/') + '/', b'', False,
+                      os.path.getmtime(file_name))
+            return
+        with open(file_name, 'rb') as f:
+            data = f.read()
+        self.writestr(arcname, data, os.path.getmtime(file_name))
+
+    def write_tree(self, directory, arcname=None):
+        """
+        Add the directory and all files in it, with names starting with
+        arcname (default: directory) in the kmz file.
+        """
+
+        if arcname is None:
+            arcname = directory
+        for dirname, subdirs, files in os.walk(directory):
+            subdirs.sort()
+            name = os.path.join(arcname, os.path.relpath(dirname, directory))
+            name = os.path.normpath(name)
+            self.write(dirname, name)
+            for filename in sorted(files):
+                self.write(os.path.join(dirname, filename),
+                           os.path.join(name, filename))
+
+    def _add(self, arcname, data, deflate, date_time):
+        arcname = arcname.replace(os.sep, '/')
+        if arcname.startswith('./'):
+            arcname = arcname[2:]
+        if arcname in self._names:
+            raise ValueError('duplicate name in %s: %s'
+                             % (self.file_name, arcname))
+        self._names.add(arcname)
+        future = self._executor.submit(_compress, data, deflate,
+                                       self.compresslevel)
+        self._pending.append((arcname, len(data), deflate, date_time,
+                              future))
+        while len(self._pending) > 2*self._num_threads:
+            self._write_entry(*self._pending.popleft())
+
+    def flush(self):
+        """Write all entries added so far to the file."""
+        while len(self._pending) > 0:
+            self._write_entry(*self._pending.popleft())
+
+    def _write_entry(self, arcname, size, deflate, date_time, future):
+        crc, data = future.result()
+        name = arcname.encode('utf-8')
+        offset = self._file.tell()
+        date, dostime = _dos_time(date_time)
+        method = 8 if deflate else 0
+        zip64 = max(size, len(data)) >= _ZIP64_LIMIT
+        if zip64:
+            extra = struct.pack('<HHQQ', 1, 16, size, len(data))
+            sizes = (_MAX32, _MAX32)
+        else:
+            extra = b''
+            sizes = (len(data), size)
+        version = 45 if zip64 else 20
+        self._file.write(struct.pack('<IHHHHHIIIHH', 0x04034b50, version,
+                                     0x800, method, dostime, date, crc,
+                                     sizes[0], sizes[1], len(name),
+                                     len(extra)))
+        self._file.write(name)
+        self._file.write(extra)
+        self._file.write(data)
+        self._entries.append((name, version, method, dostime, date, crc,
+                              len(data), size, offset,
+                              arcname.endswith('/')))
+
+    def close(self):
+        """Write the remaining entries and the central directory."""
+
+        if self._file is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
+
+        f = self._file
+        start = f.tell()
+        for (name, version, method, dostime, date, crc, csize, size,
+             offset, isdir) in self._entries:
+            fields = []
+            if size >= _ZIP64_LIMIT:
+                fields.append(size)
+                size = _MAX32
+            if csize >= _ZIP64_LIMIT:
+                fields.append(csize)
+                csize = _MAX32
+            if offset >= _ZIP64_LIMIT:
+                fields.append(offset)
+                offset = _MAX32
+            extra = b''
+            if len(fields) > 0:
+                version = 45
+                extra = struct.pack('<HH', 1, 8*len(fields)) \
+                        + struct.pack('<%iQ' % len(fields), *fields)
+            if isdir:
+                attributes = (0o40755 << 16) | 0x10
+            else:
+                attributes = 0o100644 << 16
+            f.write(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50,
+                                (3 << 8) | version, version, 0x800, method,
+                                dostime, date, crc, csize, size, len(name),
+                                len(extra), 0, 0, 0, attributes, offset))
+            f.write(name)
+            f.write(extra)
+        end = f.tell()
+
+        count = len(self._entries)
+        size = end - start
+        if (count >= _ZIP64_COUNT_LIMIT) or (start >= _ZIP64_LIMIT) \
+                or (size >= _ZIP64_LIMIT):
+            # zip64 end of central directory record and locator:
+            f.write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0,
+                                count, count, size, start))
+            f.write(struct.pack('<IIQI', 0x07064b50, 0, end, 1))
+            count = min(count, _MAX16)
+            size = min(size, _MAX32)
+            start = min(start, _MAX32)
+        f.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count,
+                            size, start, 0))
+        f.close()
+        self._file = None
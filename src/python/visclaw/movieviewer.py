@@ -0,0 +1,252 @@
+"""
+Module movieviewer: html movie pages that load the frame images lazily.
+
+The JSAnimation movies made by animation_tools.make_html embed every frame
+in the html file, base64 encoded, so for long runs the pages are hundreds
+of MB, take minutes to make and may crash the browser.  The older
+plotpages.htmlmovie pages load every image when the page is opened.
+
+The viewer made here instead refers to the png files by their URL, listed
+in a small JSON manifest, and only loads the frames in a window around the
+frame shown.  The slider can be used to move to any frame.  Making the page
+only requires writing the manifest, so it takes milliseconds.
+
+The manifest is written to a file movie_figN.json next to the html file for
+use by other tools, and is also included in the html file, since browsers
+do not allow pages opened from file:// URLs to load other files.
+
+Alternatively the frames can be packed, scaled down, into a few large
+sprite sheets by animation_tools.make_sprite_sheets, so that the movie is
+shown with a few requests rather than one for each frame, which is better
+for pages on a web server.
+
+Used by plotpages.plotclaw2html when plotdata.html_movie == 'lazy' and by
+plotpages.plotclaw_driver when plotdata.html_movie == 'sprites'.  It can
+also be used directly, e.g.
+
+    >>> from clawpack.visclaw import movieviewer
+    >>> manifest = movieviewer.make_manifest(['frame0000fig1.png',
+    ...                                       'frame0001fig1.png'])
+    >>> movieviewer.write_viewer('_plots/movie_fig1.html', manifest)
+"""
+
+import os
+import json
+
+
+def make_manifest(frames, times=None, title='', index_url=None,
+                  interval=200, ahead=10, behind=3):
+    """
+    Return the manifest, a dictionary that can be written as JSON, for a
+    movie of the images with the URLs in the list frames, relative to the
+    html page.
+
+    times is an optional list of the time of each frame, shown with the
+    frame.  index_url is the page linked to as the Plot Index.  interval
+    is the time between frames in milliseconds when the movie is played,
+    and the viewer loads the ahead frames after the one shown and behind
+    frames before it.
+    """
+
+    if times is None:
+        times = [None] * len(frames)
+    manifest = {'title': title,
+                'index': index_url,
+                'interval': interval,
+                'ahead': ahead,
+                'behind': behind,
+                'frames': [{'src': src, 't': t}
+                           for src, t in zip(frames, times)]}
+    return manifest
+
+
+def make_sprite_manifest(sprites, times=None, title='', index_url=None,
+                         interval=200, ahead=None, behind=None):
+    """
+    Return the manifest for a movie of frames packed in sprite sheets by
+    animation_tools.make_sprite_sheets, which returns the index sprites.
+    The sheet names in sprites must be URLs relative to the html page.
+
+    The viewer loads the sheets holding the frames from behind frames
+    before the one shown to ahead frames after it, by default the sheet
+    shown and the next one.  See make_manifest for the other arguments.
+    """
+
+    frames_per_sheet = max(len([frame for frame in sprites['frames']
+                                if frame['sheet'] == 0]), 1)
+    if ahead is None:
+        ahead = frames_per_sheet
+    if behind is None:
+        behind = 0
+    manifest = make_manifest([None] * len(sprites['frames']), times, title,
+                             index_url, interval, ahead, behind)
+    for frame, sprite in zip(manifest['frames'], sprites['frames']):
+        frame.pop('src')
+        frame.update(sprite)
+    manifest['sheets'] = sprites['sheets']
+    manifest['width'] = sprites['width']
+    manifest['height'] = sprites['height']
+    return manifest
+
+
+def write_viewer(html_fname, manifest, json_fname=None):
+    """
+    Write the viewer page html_fname for the movie described by manifest,
+    see make_manifest, and the manifest itself to json_fname, by default
+    html_fname with extension .json.
+    """
+
+    if json_fname is None:
+        json_fname = os.path.splitext(html_fname)[0] + '.json'
+    with open(json_fname, 'w') as f:
+        json.dump(manifest, f)
+
+    # "</" would end the script element the manifest is in:
+    manifest_json = json.dumps(manifest).replace('</', '<\\/')
+    title = manifest.get('title', '') or 'Movie'
+    title = title.replace('&', '&amp;').replace('<', '&lt;')
+    html = _viewer_template.replace('__TITLE__', title)
+    html = html.replace('__MANIFEST__', manifest_json)
+    with open(html_fname, 'w') as f:
+        f.write(html)
+
+
+_viewer_template = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+  body {font-family: sans-serif; text-align: center;}
+  #controls {margin: 8px;}
+  #controls input[type=range] {width: 60%; vertical-align: middle;}
+  #movie {max-width: 100%;}
+</style>
+</head>
+<body>
+<h3 id="index"></h3>
+<h2>__TITLE__</h2>
+<div id="controls">
+  <button onclick="viewer.show(0)">&#x23EE;</button>
+  <button onclick="viewer.show(viewer.frame - 1)">&#x25C0;</button>
+  <button id="play" onclick="viewer.toggle()">Play</button>
+  <button onclick="viewer.show(viewer.frame + 1)">&#x25B6;</button>
+  <button onclick="viewer.show(viewer.frames.length - 1)">&#x23ED;</button>
+  <button onclick="viewer.interval /= 0.7">Slower</button>
+  <button onclick="viewer.interval *= 0.7">Faster</button>
+  <br>
+  <input id="slider" type="range" min="0" value="0"
+         oninput="viewer.show(parseInt(this.value))">
+  <div id="label"></div>
+</div>
+<img id="movie">
+<div id="sprite" style="display: none; margin: auto;"></div>
+
+<script id="manifest" type="application/json">__MANIFEST__</script>
+<script>
+var viewer = (function () {
+  var manifest = JSON.parse(document.getElementById('manifest').textContent);
+  var v = {frames: manifest.frames, frame: 0, playing: false,
+           interval: manifest.interval || 200, cache: {}};
+  var img = document.getElementById('movie');
+  var sprite = document.getElementById('sprite');
+  var slider = document.getElementById('slider');
+  var label = document.getElementById('label');
+  var timer = null;
+
+  if (manifest.index) {
+    document.getElementById('index').innerHTML =
+      '<a href="' + encodeURI(manifest.index) + '">Plot Index</a>';
+  }
+  slider.max = Math.max(v.frames.length - 1, 0);
+  if (manifest.sheets) {
+    // frames packed in sprite sheets, shown as part of a background image
+    img.style.display = 'none';
+    sprite.style.display = 'block';
+    sprite.style.width = manifest.width + 'px';
+    sprite.style.height = manifest.height + 'px';
+  }
+
+  // URL of the image holding frame k
+  function url(k) {
+    var frame = v.frames[k];
+    return manifest.sheets ? manifest.sheets[frame.sheet] : frame.src;
+  }
+
+  function load(k) {
+    var u = url(k);
+    if (!(u in v.cache)) {
+      var im = new Image();
+      im.src = u;
+      v.cache[u] = im;
+    }
+    return v.cache[u];
+  }
+
+  // keep only the images for a window of frames around frame k loaded
+  function prefetch(k) {
+    var lo = Math.max(k - (manifest.behind || 0), 0);
+    var hi = Math.min(k + (manifest.ahead || 0), v.frames.length - 1);
+    var keep = {};
+    for (var j = lo; j <= hi; j++) keep[url(j)] = true;
+    for (var u in v.cache) {
+      if (!(u in keep)) {
+        v.cache[u].src = '';
+        delete v.cache[u];
+      }
+    }
+    for (var j = k; j <= hi; j++) load(j);
+    for (var j = k - 1; j >= lo; j--) load(j);
+  }
+
+  v.show = function (k) {
+    if (v.frames.length == 0) return;
+    k = Math.min(Math.max(k, 0), v.frames.length - 1);
+    v.frame = k;
+    if (manifest.sheets) {
+      var frame = v.frames[k];
+      sprite.style.backgroundImage = 'url("' + encodeURI(url(k)) + '")';
+      sprite.style.backgroundPosition = (-frame.x) + 'px ' + (-frame.y) + 'px';
+    } else {
+      img.src = url(k);
+    }
+    slider.value = k;
+    var text = 'Frame ' + (k + 1) + ' of ' + v.frames.length;
+    if (v.frames[k].t !== null && v.frames[k].t !== undefined) {
+      text += ', t = ' + v.frames[k].t;
+    }
+    label.textContent = text;
+    prefetch(k);
+  };
+
+  function tick() {
+    var next = (v.frame + 1) % v.frames.length;
+    // wait for the next image rather than showing a blank frame
+    if (load(next).complete) v.show(next);
+    timer = setTimeout(tick, load(next).complete ? v.interval : 20);
+  }
+
+  v.toggle = function () {
+    v.playing = !v.playing;
+    document.getElementById('play').textContent = v.playing ? 'Pause' : 'Play';
+    if (v.playing) {
+      timer = setTimeout(tick, v.interval);
+    } else {
+      clearTimeout(timer);
+    }
+  };
+
+  document.addEventListener('keydown', function (e) {
+    if (e.target == slider) return;
+    if (e.key == 'ArrowRight') v.show(v.frame + 1);
+    else if (e.key == 'ArrowLeft') v.show(v.frame - 1);
+    else if (e.key == ' ') {v.toggle(); e.preventDefault();}
+  });
+
+  v.show(0);
+  return v;
+})();
+</script>
+</body>
+</html>
+"""
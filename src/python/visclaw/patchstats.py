@@ -0,0 +1,259 @@
+"""
+Module patchstats: the number of patches and cells on each AMR level of each
+frame, from the patch headers only.
+
+Finding how many patches and grid cells each level has in each frame, e.g.
+to plan the memory and disk space a run needs or to see why some frames are
+slow to plot, used to mean reading every frame with getframe.  Here only the
+headers of the patches in the fort.q files are read: for binary output
+(file_format 'binary32' or 'binary64') the fort.q file holds nothing else,
+and for ascii output the file is searched for the headers without converting
+the values in between.  The frames are scanned in a pool of processes.
+
+scan_frames returns a PatchStats object with NumPy arrays indexed by frame
+and level, e.g.
+
+    >>> from clawpack.visclaw import patchstats
+    >>> stats = patchstats.scan_frames('_output')
+    >>> stats.cells[:, 1]       # cells on level 2 in each frame
+    >>> print(stats.table())
+
+Levels are numbered from 1 as in AMRClaw and GeoClaw; pass level_base=0 for
+ForestClaw output, whose levels start at 0.
+
+See plot_patch_stats.py for plots of them.
+"""
+
+import os
+import glob
+import mmap
+
+import numpy as np
+
+
+def _read_t(fname):
+    # time and number of patches and dimensions from a fort.t file:
+    with open(fname) as f:
+        values = [line.split()[0] for line in f if line.strip()]
+    return float(values[0]), int(values[2]), int(values[4])
+
+
+def read_headers(outdir, frameno, file_prefix='fort'):
+    """
+    Read the patch headers of frame frameno in outdir.
+
+    Returns a dictionary with the time 't' of the frame, the number of
+    space dimensions 'num_dim', and arrays with an entry per patch:
+    'patch_number', 'level', 'num_cells' (number of cells in each
+    dimension, of shape (number of patches, num_dim)), 'lower' and 'delta'
+    (of the same shape).
+    """
+
+    prefix = os.path.join(outdir, '%s.' % file_prefix)
+    tname = prefix + 't%s' % str(frameno).zfill(4)
+    t, nstates, num_dim = _read_t(tname)
+    nlines = 2 + 3*num_dim
+
+    patch_number = np.zeros(nstates, dtype=int)
+    level = np.zeros(nstates, dtype=int)
+    num_cells = np.zeros((nstates, num_dim), dtype=np.int64)
+    lower = np.zeros((nstates, num_dim))
+    delta = np.zeros((nstates, num_dim))
+
+    fname = prefix + 'q%s' % str(frameno).zfill(4)
+    with open(fname, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            mm = b''
+        else:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            # each header starts with a line ending in grid_number or
+            # patch_number, which the lines of values never contain:
+            pos = 0
+            for k in range(nstates):
+                pos = mm.find(b'_number', pos)
+                if pos < 0:
+                    raise ValueError('%s has %i patch headers, %s says %i'
+                                     % (fname, k, tname, nstates))
+                start = mm.rfind(b'\n', 0, pos) + 1
+                lines = []
+                while len(lines) < nlines:
+                    end = mm.find(b'\n', start)
+                    if end < 0:
+                        end = len(mm)
+                    line = mm[start:end].split()
+                    if len(line) == 0:
+                        raise ValueError('incomplete patch header in %s'
+                                         % fname)
+                    lines.append(line[0])
+                    start = end + 1
+                patch_number[k] = int(lines[0])
+                level[k] = int(lines[1])
+                num_cells[k] = [int(n) for n in lines[2:2+num_dim]]
+                lower[k] = [float(x) for x in lines[2+num_dim:2+2*num_dim]]
+                delta[k] = [float(x) for x in lines[2+2*num_dim:]]
+                pos = start
+        finally:
+            if not isinstance(mm, bytes):
+                mm.close()
+
+    return {'t': t, 'num_dim': num_dim, 'patch_number': patch_number,
+            'level': level, 'num_cells': num_cells, 'lower': lower,
+            'delta': delta}
+
+
+def level_stats(headers, num_levels=None, level_base=1):
+    """
+    Return arrays of the number of patches, the number of cells and the
+    area covered (length in 1d, volume in 3d) on each level, with entry j
+    for level j+level_base, from the headers returned by read_headers.
+    """
+
+    level = headers['level'] - level_base
+    if len(level) > 0 and level.min() < 0:
+        raise ValueError('level %i is below level_base = %i, e.g. use '
+                         'level_base = 0 for ForestClaw output'
+                         % (level.min() + level_base, level_base))
+    if num_levels is None:
+        num_levels = int(level.max()) + 1 if len(level) > 0 else 0
+    cells = np.prod(headers['num_cells'], axis=1)
+    area = np.prod(headers['num_cells'] * headers['delta'], axis=1)
+    patches = np.bincount(level, minlength=num_levels)[:num_levels]
+    cells = np.bincount(level, weights=cells,
+                        minlength=num_levels)[:num_levels]
+    area = np.bincount(level, weights=area,
+                       minlength=num_levels)[:num_levels]
+    return patches, cells.astype(np.int64), area
+
+
+def _scan_task(args):
+    outdir, frameno, file_prefix, level_base = args
+    try:
+        headers = read_headers(outdir, frameno, file_prefix)
+        return frameno, headers['t'], headers['num_dim'], \
+               level_stats(headers, level_base=level_base), None
+    except Exception as error:
+        return frameno, None, None, None, '%s: %s' % (type(error).__name__,
+                                                      error)
+
+
+class PatchStats(object):
+    """
+    The patches and cells on each level of a sequence of frames, see
+    scan_frames.  Arrays indexed by frame:
+
+        framenos:  the frame numbers
+        t:         the times of the frames
+
+    and arrays of shape (number of frames, num_levels), with column j for
+    AMR level j+level_base (1, or 0 for ForestClaw):
+
+        patches:   the number of patches
+        cells:     the number of grid cells
+        area:      the area covered by the patches (length in 1d, volume
+                   in 3d), equal on all levels where the finer levels cover
+                   the whole domain
+    """
+
+    def __init__(self, framenos, t, patches, cells, area, num_dim=None,
+                 level_base=1):
+        self.framenos = np.asarray(framenos, dtype=int)
+        self.t = np.asarray(t, dtype=float)
+        self.patches = np.asarray(patches, dtype=int)
+        self.cells = np.asarray(cells, dtype=np.int64)
+        self.area = np.asarray(area, dtype=float)
+        self.num_dim = num_dim
+        self.level_base = level_base
+
+    @property
+    def num_levels(self):
+        return self.patches.shape[1]
+
+    def table(self):
+        """
+        Return a table of the number of patches and cells on each level
+        of each frame, as a string.
+        """
+
+        lines = ['%6s %14s %8s %9s %11s %12s' % ('frame', 't', 'level',
+                                                 'patches', 'cells',
+                                                 'fraction')]
+        for n, frameno in enumerate(self.framenos):
+            for j in range(self.num_levels):
+                if self.patches[n, j] == 0:
+                    continue
+                fraction = self.area[n, j] / self.area[n, 0] \
+                           if self.area[n, 0] > 0 else np.nan
+                lines.append('%6i %14.6g %8i %9i %11i %12.4f'
+                             % (frameno, self.t[n], j + self.level_base,
+                                self.patches[n, j], self.cells[n, j],
+                                fraction))
+            lines.append('%6i %14.6g %8s %9i %11i'
+                         % (frameno, self.t[n], 'total',
+                            self.patches[n].sum(), self.cells[n].sum()))
+        return '\n'.join(lines)
+
+
+def scan_frames(outdir='_output', framenos='all', file_prefix='fort',
+                num_procs=None, verbose=True, level_base=1):
+    """
+    Read the patch headers of the frames in framenos ('all' for all frames
+    with a fort.t file in outdir) in num_procs processes (default: number of
+    cpus) and return a PatchStats object.  Frames that cannot be read are
+    left out with a warning.  level_base is the number of the coarsest
+    level, 1 for AMRClaw and GeoClaw output and 0 for ForestClaw output.
+    """
+
+    import multiprocessing
+
+    if file_prefix is None:
+        file_prefix = 'fort'
+    if framenos == 'all':
+        # frame numbers have at least 4 digits, more from frame 10000 on:
+        prefix = os.path.join(outdir, '%s.t' % file_prefix)
+        framenos = sorted([int(f[len(prefix):])
+                           for f in glob.glob(glob.escape(prefix) + '[0-9]*')
+                           if f[len(prefix):].isdigit()
+                           and len(f) - len(prefix) >= 4])
+    framenos = list(framenos)
+    todo = [(outdir, frameno, file_prefix, level_base)
+            for frameno in framenos]
+
+    if num_procs is None:
+        num_procs = os.cpu_count() or 1
+    num_procs = min(num_procs, len(todo))
+    if multiprocessing.current_process().daemon:
+        # in a worker of parallel plotting, which cannot start processes
+        num_procs = 1
+    if num_procs > 1:
+        pool = multiprocessing.Pool(num_procs)
+        try:
+            chunksize = max(1, len(todo) // (4*num_procs))
+            results = pool.map(_scan_task, todo, chunksize=chunksize)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_scan_task(args) for args in todo]
+
+    good = []
+    num_dim = None
+    for frameno, t, dim, stats, error in results:
+        if error is not None:
+            if verbose:
+                print('*** Warning: headers of frame %s not read: %s'
+                      % (frameno, error))
+            continue
+        good.append((frameno, t, stats))
+        num_dim = dim
+
+    num_levels = max([len(stats[0]) for frameno, t, stats in good] + [0])
+    nframes = len(good)
+    patches = np.zeros((nframes, num_levels), dtype=int)
+    cells = np.zeros((nframes, num_levels), dtype=np.int64)
+    area = np.zeros((nframes, num_levels))
+    for n, (frameno, t, stats) in enumerate(good):
+        nlev = len(stats[0])
+        patches[n, :nlev], cells[n, :nlev], area[n, :nlev] = stats
+    return PatchStats([g[0] for g in good], [g[1] for g in good], patches,
+                      cells, area, num_dim, level_base)
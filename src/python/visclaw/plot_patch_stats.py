@@ -0,0 +1,193 @@
+"""
+Plot the number of patches and grid cells on each AMR level in each frame,
+read from the patch headers of the output files by patchstats.scan_frames.
+
+If you execute this at the command line you can specify the output
+directory, e.g.
+
+    python plot_patch_stats.py _output
+
+and plots will be made and png files placed in the output directory,
+along with patches.html to view them and a table of the numbers printed.
+
+For more control, import this module and call the function `make_plots`,
+as for plot_timing_stats.py.  This allows setting units and also
+redirecting the png files to the _plots directory.
+"""
+
+from __future__ import print_function
+import os
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+# text for html file showing all plots:
+
+html_text1 = """
+    <html>
+    <h1>Patches and cells on each level</h1>
+    <p>
+    <pre>
+    """
+html_text2 = """
+    </pre>
+    <p>
+    <img width=30% src="patches_Patches.png">
+    <img width=30% src="patches_Cells.png">
+    <img width=30% src="patches_Area.png">
+
+    </html>
+"""
+
+#=======================================================================
+
+def make_plots(outdir='_output', make_pngs=True, make_html=None,
+               plotdir=None, units={}, framenos='all', file_prefix='fort',
+               num_procs=None, level_base=1):
+
+    """
+    `outdir` is the directory containing the fort.t and fort.q files.
+    The patch headers of the frames in `framenos` are read in `num_procs`
+    processes, see patchstats.scan_frames, which is also returned.
+    Set `level_base` to 0 for ForestClaw output, whose levels start at 0.
+    Set `make_pngs` to `True` to create png files,
+    By default, an html index will be made if `make_pngs == True` but
+    you can turn this off by setting `make_html` to `False`.
+    If `plotdir == None` then png file will be put in `outdir`.
+
+    The `units` dictionary is used as in plot_timing_stats.make_plots:
+
+    units['simtime'] and units['simtime_factor'] give the units of the
+        simulation time t, which is divided by units['simtime_factor']
+        before plotting.  The factor defaults to 1, 60, 3600, or 24*3600 if
+        units['simtime'] is 'seconds', 'minutes', 'hours', or 'days', and
+        to 1 otherwise.
+
+    units['cell'] is the units used in plotting the number of grid cells:
+        'raw count' (the default), 'thousands', 'millions', 'billions', or
+        'trillions', or any string along with units['cell_factor'].
+    """
+
+    from clawpack.visclaw import patchstats
+
+    if plotdir is None:
+        plotdir = outdir
+    if make_pngs:
+        os.system('mkdir -p %s' % plotdir)
+
+    if make_html is None:
+        make_html = make_pngs
+
+    if make_html and (not make_pngs):
+        print('Warning: will make html index but no png files')
+
+    def make_png(fname):
+        if make_pngs:
+            plt.tight_layout() # since labels sometimes disappear
+            fname = os.path.join(plotdir, fname)
+            plt.savefig(fname)
+            print('Created %s' % fname)
+
+    simtime_units = units.get('simtime', 'dimensionless')
+    simtime_factor = units.get('simtime_factor',
+                               {'seconds': 1, 'minutes': 60.,
+                                'hours': 3600.,
+                                'days': 24*3600.}.get(simtime_units, 1))
+
+    cell_units = units.get('cell', 'raw count')
+    cell_factor = units.get('cell_factor',
+                            {'thousands': 1e3, 'millions': 1e6,
+                             'billions': 1e9,
+                             'trillions': 1e12}.get(cell_units, 1))
+
+    # define colors, with colors[j+1] for the j'th level from the coarsest
+    colors = ['gray'] + 3*['r','c','m','limegreen','b','orange','g','yellow']
+
+    stats = patchstats.scan_frames(outdir, framenos, file_prefix, num_procs,
+                                   level_base=level_base)
+    if len(stats.framenos) == 0:
+        print('*** No frames found in %s' % outdir)
+        return stats
+
+    time = stats.t / simtime_factor
+    nlevels = stats.num_levels
+    if len(time) > 1:
+        xlimits = [time.min(), time.max()]
+    else:
+        xlimits = [time[0] - 0.5, time[0] + 0.5]
+
+    def stacked(values, name):
+        # values on each level stacked, with a line through each frame:
+        sum_over_levels = np.zeros(len(time))
+        for j in range(nlevels):
+            last_sum = sum_over_levels.copy()
+            sum_over_levels += values[:,j]
+            plt.fill_between(time, last_sum, sum_over_levels,
+                             color=colors[j+1], edgecolor=None,
+                             label='Level %s' % (j + stats.level_base))
+            plt.plot(time, sum_over_levels, 'k')
+        plt.plot(time, sum_over_levels, 'ko', markersize=3,
+                 label='Total %s' % name)
+        plt.xlim(xlimits)
+        plt.ylim(0, 1.1*max(sum_over_levels.max(), 1))
+        plt.xlabel('Simulation time t (%s)' % simtime_units)
+        plt.legend(loc='upper left')
+
+
+    plt.figure(51)
+    plt.clf()
+    stacked(stats.patches.astype(float), 'patches')
+    plt.title('Number of patches on each level')
+    plt.ylabel('Patches')
+
+    make_png('patches_Patches.png')
+
+
+    plt.figure(52)
+    plt.clf()
+    stacked(stats.cells / cell_factor, 'cells')
+    plt.title('Number of grid cells on each level')
+    if cell_units == 'raw count':
+        plt.ylabel('Grid cells')
+    else:
+        plt.ylabel('Grid cells (%s)' % cell_units)
+
+    make_png('patches_Cells.png')
+
+
+    # area covered by each level, as a fraction of the coarsest level area:
+
+    plt.figure(53)
+    plt.clf()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = stats.area / stats.area[:,:1]
+    for j in range(nlevels):
+        plt.plot(time, fraction[:,j], 'o-', color=colors[j+1], markersize=3,
+                 label='Level %s' % (j + stats.level_base))
+    plt.xlim(xlimits)
+    plt.ylim(0, 1.1)
+    plt.title('Fraction of the domain covered by each level')
+    plt.xlabel('Simulation time t (%s)' % simtime_units)
+    plt.ylabel('Fraction of level %s area' % stats.level_base)
+    plt.legend(loc='upper right')
+
+    make_png('patches_Area.png')
+
+    if make_html:
+        html_text = html_text1 + stats.table() + html_text2
+        html_file = os.path.join(plotdir, 'patches.html')
+        with open(html_file,'w') as h:
+            h.write(html_text)
+        print('Created %s' % html_file)
+
+    return stats
+
+
+if __name__=='__main__':
+    import sys
+    if len(sys.argv) > 1:
+        outdir = sys.argv[1]
+    else:
+        outdir = '_output'
+    stats = make_plots(outdir)
+    print(stats.table())
@@ -15,6 +15,10 @@ From most Clawpack applications directories the command
     $ make .plots
 will call the plotclaw function from this module.
 
+If setplot sets plotdata.parallel = True and plotdata.parallel_backend = 'mpi'
+the plotting can be distributed over several nodes using mpi4py, e.g.
+    $ mpirun -n 4 python $CLAW/visclaw/src/python/visclaw/plotclaw.py _output _plots
+
 """
 
 import matplotlib
@@ -23,13 +27,592 @@ matplotlib.use('Agg')
 import sys
 import os
 import time
-import subprocess
+import json
+import glob
+import signal
+import traceback
 
 import clawpack.visclaw.frametools as frametools
 
+# ClawPlotData object used by each worker process in parallel plotting,
+# set up once per process by _init_worker, or the error setplot raised there,
+# and the queue on which the worker reports each task it starts:
+_worker_plotdata = None
+_worker_error = None
+_worker_started = None
+
+
+def _init_worker(outdir, plotdir, setplot, format, started=None):
+    """
+    Initialize a worker process for parallel plotting by calling setplot
+    once, so that frames, gauges and other figures can then be plotted one
+    at a time as they are pulled from the shared work queue.
+
+    If setplot fails the error is kept and reported by _plot_task as the
+    failure of every task, rather than raised here, which would stop the
+    worker before it takes any task.
+
+    If started is a multiprocessing.SimpleQueue, (pid, None, time) is put
+    on it now and (pid, task, time) whenever a task is started, see
+    _run_pool.
+    """
+
+    global _worker_plotdata, _worker_error, _worker_started
+    from clawpack.visclaw.data import ClawPlotData
+
+    _worker_started = started
+    if started is not None:
+        started.put((os.getpid(), None, time.time()))
+
+    try:
+        plotdata = ClawPlotData(file_format=format)
+        plotdata.outdir = outdir
+        plotdata.plotdir = plotdir
+        plotdata.setplot = setplot
+        plotdata.format = format
+        plotdata = frametools.call_setplot(plotdata.setplot, plotdata,
+                                           verbose=False)
+        _worker_plotdata = _worker_setup(plotdata)
+    except Exception as e:
+        traceback.print_exc()
+        _worker_error = 'setplot failed in worker, %s: %s' \
+                        % (type(e).__name__, e)
+
+
+def _worker_setup(plotdata):
+    """
+    Set the options of plotdata needed to plot individual tasks.
+    """
+
+    from clawpack.visclaw import plotpages
+
+    plotpages.set_figure_dpi()
+    plotdata._parallel_todo = 'frames'
+    plotdata._mode = 'printframes'
+    plotdata.save_frames = False   # only one frame in memory at a time
+    plotdata.num_procs = 1         # e.g. for framestats, no pools in workers
+    return plotdata
+
+
+class _TaskTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise _TaskTimeout()
+
+
+def _plot_task(task):
+    """
+    Plot a single task in a worker process, where task is one of
+        ('frame', frameno), ('gauge', gaugeno) or ('otherfigure', name).
+
+    Returns (pid, task, elapsed time, success, error message) for the
+    utilization report and the progress manifest.  A task that raises an
+    exception or takes longer than plotdata.parallel_timeout seconds is
+    reported here and skipped, so it does not stop the other workers.
+    """
+
+    import matplotlib.pyplot as plt
+    from clawpack.visclaw import gaugetools, plotpages, animation_tools
+
+    kind, key = task
+    if _worker_started is not None:
+        _worker_started.put((os.getpid(), task, time.time()))
+    if _worker_error is not None:
+        print('*** Warning: Unable to plot %s %s, %s' \
+              % (kind, key, _worker_error))
+        return (os.getpid(), task, 0., False, _worker_error)
+
+    plotdata = _worker_plotdata
+    error = None
+    t_start = time.time()
+
+    timeout = plotdata.parallel_timeout
+    use_timer = (timeout is not None) and hasattr(signal, 'SIGALRM')
+    if use_timer:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    try:
+        if kind == 'frame':
+            frametools.plotframe(key, plotdata, verbose=False)
+            print('Creating png for Frame %i' % key)
+
+        elif kind == 'gauge':
+            gaugetools.plotgauge(key, plotdata, verbose=False)
+            print('Found data for Gauge %i ' % key)
+
+        elif kind == 'otherfigure':
+            plotpages.plot_otherfigure(key, plotdata)
+
+        # reduced copies of the png files, made while the next figure
+        # was plotted, must be done when the task is:
+        animation_tools.wait_for_reduced_images()
+
+    except _TaskTimeout:
+        error = 'timed out after %s seconds' % timeout
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+        traceback.print_exc()
+
+    finally:
+        if use_timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        # the gauge data is read once for all figures of this gauge,
+        # no need to keep it around afterwards:
+        plotdata.gaugesoln_dict.clear()
+
+    if error is not None:
+        if kind == 'gauge':
+            print('*** Warning: Unable to plot Gauge %i' % key)
+        else:
+            print('*** Warning: Unable to plot %s %s, %s' \
+                  % (kind, key, error))
+        # don't leave partial figures around for the next task:
+        plt.close('all')
+
+    return (os.getpid(), task, time.time() - t_start, error is None, error)
+
+
+def _terminate_workers(pool, pids):
+    """
+    Stop the worker processes of the ProcessPoolExecutor pool, with process
+    ids pids, including those stuck in a task, and cancel the tasks not
+    started.
+    """
+
+    if hasattr(pool, 'terminate_workers'):
+        pool.terminate_workers()     # Python >= 3.14
+        return
+    pool.shutdown(wait=False, cancel_futures=True)
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass    # already gone
+
+
+# Error recorded for the task that was being plotted by a process that died:
+_process_died = 'a plotting process died'
+
+
+def _run_pool(tasks, num_procs, initargs, wait, record):
+    """
+    Plot tasks in a pool of num_procs worker processes that each call
+    setplot once (see _init_worker with initargs) and then take the next
+    task as they become idle, calling record with each result of
+    _plot_task.
+
+    Returns (lost, suspects).  lost is None if all tasks were plotted.
+    Otherwise it is the error to report for the tasks in suspects, which
+    were being plotted when a worker process died (lost is _process_died)
+    or which had not finished after wait seconds, when the workers were
+    stopped.  The other tasks without a result were not started or were
+    interrupted by this, and can be plotted again.
+    """
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, \
+         wait as wait_futures, FIRST_COMPLETED
+    from concurrent.futures.process import BrokenProcessPool
+
+    started = multiprocessing.SimpleQueue()
+    pool = ProcessPoolExecutor(num_procs, initializer=_init_worker,
+                               initargs=initargs + (started,))
+    pids = set()
+    in_flight = {}     # task: time it was started
+    lost = None
+    suspects = []
+    t_event = time.time()
+    try:
+        pending = set([pool.submit(_plot_task, task) for task in tasks])
+        while len(pending) > 0:
+            # poll often to keep the queue of started tasks short:
+            done, pending = wait_futures(pending, timeout=1.,
+                                         return_when=FIRST_COMPLETED)
+            while not started.empty():
+                pid, task, t_start = started.get()
+                pids.add(pid)
+                if task is not None:
+                    in_flight[task] = t_start
+                t_event = time.time()
+            for future in done:
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    lost = _process_died
+                    continue
+                in_flight.pop(result[1], None)
+                record(result)
+                t_event = time.time()
+            if lost is not None:
+                # the other futures fail at once, some may have results:
+                for future in wait_futures(pending)[0]:
+                    if future.exception() is None:
+                        in_flight.pop(future.result()[1], None)
+                        record(future.result())
+                suspects = list(in_flight.keys())
+                break
+            if wait is not None:
+                now = time.time()
+                suspects = [task for task in in_flight.keys()
+                            if now - in_flight[task] > wait]
+                if (len(suspects) > 0) or (now - t_event > wait):
+                    # stuck in a task, or outside of Python, e.g. in setplot:
+                    lost = 'no result received after %s seconds' % wait
+                    _terminate_workers(pool, pids)
+                    break
+
+    except:
+        _terminate_workers(pool, pids)
+        raise
+
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    return lost, suspects
+
+
+def _print_utilization(results, wall_time):
+    """
+    Print the number of tasks plotted and the fraction of the wall time
+    each worker process was busy, from the results of _plot_task.
+    """
+
+    busy = {}
+    count = {}
+    for (pid, task, elapsed, success, error) in results:
+        busy[pid] = busy.get(pid, 0.) + elapsed
+        count[pid] = count.get(pid, 0) + 1
+
+    num_frames = len([r for r in results if r[1][0] == 'frame'])
+    num_gauges = len([r for r in results if r[1][0] == 'gauge'])
+    print("\nParallel plotting: %i frames and %i gauges on %i processes " \
+          % (num_frames, num_gauges, len(busy)) \
+          + "in %.1f seconds" % wall_time)
+    print("    %10s  %8s  %10s  %12s" \
+          % ('process', 'tasks', 'busy (s)', 'utilization'))
+    for pid in sorted(busy.keys()):
+        if wall_time > 0:
+            utilization = 100. * busy[pid] / wall_time
+        else:
+            utilization = 100.
+        print("    %10i  %8i  %10.1f  %11.1f%%" \
+              % (pid, count[pid], busy[pid], utilization))
+
+
+def _print_failures(progress):
+    """
+    Print the frames, gauges and other figures that could not be plotted.
+    """
+
+    failed = sorted([key for key in progress.keys()
+                     if progress[key]['status'] != 'done'])
+    if len(failed) > 0:
+        print("*** Warning: %i tasks could not be plotted:" % len(failed))
+        for key in failed:
+            print("***     %s: %s" % (key, progress[key]['error']))
+        print("*** Use plotclaw(..., resume=True) to plot only these again")
+
+
+def _parallel_tasks(plotdata, framenos):
+    """
+    Return the list of tasks for the parallel workers, see _plot_task,
+    together with the names of the other figures and the gauge numbers
+    included.  Frames come first, ordered by plotdata.parallel_order,
+    then other figures, then gauges.
+    """
+
+    from clawpack.visclaw import plotpages
+
+    if plotdata.parallel_order == 'cost':
+        # hand out the most expensive frames first so that no
+        # process is left with a large frame at the end:
+        costs = frametools.frame_costs(framenos, plotdata.outdir,
+                                       plotdata.file_prefix)
+        framenos = sorted(framenos, key=lambda n: -costs[n])
+
+    tasks = [('frame', frameno) for frameno in framenos]
+
+    # each_run figures made by otherfigure makefig functions:
+    if plotdata.html:
+        otherfignames = list(plotdata.otherfigure_dict.keys())
+    else:
+        otherfignames = []
+    tasks += [('otherfigure', name) for name in otherfignames]
+
+    # Gauges are queued last, the many small tasks help to keep all
+    # processes busy until the end:
+    gauge_figures = [figname for figname in plotdata._fignames
+            if plotdata.plotfigure_dict[figname].type == 'each_gauge'
+            and plotdata.plotfigure_dict[figname]._show]
+    if plotdata.printfigs and (len(gauge_figures) > 0) and \
+            os.path.exists(os.path.join(plotdata.outdir, "gauges.data")):
+        gaugenos = plotpages.get_gaugenos(plotdata)
+    else:
+        gaugenos = []
+    tasks += [('gauge', gaugeno) for gaugeno in gaugenos]
+
+    return tasks, otherfignames, gaugenos
+
+
+def _set_parallel_results(plotdata, progress, otherfignames, gaugenos):
+    """
+    Let the driver know which gauges and other figures were plotted by the
+    workers, only the gauges that were plotted successfully get html pages.
+    """
+
+    plotdata._parallel_otherfignames = otherfignames
+    if len(gaugenos) > 0:
+        plotdata._parallel_gaugenos = [gaugeno for gaugeno in gaugenos
+                if progress.get(_task_key(('gauge', gaugeno)), {})
+                           .get('status') == 'done']
+        plotdata._parallel_gaugenos.sort()
+
+
+# Progress manifest written to the plotdir by parallel plotting, so that
+# plotclaw(..., resume=True) only plots the tasks that are missing or failed:
+progress_file = 'plotclaw_progress.json'
+
+
+def _task_key(task):
+    return '%s %s' % task
+
+
+def _task_mtime(plotdata, task):
+    """
+    Return the latest modification time of the output files for a frame or
+    gauge task, or None if there are none (or for other figures).
+    """
+
+    kind, key = task
+    if kind == 'frame':
+        files = frametools.frame_files(key, plotdata.outdir,
+                                       plotdata.file_prefix)
+    elif kind == 'gauge':
+        pattern = 'gauge%s.*' % str(key).zfill(5)
+        files = glob.glob(os.path.join(plotdata.outdir, pattern))
+    else:
+        return None
+    mtimes = [os.path.getmtime(fname) for fname in files]
+    if len(mtimes) == 0:
+        return None
+    return max(mtimes)
+
+
+def _task_files(plotdata, task):
+    """
+    Return the figure files a task is expected to create in the plotdir.
+    """
+
+    kind, key = task
+    fignos = [plotdata.plotfigure_dict[figname].figno
+              for figname in plotdata._fignames
+              if plotdata.plotfigure_dict[figname]._show
+              and plotdata.plotfigure_dict[figname].type == 'each_' + kind]
+    if kind == 'frame':
+        if plotdata.file_prefix in [None, 'fort']:
+            png_prefix = 'frame'
+        else:
+            png_prefix = plotdata.file_prefix + 'frame'
+        fnames = ['%s%sfig%s.%s' % (png_prefix, str(key).zfill(4), figno,
+                                    plotdata.print_format)
+                  for figno in fignos]
+    elif kind == 'gauge':
+        fnames = ['gauge%sfig%s.png' % (str(key).zfill(4), figno)
+                  for figno in fignos]
+    else:
+        fname = plotdata.otherfigure_dict[key].fname
+        fnames = [fname] if fname else []
+    return [os.path.join(plotdata.plotdir, fname) for fname in fnames]
+
+
+def read_progress(plotdir):
+    """
+    Return the dictionary stored in the progress manifest in plotdir, with
+    an entry for each frame, gauge or other figure plotted in parallel
+    giving its 'status' ('done' or 'failed'), the 'error' message if it
+    failed, the 'elapsed' time and the 'mtime' of its output files.
+    Returns an empty dictionary if there is no manifest.
+    """
+
+    fname = os.path.join(plotdir, progress_file)
+    if not os.path.exists(fname):
+        return {}
+    try:
+        with open(fname) as f:
+            return json.load(f)
+    except ValueError:
+        print('*** Warning: ignoring corrupt progress file %s' % fname)
+        return {}
+
+
+def _write_progress(plotdir, progress):
+    """
+    Write the progress manifest, replacing the old one only when the new
+    file is complete.
+    """
+
+    fname = os.path.join(plotdir, progress_file)
+    with open(fname + '.tmp', 'w') as f:
+        json.dump(progress, f, indent=1, sort_keys=True)
+    os.replace(fname + '.tmp', fname)
+
+
+def _record_progress(plotdata, progress, result):
+    (pid, task, elapsed, success, error) = result
+    progress[_task_key(task)] = {'status': 'done' if success else 'failed',
+                                 'error': error,
+                                 'elapsed': elapsed,
+                                 'mtime': _task_mtime(plotdata, task)}
+
+
+def _resume_tasks(plotdata, tasks, progress):
+    """
+    Return the tasks that still need to be plotted, i.e. those that are not
+    recorded as done in the progress manifest, whose output has changed
+    since, or whose figure files are missing.
+    """
+
+    todo = []
+    for task in tasks:
+        entry = progress.get(_task_key(task), {})
+        if (entry.get('status') == 'done') and (task[0] != 'otherfigure') \
+                and (entry.get('mtime') == _task_mtime(plotdata, task)) \
+                and all([os.path.exists(fname) for fname in
+                         _task_files(plotdata, task)]):
+            continue
+        todo.append(task)
+    print("Resuming: %i of %i tasks already plotted, %i to do" \
+          % (len(tasks) - len(todo), len(tasks), len(todo)))
+    return todo
+
+
+def _plotclaw_mpi(plotdata, format='ascii', verbose=False, resume=False):
+    """
+    Plot in parallel using all MPI ranks, e.g. when started with
+        $ mpirun -n 4 python $CLAW/visclaw/src/python/visclaw/plotclaw.py
+    Every rank must call plotclaw.  Rank 0 sets up the plotdir and hands
+    out frames, other figures and gauges one at a time to the other ranks
+    as they become idle, then makes the html index, latex, kml and movies
+    once all tasks are done.
+
+    If resume is True only the tasks not recorded as done in the progress
+    manifest are plotted, see plotclaw.
+
+    Returns False if mpi4py is not available.
+    """
+
+    global _worker_plotdata
+    from clawpack.visclaw import plotpages
+
+    try:
+        from mpi4py import MPI
+    except ImportError:
+        print("*** Warning: mpi4py is not available for " \
+              + "parallel_backend = 'mpi'")
+        return False
+
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    TASK_TAG = 1
+    RESULT_TAG = 2
+
+    if rank == 0:
+        # set up plotdir, this also makes outdir and plotdir absolute paths:
+        plotdata._parallel_resume = resume
+        plotdata._parallel_todo = 'initialize'
+        plotpages.plotclaw_driver(plotdata, verbose=False, format=format)
+    plotdata.outdir, plotdata.plotdir = comm.bcast((plotdata.outdir,
+                                                    plotdata.plotdir), root=0)
+
+    if rank > 0:
+        # worker: plot tasks until rank 0 sends None
+        _worker_plotdata = _worker_setup(plotdata)
+        comm.send(None, dest=0, tag=RESULT_TAG)
+        while True:
+            task = comm.recv(source=0, tag=TASK_TAG)
+            if task is None:
+                break
+            try:
+                result = _plot_task(task)
+            except:
+                traceback.print_exc()
+                print("ERROR: An error occurred on rank %i while plotting " \
+                      % rank + "%s %s.  Aborting all ranks." % task)
+                comm.Abort(1)
+            comm.send((rank,) + result[1:], dest=0, tag=RESULT_TAG)
+        return True
+
+    framenos = frametools.only_most_recent(plotdata.print_framenos,
+                                           plotdata.outdir,
+                                           plotdata.file_prefix)
+
+    # statistics for 'auto_global' color limits, computed and stored here
+    # before any task is handed out, so that the other ranks (which have
+    # num_procs = 1, see _worker_setup) only read them:
+    from clawpack.visclaw import framestats
+    framestats.update_plot_stats(plotdata)
+
+    tasks, otherfignames, gaugenos = _parallel_tasks(plotdata, framenos)
+    if resume:
+        progress = read_progress(plotdata.plotdir)
+        tasks = _resume_tasks(plotdata, tasks, progress)
+    else:
+        progress = {}
+
+    results = []
+    t_start = time.time()
+    t_written = t_start
+    if size == 1:
+        # no other ranks, plot all tasks here:
+        _worker_plotdata = _worker_setup(plotdata)
+        for task in tasks:
+            results.append((rank,) + _plot_task(task)[1:])
+            _record_progress(plotdata, progress, results[-1])
+    else:
+        # dynamic load balancing: each rank gets a new task when it sends
+        # back the result of the previous one:
+        status = MPI.Status()
+        next_task = 0
+        num_active = size - 1
+        while num_active > 0:
+            result = comm.recv(source=MPI.ANY_SOURCE, tag=RESULT_TAG,
+                               status=status)
+            if result is not None:
+                results.append(result)
+                _record_progress(plotdata, progress, result)
+                if time.time() - t_written > 5.:
+                    _write_progress(plotdata.plotdir, progress)
+                    t_written = time.time()
+                if verbose:
+                    print("Tasks finished: %i of %i" \
+                          % (len(results), len(tasks)))
+            if next_task < len(tasks):
+                comm.send(tasks[next_task], dest=status.Get_source(),
+                          tag=TASK_TAG)
+                next_task += 1
+            else:
+                comm.send(None, dest=status.Get_source(), tag=TASK_TAG)
+                num_active -= 1
+
+    _write_progress(plotdata.plotdir, progress)
+    _print_utilization(results, time.time() - t_start)
+    _print_failures(progress)
+    _set_parallel_results(plotdata, progress, otherfignames, gaugenos)
+
+    # After all figures have been plotted by the ranks,
+    # make index and html pages only:
+    plotdata._parallel_todo = 'finalize'
+    plotpages.plotclaw_driver(plotdata, verbose=False, format=format)
+    return True
+
 
 def plotclaw(outdir='.', plotdir='_plots', setplot = 'setplot.py', plotdata=None,
-             format='ascii', msgfile='', frames=None, verbose=False):
+             format='ascii', msgfile='', frames=None, verbose=False,
+             resume=False):
     """
     Create html and/or latex versions of plots.
 
@@ -37,6 +620,10 @@ def plotclaw(outdir='.', plotdir='_plots', setplot = 'setplot.py', plotdata=None
         setplot is a module containing a function setplot that will be called
                 to set various plotting parameters.
         format specifies the format of the files output from Clawpack
+        resume: when plotting in parallel, progress is recorded in the file
+                plotclaw_progress.json in plotdir.  If resume is True, only
+                frames and gauges that are missing, failed, or whose output
+                changed since are plotted again.
     """
 
     from clawpack.visclaw.data import ClawPlotData
@@ -65,6 +652,14 @@ def plotclaw(outdir='.', plotdir='_plots', setplot = 'setplot.py', plotdata=None
                 + "*** Setting plotdata.parallel to False")
         plotdata.parallel = False
 
+    if plotdata.parallel and (plotdata.parallel_backend == 'mpi') \
+            and (frames is None):
+        if _plotclaw_mpi(plotdata, format=format, verbose=verbose,
+                         resume=resume):
+            return
+        print("*** Using parallel_backend = 'multiprocessing' instead")
+        plotdata.parallel_backend = 'multiprocessing'
+
     if plotdata.parallel and (plotdata.num_procs > 1):
 
         # If this is the original call then we need to split up the work and
@@ -72,6 +667,7 @@ def plotclaw(outdir='.', plotdir='_plots', setplot = 'setplot.py', plotdata=None
 
         # First set up plotdir:
 
+        plotdata._parallel_resume = resume
         plotdata._parallel_todo = 'initialize'
         plotpages.plotclaw_driver(plotdata, verbose=False, format=format)
 
@@ -79,58 +675,106 @@ def plotclaw(outdir='.', plotdir='_plots', setplot = 'setplot.py', plotdata=None
             if plotdata.num_procs is None:
                 plotdata.num_procs = int(os.environ.get("OMP_NUM_THREADS", 1))
 
-
-            frames = [[] for n in range(plotdata.num_procs)]
             framenos = frametools.only_most_recent(plotdata.print_framenos,
-                                                   outdir)
-
-            # don't use more procs than frames or infinite loop!!
-            num_procs = min(plotdata.num_procs, len(framenos))
-
-            for (n, frame) in enumerate(framenos):
-                frames[n%num_procs].append(frame)
-
-            # Create subprocesses to work on each
-            plotclaw_cmd = "python %s" % __file__
-            process_queue = []
-            for n in range(num_procs):
-                plot_cmd = "%s %s %s %s" % (plotclaw_cmd,
-                                            outdir,
-                                            plotdir,
-                                            setplot)
-                plot_cmd = plot_cmd + " " + " ".join([str(i) for i in frames[n]])
-
-                process_queue.append(subprocess.Popen(plot_cmd, shell=True))
-
-            poll_interval = 0.5
+                                                   plotdata.outdir,
+                                                   plotdata.file_prefix)
+
+            # statistics for 'auto_global' color limits, computed here
+            # using all processes rather than by each worker:
+            from clawpack.visclaw import framestats
+            framestats.update_plot_stats(plotdata)
+
+            tasks, otherfignames, gaugenos = _parallel_tasks(plotdata,
+                                                             framenos)
+            if resume:
+                progress = read_progress(plotdata.plotdir)
+                tasks = _resume_tasks(plotdata, tasks, progress)
+            else:
+                progress = {}
+
+            # don't use more procs than tasks:
+            num_procs = min(plotdata.num_procs, len(tasks))
+
+            # If workers are to time out, give up on a task that has not
+            # finished after this time, e.g. when its worker is stuck outside
+            # of Python.  A worker that dies breaks the pool, which is
+            # noticed without waiting:
+            if plotdata.parallel_timeout is not None:
+                wait = plotdata.parallel_timeout + 60.
+            else:
+                wait = None
+
+            results = []
+            t_start = time.time()
+            t_written = [t_start]
+
+            def record(result):
+                results.append(result)
+                _record_progress(plotdata, progress, result)
+                if time.time() - t_written[0] > 5.:
+                    _write_progress(plotdata.plotdir, progress)
+                    t_written[0] = time.time()
+                if verbose:
+                    print("Tasks finished: %i of %i" \
+                          % (len(results), len(tasks)))
+
+            def skip(task, error):
+                print("*** Warning: Unable to plot %s %s, %s" \
+                      % (task + (error,)))
+                _record_progress(plotdata, progress,
+                                 (None, task, 0., False, error))
+
+            # Plot the tasks in a pool of worker processes.  If a worker
+            # dies or is stuck, only the task it was plotting is skipped:
+            # the tasks that were being plotted when a worker died are
+            # plotted again one at a time to find the one that kills its
+            # process, and the others in a new pool.
+            initargs = (plotdata.outdir, plotdata.plotdir, setplot, format)
+            todo = list(tasks)
             try:
-                while len(process_queue) > 0:
-                    time.sleep(poll_interval)
-                    for process in process_queue:
-                        if process.poll() is not None:
-                            process_queue.remove(process)
-                    if verbose:
-                        print("Number of processes currently:",len(process_queue))
-
-            # Stop child processes if interrupt was caught or something went
-            # wrong
+                while len(todo) > 0:
+                    lost, suspects = _run_pool(todo, min(num_procs,
+                                               len(todo)), initargs, wait,
+                                               record)
+                    if lost is None:
+                        break
+                    if len(suspects) == 0:
+                        # e.g. stuck in setplot, no task will finish:
+                        suspects = todo
+                    elif (lost == _process_died) and (len(suspects) > 1):
+                        suspects = [task for task in suspects
+                                    if _run_pool([task], 1, initargs, wait,
+                                                 record)[0] is not None]
+                    for task in suspects:
+                        skip(task, lost)
+                    finished = set([result[1] for result in results]
+                                   + suspects)
+                    todo = [task for task in todo if task not in finished]
+
+            # Child processes were stopped by _run_pool if interrupt was
+            # caught or something went wrong
             except KeyboardInterrupt:
                 print("ABORTING: A keyboard interrupt was caught.  All " + \
                       "child processes will be terminated as well.")
-                for process in process_queue:
-                    process.terminate()
                 raise
 
             except:
                 print("ERROR: An error occurred while waiting for " + \
                       "plotting processes to complete.  Aborting all " + \
                       "child processes.")
-                for process in process_queue:
-                    process.terminate()
                 raise
 
-            # After all frames have been plotted via recursive calls,
-            # make index and gauge plots only:
+            finally:
+                _write_progress(plotdata.plotdir, progress)
+
+            _print_utilization(results, time.time() - t_start)
+            _print_failures(progress)
+
+            _set_parallel_results(plotdata, progress, otherfignames,
+                                  gaugenos)
+
+            # After all figures have been plotted by the workers,
+            # make index and html pages only:
             plotdata._parallel_todo = 'finalize'
             plotpages.plotclaw_driver(plotdata, verbose=False, format=format)
 
@@ -0,0 +1,565 @@
+"""
+Module plotindex: single page html index for the plots made by plotclaw.
+
+The old plotpages.plotclaw2html writes the index page and an html page for
+each frame and figure, each frame and each figure, so the number of files
+written grows as frames times figures, and all of them are written again
+every time plots are made.
+
+Instead, plotclaw2index writes a JSON manifest _PlotIndex.json listing the
+frames, their times, the figures, gauges and other plots, and a single
+index page _PlotIndex.html.  The page includes the manifest and shows the
+tables of plots and the pages for a frame and figure, all frames of a
+figure, all figures of a frame (and the same for gauges) from it, using
+links such as _PlotIndex.html#frame=3&fig=2.
+
+If plotdata.html_static_pages is True, separate pages frame0003fig2.html
+etc. are also written, in parallel, for use without javascript or for
+linking to.  These only link to the previous and next frames and to the
+index page, so that when frames are added only the pages for the new
+frames and the one before them change.  Pages whose content is the same as
+in the previous manifest and that still exist are not written again.
+
+Used by plotpages.plotclaw2html when plotdata.html_single_page is True.
+"""
+
+import os
+import json
+
+manifest_version = 1
+
+
+def make_manifest(plotdata):
+    """
+    Return the manifest, a dictionary that can be written as JSON,
+    describing the plots for plotdata, after plotpages.massage_frames_data
+    and plotpages.massage_gauges_data have been applied.
+    """
+
+    from clawpack.visclaw.plotpages import current_time
+
+    framenos = plotdata.timeframes_framenos
+    fignos = plotdata.timeframes_fignos
+    fignames = plotdata.timeframes_fignames
+    pngfile = plotdata._pngfile
+    htmlfile = plotdata._htmlfile
+    frametimef = plotdata._frametimef
+
+    manifest = {'version': manifest_version,
+                'title': plotdata.html_index_title,
+                'created': current_time(),
+                'homelink': getattr(plotdata, 'html_homelink', None),
+                'plotdir': os.path.abspath(plotdata.plotdir),
+                'index': plotdata.html_index_fname,
+                'static_pages': bool(getattr(plotdata, 'html_static_pages',
+                                             False)),
+                'reduced': sorted(getattr(plotdata, 'html_reduced_widths',
+                                          None) or []),
+                'pdf': None,
+                'movies': [],
+                'frame_figures': [],
+                'frames': [],
+                'gauge_figures': [],
+                'gauges': [],
+                'other': []}
+
+    if plotdata.latex_makepdf:
+        manifest['pdf'] = plotdata.latex_fname + '.pdf'
+
+    for (kind, on, ext) in [('js Movies', plotdata.html_movie, 'html'),
+                            ('gif Movies', plotdata.gif_movie, 'gif'),
+                            ('mp4 Movies', plotdata.mp4_movie, 'mp4')]:
+        if on:
+            manifest['movies'].append({'label': kind,
+                    'files': ['%sfig%s.%s' % (plotdata.movie_name_prefix,
+                                              figno, ext) for figno in fignos]})
+
+    for figno in fignos:
+        manifest['frame_figures'].append({'figno': figno,
+                                          'name': fignames[figno]})
+    for frameno in framenos:
+        manifest['frames'].append({'frameno': frameno,
+                    't': frametimef[frameno].strip(),
+                    'png': [pngfile[frameno,figno] for figno in fignos],
+                    'html': [htmlfile[frameno,figno] for figno in fignos]})
+
+    gaugenos = plotdata.gauges_gaugenos
+    gauge_fignos = plotdata.gauges_fignos
+    if (gaugenos is not None) and (gauge_fignos is not None):
+        gauge_pngfile = plotdata._gauge_pngfile
+        gauge_htmlfile = plotdata._gauge_htmlfile
+        for figno in gauge_fignos:
+            manifest['gauge_figures'].append({'figno': figno,
+                                'name': plotdata.gauges_fignames[figno]})
+        for gaugeno in gaugenos:
+            manifest['gauges'].append({'gaugeno': gaugeno,
+                    'png': [gauge_pngfile[gaugeno,figno]
+                            for figno in gauge_fignos],
+                    'html': [gauge_htmlfile[gaugeno,figno]
+                             for figno in gauge_fignos]})
+
+    for name, otherfigure in plotdata.otherfigure_dict.items():
+        manifest['other'].append({'name': name, 'fname': otherfigure.fname})
+
+    return manifest
+
+
+def image_src(manifest, png, display_width=None):
+    """
+    Return the URL of the copy of png to show display_width pixels wide,
+    the smallest reduced copy that is wide enough or png itself, see
+    animation_tools.make_reduced_images.  If display_width is None the
+    largest reduced copy is used.
+    """
+
+    from clawpack.visclaw.animation_tools import choose_reduced_width
+
+    widths = manifest.get('reduced', [])
+    if display_width is None:
+        width = max(widths) if len(widths) > 0 else None
+    else:
+        width = choose_reduced_width(widths, display_width)
+    if width is None:
+        return png
+    return '_w%i/%s' % (width, png)
+
+
+def _escape(text):
+    return str(text).replace('&', '&amp;').replace('<', '&lt;') \
+                    .replace('>', '&gt;').replace('"', '&quot;')
+
+
+def static_page(manifest, kind, k, i):
+    """
+    Return the html for the static page of item k of manifest[kind], kind
+    'frames' or 'gauges', and figure i.  The page only depends on the
+    neighbouring items, so that pages of other items do not change when
+    items are added.
+    """
+
+    items = manifest[kind]
+    item = items[k]
+    figures = manifest[kind[:-1] + '_figures']
+    index = manifest['index']
+    if kind == 'frames':
+        what = 'Frame %s' % item['frameno']
+        view = 'frame=%s' % item['frameno']
+        allview = 'allframes=%s' % figures[i]['figno']
+    else:
+        what = 'Gauge %s' % item['gaugeno']
+        view = 'gauge=%s' % item['gaugeno']
+        allview = 'allgauges=%s' % figures[i]['figno']
+
+    lines = ['<html><meta http-equiv="expires" content="0">',
+             '<title>Plots</title>',
+             '<body><center>']
+    title = '<h3>%s' % what
+    if len(figures) > 1:
+        title += ' &nbsp;---&nbsp; %s' % _escape(figures[i]['name'])
+    if kind == 'frames':
+        title += '&nbsp;&nbsp; at time t = %s' % _escape(item['t'])
+    lines.append(title + '</h3>')
+
+    links = []
+    if k > 0:
+        links.append('<a href="%s"> &#060; </a>' % items[k-1]['html'][i])
+    else:
+        links.append('&#060;')
+    links.append('<a href="%s">Index</a>' % index)
+    if k < len(items) - 1:
+        links.append('<a href="%s"> &#062; </a>' % items[k+1]['html'][i])
+    else:
+        links.append('&#062;')
+    lines.append('<p>' + ' &nbsp; &nbsp;\n'.join(links))
+
+    lines.append('<p><a href="%s"><img src="%s"></a><p>' \
+                 % (item['png'][i], image_src(manifest, item['png'][i])))
+    lines.append('Image source: &nbsp; %s' \
+                 % _escape(os.path.join(manifest['plotdir'], item['png'][i])))
+
+    if len(figures) > 1:
+        others = []
+        for j, figure in enumerate(figures):
+            if j == i:
+                others.append('<font color=red>%s</font>' \
+                              % _escape(figure['name']))
+            else:
+                others.append('<a href="%s">%s</a>' \
+                              % (item['html'][j], _escape(figure['name'])))
+        lines.append('<p><b>Other figures:</b> &nbsp;&nbsp;'
+                     + ' &nbsp; &nbsp;\n'.join(others))
+        lines.append('<a href="%s#%s">All Figures</a>' % (index, view))
+    lines.append('<p><a href="%s#%s">All %ss</a>' \
+                 % (index, allview, kind[:-1].capitalize()))
+    lines.append('<p><h3><a href="%s">Plot Index</a></h3>' % index)
+    lines.append('</center></body></html>\n')
+    return '\n'.join(lines)
+
+
+def _static_pages(manifest):
+    """
+    Return a dictionary with the html of all static pages in manifest,
+    with their file names as keys.
+    """
+
+    pages = {}
+    for kind in ['frames', 'gauges']:
+        items = manifest[kind]
+        for k in range(len(items)):
+            for i in range(len(items[k]['html'])):
+                pages[items[k]['html'][i]] = static_page(manifest, kind, k, i)
+    return pages
+
+
+def write_static_pages(plotdir, manifest, old_manifest=None,
+                       num_threads=None):
+    """
+    Write the static pages of manifest to plotdir in num_threads threads,
+    leaving out pages that would be the same for old_manifest, the one
+    from the last time, and still exist.  Returns the number of pages
+    written.
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    pages = _static_pages(manifest)
+    if old_manifest is not None:
+        try:
+            old_pages = _static_pages(old_manifest)
+        except (KeyError, IndexError, TypeError):
+            old_pages = {}
+        for fname in list(pages.keys()):
+            if (old_pages.get(fname, None) == pages[fname]) \
+                    and os.path.isfile(os.path.join(plotdir, fname)):
+                pages.pop(fname)
+
+    def write(fname):
+        with open(os.path.join(plotdir, fname), 'w') as f:
+            f.write(pages[fname])
+
+    if num_threads is None:
+        num_threads = min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        list(executor.map(write, pages.keys()))
+    return len(pages)
+
+
+def read_manifest(json_fname):
+    """
+    Return the manifest in json_fname, or None if there is no usable one.
+    """
+
+    try:
+        with open(json_fname) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version', None) != manifest_version:
+        return None
+    return manifest
+
+
+def write_index(plotdir, manifest):
+    """
+    Write the index page and the manifest, with the same name and
+    extension .json, to plotdir.
+    """
+
+    index_fname = os.path.join(plotdir, manifest['index'])
+    json_fname = os.path.splitext(index_fname)[0] + '.json'
+    with open(json_fname, 'w') as f:
+        json.dump(manifest, f)
+
+    # "</" would end the script element the manifest is in:
+    manifest_json = json.dumps(manifest).replace('</', '<\\/')
+    html = _index_template.replace('__TITLE__', _escape(manifest['title']))
+    html = html.replace('__MANIFEST__', manifest_json)
+    with open(index_fname, 'w') as f:
+        f.write(html)
+
+
+def plotclaw2index(plotdata):
+    """
+    Make the single page index, and the static pages if requested, for the
+    plots described by plotdata.  Also makes the other figures not already
+    made by parallel workers and the lazy html movies, as plotclaw2html
+    does.
+    """
+
+    from clawpack.visclaw import plotpages
+
+    print('\n-----------------------------------\n')
+    print('\nCreating html index for figures...\n')
+
+    try:
+        plotdir = plotpages.prepare_plotdir(plotdata.plotdir,
+                                            plotdata.overwrite,
+                                            plotdata.verbose)
+    except:
+        print("*** Error, aborting plotclaw2index")
+        raise
+
+    plotdata = plotpages.massage_frames_data(plotdata)
+    if plotdata.gauges_fignos is not None:
+        plotdata = plotpages.massage_gauges_data(plotdata)
+
+    for name in plotdata.otherfigure_dict.keys():
+        if name not in plotdata._parallel_otherfignames:
+            plotpages.plot_otherfigure(name, plotdata)
+
+    manifest = make_manifest(plotdata)
+    json_fname = os.path.join(plotdir,
+                    os.path.splitext(plotdata.html_index_fname)[0] + '.json')
+    old_manifest = read_manifest(json_fname)
+
+    if manifest['static_pages']:
+        num_pages = write_static_pages(plotdir, manifest, old_manifest)
+        print('Wrote %i static html pages' % num_pages)
+    write_index(plotdir, manifest)
+
+    if plotdata.html_movie == "lazy":
+        plotpages.write_lazy_movies(plotdata)
+
+
+_index_template = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta http-equiv="expires" content="0">
+<title>__TITLE__</title>
+<style>
+  body {font-family: sans-serif;}
+  td {padding: 3px 8px;}
+  .center {text-align: center;}
+  .thumb {width: 400px; margin: 4px;}
+  .current {color: red;}
+</style>
+</head>
+<body>
+<div id="index"></div>
+<div id="view" class="center"></div>
+
+<script id="manifest" type="application/json">__MANIFEST__</script>
+<script>
+(function () {
+  var m = JSON.parse(document.getElementById('manifest').textContent);
+  var indexDiv = document.getElementById('index');
+  var viewDiv = document.getElementById('view');
+
+  function esc(s) {
+    return String(s).replace(/&/g, '&amp;').replace(/</g, '&lt;')
+                    .replace(/>/g, '&gt;').replace(/"/g, '&quot;');
+  }
+  function link(href, text) {
+    return '<a href="' + esc(href) + '">' + text + '</a>';
+  }
+  function figureCells(figures, hrefs) {
+    var s = '';
+    for (var i = 0; i < figures.length; i++) {
+      s += '<td>' + link(hrefs[i], esc(figures[i].name)) + '</td>';
+    }
+    return s;
+  }
+
+  // copy of png reduced to at least width pixels, or the largest one if
+  // width is 0, see animation_tools.make_reduced_images
+  function src(png, width) {
+    var best = null;
+    for (var j = 0; j < m.reduced.length; j++) {
+      var w = m.reduced[j];
+      if (width == 0 ? (best === null || w > best)
+                     : (w >= width && (best === null || w < best))) best = w;
+    }
+    return esc(best === null ? png : '_w' + best + '/' + png);
+  }
+
+  // kind is 'frame' or 'gauge':
+  function items(kind) { return m[kind + 's']; }
+  function figures(kind) { return m[kind + '_figures']; }
+  function number(kind, item) { return kind == 'frame' ? item.frameno : item.gaugeno; }
+  function find(kind, n) {
+    var list = items(kind);
+    for (var k = 0; k < list.length; k++) {
+      if (number(kind, list[k]) == n) return k;
+    }
+    return -1;
+  }
+  function figIndex(kind, figno) {
+    var figs = figures(kind);
+    for (var i = 0; i < figs.length; i++) {
+      if (figs[i].figno == figno) return i;
+    }
+    return -1;
+  }
+
+  function table(kind, title, anchor) {
+    var figs = figures(kind), list = items(kind);
+    var label = kind == 'frame' ? 'Frames' : 'Gauges';
+    var s = '<p><a name="' + anchor + '"><h3>' + title + ':</h3></a>';
+    s += '<table border=0 cellpadding=5 cellspacing=5>';
+    if (kind == 'frame') {
+      if (m.pdf) {
+        s += '<tr><td><b>pdf file:</b></td><td>' + link(m.pdf, esc(m.pdf)) + '</td></tr>';
+      }
+      for (var j = 0; j < m.movies.length; j++) {
+        s += '<tr><td><b>' + m.movies[j].label + ':</b></td>'
+             + figureCells(figs, m.movies[j].files) + '</tr>';
+      }
+    }
+    var all = [];
+    for (var i = 0; i < figs.length; i++) {
+      all.push('#all' + kind + 's=' + figs[i].figno);
+    }
+    s += '<tr><td><b>All ' + label + ':</b></td>' + figureCells(figs, all) + '</tr>';
+    s += '<tr><td><b>Individual ' + label + ':</b></td></tr>';
+    for (var k = 0; k < list.length; k++) {
+      var n = number(kind, list[k]), hrefs = [];
+      for (var i = 0; i < figs.length; i++) {
+        hrefs.push('#' + kind + '=' + n + '&fig=' + figs[i].figno);
+      }
+      s += '<tr><td>' + (kind == 'frame' ? 'Frame ' : 'Gauge ') + n
+           + (kind == 'frame' ? ', t = ' + esc(list[k].t) : '') + ':</td>'
+           + figureCells(figs, hrefs);
+      if (figs.length > 1) {
+        s += '<td>' + link('#' + kind + '=' + n, 'All figures') + '</td>';
+      }
+      s += '</tr>';
+    }
+    return s + '</table>';
+  }
+
+  function showIndex() {
+    var s = '<h1 class="center">' + esc(m.title) + '</h1>';
+    if (m.homelink) {
+      s += '<p class="center">' + link(m.homelink, 'Back to ' + esc(m.homelink)) + '</p>';
+    }
+    s += '<p class="center">Plots created: ' + esc(m.created) + '</p>';
+    s += '<p><b>Go to:</b>';
+    if (m.gauges.length > 0 && m.gauge_figures.length > 0) {
+      s += ' &nbsp; <a href="#gauges">Gauges</a>';
+    }
+    s += ' &nbsp; <a href="#eachrun">Other plots</a>';
+    s += table('frame', 'Time frames', 'timeframes');
+    if (m.gauges.length > 0 && m.gauge_figures.length > 0) {
+      s += table('gauge', 'Gauges', 'gauges');
+    }
+    if (m.other.length > 0) {
+      s += '<p><a name="eachrun"><h3>Other plots:</h3></a><ul>';
+      for (var j = 0; j < m.other.length; j++) {
+        s += '<li>' + link(m.other[j].fname, esc(m.other[j].name));
+      }
+      s += '</ul>';
+    }
+    indexDiv.innerHTML = s;
+    indexDiv.style.display = 'block';
+    viewDiv.style.display = 'none';
+  }
+
+  function showView(s) {
+    viewDiv.innerHTML = s + '<p><h3>' + link('#', 'Plot Index') + '</h3>';
+    viewDiv.style.display = 'block';
+    indexDiv.style.display = 'none';
+    window.scrollTo(0, 0);
+  }
+
+  function nav(kind, k, figno) {
+    var list = items(kind), links = [];
+    var href = function (j) {
+      return '#' + kind + '=' + number(kind, list[j]) + (figno === null ? '' : '&fig=' + figno);
+    };
+    links.push(link(href(0), '&#060; &#060;'));
+    links.push(k > 0 ? link(href(k - 1), '&#060;') : '&#060;');
+    links.push(link('#', 'Index'));
+    links.push(k < list.length - 1 ? link(href(k + 1), '&#062;') : '&#062;');
+    links.push(link(href(list.length - 1), '&#062; &#062;'));
+    return '<p>' + links.join(' &nbsp; &nbsp; ');
+  }
+
+  function itemTitle(kind, item) {
+    return (kind == 'frame' ? 'Frame ' + item.frameno + ' &nbsp; at time t = '
+            + esc(item.t) : 'Gauge ' + item.gaugeno);
+  }
+
+  function showOne(kind, k, i) {
+    var item = items(kind)[k], figs = figures(kind);
+    var s = '<h3>' + itemTitle(kind, item);
+    if (figs.length > 1) s += ' &nbsp;---&nbsp; ' + esc(figs[i].name);
+    s += '</h3>' + nav(kind, k, figs[i].figno);
+    s += '<p>' + link(item.png[i], '<img src="' + src(item.png[i], 0) + '">') + '<p>';
+    s += 'Image source: &nbsp; ' + esc(m.plotdir + '/' + item.png[i]);
+    if (figs.length > 1) {
+      s += '<p><b>Other figures:</b> ';
+      for (var j = 0; j < figs.length; j++) {
+        s += ' &nbsp; ' + (j == i ? '<span class="current">' + esc(figs[j].name) + '</span>'
+             : link('#' + kind + '=' + number(kind, item) + '&fig=' + figs[j].figno,
+                    esc(figs[j].name)));
+      }
+      s += ' &nbsp; ' + link('#' + kind + '=' + number(kind, item), 'All Figures');
+    }
+    s += '<p>' + link('#all' + kind + 's=' + figs[i].figno,
+                      'All ' + (kind == 'frame' ? 'Frames' : 'Gauges'));
+    showView(s);
+  }
+
+  function showAllFigures(kind, k) {
+    var item = items(kind)[k], figs = figures(kind);
+    var s = '<h3>All Figures -- ' + itemTitle(kind, item) + '</h3>' + nav(kind, k, null);
+    s += '<h3>Click on a figure to enlarge</h3>';
+    for (var i = 0; i < figs.length; i++) {
+      s += link('#' + kind + '=' + number(kind, item) + '&fig=' + figs[i].figno,
+                '<img class="thumb" src="' + src(item.png[i], 400) + '">');
+    }
+    showView(s);
+  }
+
+  function showAll(kind, i) {
+    var list = items(kind), figs = figures(kind);
+    var s = '<h1>All ' + (kind == 'frame' ? 'Frames' : 'Gauges') + ' -- '
+            + esc(figs[i].name) + '</h1><h3>Click on a figure to enlarge</h3>';
+    for (var k = 0; k < list.length; k++) {
+      s += link('#' + kind + '=' + number(kind, list[k]) + '&fig=' + figs[i].figno,
+                '<img class="thumb" loading="lazy" src="' + src(list[k].png[i], 400) + '">');
+    }
+    showView(s);
+  }
+
+  function route() {
+    var h = {};
+    location.hash.replace(/^#/, '').split('&').forEach(function (part) {
+      var kv = part.split('=');
+      if (kv.length == 2) h[kv[0]] = kv[1];
+    });
+    var kinds = ['frame', 'gauge'];
+    for (var j = 0; j < kinds.length; j++) {
+      var kind = kinds[j];
+      if (kind in h) {
+        var k = find(kind, h[kind]);
+        if (k < 0) break;
+        if ('fig' in h) {
+          var i = figIndex(kind, h.fig);
+          if (i >= 0) return showOne(kind, k, i);
+        } else {
+          return showAllFigures(kind, k);
+        }
+      }
+      if (('all' + kind + 's') in h) {
+        var i = figIndex(kind, h['all' + kind + 's']);
+        if (i >= 0) return showAll(kind, i);
+      }
+    }
+    if (indexDiv.innerHTML == '') showIndex();
+    indexDiv.style.display = 'block';
+    viewDiv.style.display = 'none';
+    if (location.hash.length > 1) {
+      var target = document.getElementsByName(location.hash.substring(1));
+      if (target.length > 0) target[0].scrollIntoView();
+    }
+  }
+
+  window.addEventListener('hashchange', route);
+  route();
+})();
+</script>
+</body>
+</html>
+"""
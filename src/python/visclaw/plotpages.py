@@ -7,22 +7,29 @@ latex/pdf pages displaying the plots.
 """
 import os, time, glob
 import sys
+import threading
 from functools import wraps
+from contextlib import contextmanager
 
 # increase resolution for images in animations:
 html_movie_dpi = 100
-import matplotlib as mpl
-mpl.rcParams['figure.dpi']= html_movie_dpi
-#print('+++ backend =',  mpl.rcParams['backend'])
-
 
 # Required for new animation style modified MAY 2013
 import numpy as np
-from matplotlib import image as Image
-from matplotlib import pyplot as plt
 
-from clawpack.visclaw import gaugetools
-from clawpack.visclaw import animation_tools
+# matplotlib, and the visclaw modules that use it, are imported in the
+# functions that need them, so that importing this module does not import
+# pyplot or change the matplotlib settings.
+
+
+def set_figure_dpi(dpi=html_movie_dpi):
+    """
+    Set the default dpi of matplotlib figures, used for the images in
+    animations.  Called when plots are made rather than on import, so that
+    importing plotpages does not change the user's matplotlib settings.
+    """
+    import matplotlib as mpl
+    mpl.rcParams['figure.dpi'] = dpi
 
 # Clawpack logo... not used on plot pages currently.
 clawdir = os.getenv('CLAW')
@@ -584,35 +591,48 @@ def plotclaw2kml(plotdata):
                 gauges.kml : Gauge Placemarks
                regions.kml : Region polygons
                 levels.kml : Patch border polygons
+           regions.geojson : Region polygons, for other programs (GIS)
+            levels.geojson : Patch border polygons, for other programs
 
-
+    All files are addressed by their paths in plotdata.plotdir, and the
+    working directory is not changed (the gdal tiling programs are run with
+    the figure directory as their working directory).
     """
 
+    try:
+        plotdir = prepare_plotdir(plotdata.plotdir, plotdata.overwrite,
+                                  plotdata.verbose)
+    except:
+        print("KML ===> Error, aborting plotclaw2kml (cannot create plot directory")
+        raise
+
+    _plotclaw2kml(plotdata, plotdir)
+
+
+def _plotclaw2kml(plotdata, plotdir):
+
+    def in_plotdir(*names):
+        return os.path.join(plotdir, *names)
+
     print(" ")
     print("KML ===> Creating file %s.kmz" % plotdata.kml_index_fname)
 
-    startdir = os.getcwd()
-
     from lxml import etree
     from pykml.factory import KML_ElementMaker as KML
     from pykml.factory import GX_ElementMaker as GX
     from pykml.factory import ATOM_ElementMaker as ATOM
-    import zipfile
     import shutil
     from copy import deepcopy
+    from clawpack.visclaw import kmzfile, kmlgeometry, patchstats
     from clawpack.geoclaw import kmltools
+    from matplotlib import pyplot as plt
+    from clawpack.visclaw import gaugetools
 
     if plotdata.format == 'forestclaw':
         level_base = 0
     else:
         level_base = 1
 
-    try:
-        cd_with_mkdir(plotdata.plotdir, plotdata.overwrite, plotdata.verbose)
-    except:
-        print("KML ===> Error, aborting plotclaw2kml (cannot create plot directory")
-        raise
-
     gaugenos = plotdata.gauges_gaugenos
     if gaugenos is not None:
         if plotdata.gauges_fignos is not None:
@@ -681,8 +701,9 @@ def plotclaw2kml(plotdata):
             KML.name(plotdata.kml_name),
             KML.open(1)))
 
-    # Open main zip file
-    zip = zipfile.ZipFile(plotdata.kml_index_fname + ".kmz",'w',allowZip64=True)
+    # Open main zip file, entries are compressed in parallel, see kmzfile.py
+    zip = kmzfile.KMZFile(in_plotdir(plotdata.kml_index_fname + ".kmz"))
+    png_to_remove = []   # png files moved into the kmz file
 
     # --------------------- Set initial view --------------------------
     first_found = False
@@ -747,8 +768,8 @@ def plotclaw2kml(plotdata):
         else:
             fig_vis = 0
 
-        shutil.rmtree(fig_dir,True)
-        os.mkdir(fig_dir)
+        shutil.rmtree(in_plotdir(fig_dir),True)
+        os.mkdir(in_plotdir(fig_dir))
 
         doc_fig = KML.kml(
             KML.Document(
@@ -771,6 +792,7 @@ def plotclaw2kml(plotdata):
         # ------------------- Loop over frames ----------------------
         # This will get created for each figure, but I need it
         # for createing the level boxes around each patch
+        tile_jobs = []
 
         for i in range(0,numframes):
             frameno = framenos[i]
@@ -801,38 +823,37 @@ def plotclaw2kml(plotdata):
                             KML.east(ur[0]),
                             KML.west(ul[0]))))
 
-                # Easier to just move into this directory to construct everything
-                os.chdir(fig_dir)
-
-                shutil.rmtree(fname_str,True)  # remove directory and ignore errors
-                os.mkdir(fname_str)
-
-                # PNG file gets moved into subdirectory and will eventually be
-                # zipped into KMZ file.
-                if plotdata.html:
-                    shutil.copy(os.path.join("..","%s.png" % fname_str),fname_str)
-                else:
-                    shutil.move(os.path.join("..","%s.png" % fname_str),fname_str)
+                # PNG file goes into subdirectory <framename> of the KMZ
+                # file, written directly from the plot directory.  It is
+                # removed from there at the end unless html pages use it.
+                zip.write(in_plotdir("%s.png" % fname_str),
+                          os.path.join(fig_dir, fname_str, "%s.png" % fname_str))
+                if not plotdata.html:
+                    png_to_remove.append(in_plotdir("%s.png" % fname_str))
 
                 # The actual file to be written <framename>/doc.kml
-                docfile = os.path.join(fname_str,'doc.kml')
-                docfile_notile = open(os.path.join(fname_str,'doc.kml'),'wt')
-                docfile_notile.write('<?xml version="1.0" encoding="UTF-8"?>\n')
                 kml_text = etree.tostring(etree.ElementTree(doc_notile),
                                                         pretty_print=True)
-                docfile_notile.write(kml_text.decode())
-                docfile_notile.close()
-
-                os.chdir("..")
+                zip.writestr(os.path.join(fig_dir, fname_str, 'doc.kml'),
+                             '<?xml version="1.0" encoding="UTF-8"?>\n'
+                             + kml_text.decode())
+
+            elif plotdata.kml_tiler == 'python':
+                # tiled below for all frames at once, see kmltiles.py
+                tile_jobs.append({'png_file': in_plotdir("%s.png" % fname_str),
+                                  'tile_dir': in_plotdir(fig_dir, fname_str),
+                                  'west': ul[0], 'south': lr[1],
+                                  'east': ur[0], 'north': ur[1],
+                                  'name': fname_str})
 
             else:
                 print(" ")
                 print("KML ===> Tiling %s.png" % fname_str)
 
-                os.chdir(fig_dir)
-                pngfile = os.path.join("..","%s.png"% fname_str)
-                shutil.copy(pngfile,".")
-                im = plt.imread("%s.png" % fname_str)
+                # the gdal programs are run in fig_dir:
+                tile_cwd = in_plotdir(fig_dir)
+                shutil.copy(in_plotdir("%s.png" % fname_str), tile_cwd)
+                im = plt.imread(in_plotdir("%s.png" % fname_str))
                 sx = im.shape[1]   # reversed?
                 sy = im.shape[0]
 
@@ -844,37 +865,41 @@ def plotclaw2kml(plotdata):
                             "%s.png"%(fname_str), "%s_tmp.vrt"%(fname_str)]
 
                 import subprocess
-                retval = subprocess.call(arg_list)
+                try:
+                    retval = subprocess.call(arg_list, cwd=tile_cwd)
 
-                arg_list = ["gdalwarp", "-of", "VRT", "-t_srs", "EPSG:4326 ", "-overwrite", \
-                            "%s_tmp.vrt"%(fname_str), "%s.vrt"%(fname_str)]
-                retval = retval or subprocess.call(arg_list)
+                    arg_list = ["gdalwarp", "-of", "VRT", "-t_srs", "EPSG:4326 ", "-overwrite", \
+                                "%s_tmp.vrt"%(fname_str), "%s.vrt"%(fname_str)]
+                    retval = retval or subprocess.call(arg_list,
+                                                       cwd=tile_cwd)
 
-                arg_list = ["gdal2tiles.py", \
-                            "--profile=geodetic", \
-                            "--force-kml", \
-                            "--resampling=near", \
-                            "%s.vrt" % (fname_str)]
+                    arg_list = ["gdal2tiles.py", \
+                                "--profile=geodetic", \
+                                "--force-kml", \
+                                "--resampling=near", \
+                                "%s.vrt" % (fname_str)]
 
-                retval = retval or subprocess.call(arg_list)
+                    retval = retval or subprocess.call(arg_list,
+                                                       cwd=tile_cwd)
+                except OSError as e:
+                    print("KML ===> gdal : %s" % e)
+                    retval = 1
 
                 if retval > 0:
-                    print("KML ===> gdal : something went wrong!\n")
-                    sys.exit(1)
-
-                # Change back to top level directory before adding zipped files
-                os.chdir("..")
-
-                # Add the <fname>.vrt file to zipped file. Remove
-                # figure PNG file
-                zip.write(os.path.join(fig_dir,"%s.vrt" % fname_str))
+                    print("KML ===> gdal : something went wrong tiling %s.png, "
+                          "try kml_tiler = 'python'\n" % fname_str)
+                else:
+                    # Add the <fname>.vrt file to zipped file.
+                    zip.write(in_plotdir(fig_dir, "%s.vrt" % fname_str),
+                              os.path.join(fig_dir, "%s.vrt" % fname_str))
 
                 # Leave the PNG file in the KMZ file?
                 # os.remove(os.path.join(fig_dir,"%s.png" % fname_str))
 
                 # Clean up files
-                os.remove(os.path.join(fig_dir,"%s_tmp.vrt" % fname_str))
-                os.remove(os.path.join(fig_dir,"%s.vrt" % fname_str))
+                for vrt in ["%s_tmp.vrt" % fname_str, "%s.vrt" % fname_str]:
+                    if os.path.exists(in_plotdir(fig_dir, vrt)):
+                        os.remove(in_plotdir(fig_dir, vrt))
 
 
             # add Network link to high level doc.kml file.  This will referenece either
@@ -902,6 +927,20 @@ def plotclaw2kml(plotdata):
 
         # ----------------- Done with frame loop --------------------
 
+        if len(tile_jobs) > 0:
+            from clawpack.visclaw import kmltiles
+            print(" ")
+            print("KML ===> Tiling %i frames of figure %s" \
+                  % (len(tile_jobs), figno))
+            for (png_file, num_tiles, error) in \
+                    kmltiles.tile_images(tile_jobs, plotdata.num_procs):
+                if error is None:
+                    print("KML ===> Tiled %s into %i tiles" \
+                          % (os.path.basename(png_file), num_tiles))
+                else:
+                    print("KML ===> Error tiling %s : %s" \
+                          % (os.path.basename(png_file), error))
+
         lstr = os.path.join(fig_dir,"doc.kml")
         fig_folder.append(
             KML.NetworkLink(
@@ -920,13 +959,12 @@ def plotclaw2kml(plotdata):
             print(" ")
             print("KML ===> Building colorbar for figure %s" % plotfigure.name)
             cb_img = "images"
-            cb_dir = os.path.join(fig_dir,cb_img)
+            cb_dir = in_plotdir(fig_dir,cb_img)
             shutil.rmtree(cb_dir,True)
             os.mkdir(cb_dir)
             cb_filename = "colorbarfig%s.png" % figno
             try:
-                plotfigure.kml_colorbar(cb_filename)
-                shutil.move(cb_filename,cb_dir)
+                plotfigure.kml_colorbar(os.path.join(cb_dir,cb_filename))
             except:
                 print("KML ===> Warning : Something went wrong when creating colorbar")
 
@@ -942,7 +980,7 @@ def plotclaw2kml(plotdata):
             # -----  Done with colorbar ------
 
         # ------------------ done with fig<N>/doc.kml file ------------------
-        fig_file = open(os.path.join(fig_dir,"doc.kml"),'wt')
+        fig_file = open(in_plotdir(fig_dir,"doc.kml"),'wt')
         fig_file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
 
         # In case we used CDATA in any snippets or descriptions.  For some reason
@@ -956,13 +994,8 @@ def plotclaw2kml(plotdata):
 
 
         # Clean up everything in the figure directory
-        for dirname, subdirs, files in os.walk(fig_dir):
-            zip.write(dirname)
-            for filename in files:
-                zip.write(os.path.join(dirname, filename))
-                #print('++++ writing %s' % os.path.join(dirname, filename))
-
-        shutil.rmtree(fig_dir)
+        zip.write_tree(in_plotdir(fig_dir), fig_dir)
+        shutil.rmtree(in_plotdir(fig_dir))
 
 
     # ---------------------- Done with figure loop ------------------
@@ -973,12 +1006,12 @@ def plotclaw2kml(plotdata):
 
     # ---------- Create top-level resource subdirectories -----------
     kml_dir = 'kml'
-    shutil.rmtree(kml_dir,True)  # remove directory and ignore errors
-    os.mkdir(kml_dir)
+    shutil.rmtree(in_plotdir(kml_dir),True)  # remove directory and ignore errors
+    os.mkdir(in_plotdir(kml_dir))
 
     img_dir = 'images'
-    shutil.rmtree(img_dir,True)  # remove directory and ignore errors
-    os.mkdir(img_dir)
+    shutil.rmtree(in_plotdir(img_dir),True)  # remove directory and ignore errors
+    os.mkdir(in_plotdir(img_dir))
 
     # ------------------ Creating gauges.kml file -------------------------
     gauge_kml_file = "gauges.kml"
@@ -1081,7 +1114,7 @@ def plotclaw2kml(plotdata):
 
             doc_gauges.Document.append(placemark)
 
-        kml_file = open(gauge_kml_file,'wt')
+        kml_file = open(in_plotdir(gauge_kml_file),'wt')
         kml_file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
 
         kml_text = etree.tostring(etree.ElementTree(doc_gauges),
@@ -1104,14 +1137,14 @@ def plotclaw2kml(plotdata):
             KML.Link(KML.href(os.path.join(kml_dir,
                                            gauge_kml_file)))))
 
-    if os.path.isfile(gauge_kml_file):
-            shutil.move(gauge_kml_file,kml_dir)
+    if os.path.isfile(in_plotdir(gauge_kml_file)):
+            shutil.move(in_plotdir(gauge_kml_file),in_plotdir(kml_dir))
 
     # Add any gauge PNG files to images directory.
     if plotdata.gauges_fignos is not None:
         for k in gauge_pngfile.keys():
-            if os.path.isfile(gauge_pngfile[k]):
-                shutil.copy(gauge_pngfile[k],img_dir)
+            if os.path.isfile(in_plotdir(gauge_pngfile[k])):
+                shutil.copy(in_plotdir(gauge_pngfile[k]),in_plotdir(img_dir))
 
 
     # ----------------- Add a region for the computational domain ----------
@@ -1122,6 +1155,7 @@ def plotclaw2kml(plotdata):
 
     # collect all the placemarks in a folder and append later
     placemark_folder = []
+    region_features = []   # for regions.geojson
 
     # Read claw.data to get computational domain
     print(" ")
@@ -1232,6 +1266,10 @@ def plotclaw2kml(plotdata):
                         KML.coordinates(coords)))))
 
         placemark_folder.append(placemark)
+        region_features.append(kmlgeometry.geojson_feature(
+            [kmlgeometry.rectangle(longitude[0],longitude[1],y1,y2)],
+            {'name': 'Computational Domain',
+             'x1': x1, 'x2': x2, 'y1': y1, 'y2': y2}))
 
     print(" ")
     # Create regions for remaining regions specifed in regions.data
@@ -1383,12 +1421,23 @@ def plotclaw2kml(plotdata):
 
 
             placemark_folder.append(placemark)
+            region_features.append(kmlgeometry.geojson_feature(
+                [kmlgeometry.rectangle(longitude[0],longitude[1],y1,y2)],
+                {'name': 'Region %d' % rnum,
+                 'minlevel': int(minlevel), 'maxlevel': int(maxlevel),
+                 't1': t1, 't2': t2, 'x1': x1, 'x2': x2, 'y1': y1, 'y2': y2,
+                 'begin': sbegin, 'end': send}))
+
+    # The same regions for other programs than Google Earth
+    with kmlgeometry.GeoJSONWriter(in_plotdir("regions.geojson")) as geojson:
+        for feature in region_features:
+            geojson.write(feature)
 
     # Do we have any regions (either computational (from claw.data) or from regions.data?
     for p in placemark_folder:
         doc_regions.Document.append(p)
 
-    kml_file = open(region_kml_file,'wt')
+    kml_file = open(in_plotdir(region_kml_file),'wt')
     kml_file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
 
     kml_text = etree.tostring(etree.ElementTree(doc_regions),
@@ -1408,8 +1457,8 @@ def plotclaw2kml(plotdata):
             KML.Link(KML.href(os.path.join(kml_dir,
                                            region_kml_file)))))
 
-    if os.path.isfile(region_kml_file):
-            shutil.move(region_kml_file,kml_dir)
+    if os.path.isfile(in_plotdir(region_kml_file)):
+            shutil.move(in_plotdir(region_kml_file),in_plotdir(kml_dir))
 
     # --------------- Create polygons for AMR patch borders --------------
     level_kml_file = "levels.kml"
@@ -1431,9 +1480,8 @@ def plotclaw2kml(plotdata):
     # set _outdirs attribute to be list of all outdirs for all items
     plotdata.set_outdirs()
 
+    # The files are written straight into the kmz file, one at a time
     level_dir = "levels"
-    shutil.rmtree(level_dir,True)
-    os.mkdir(os.path.join(kml_dir,level_dir))
 
     # Level colors, in (alpha, blue, green, red)
     black = ["FF000000"]
@@ -1447,177 +1495,126 @@ def plotclaw2kml(plotdata):
     colors = black
     width = 1
 
-    # Create high level 'levels.kml' file
-    level_files = []
-    doc_levels = []
-    styles = []
-
     # Assume that if we are using ForestClaw, that we have set maxlevels correctly
-    for i in range(0,maxlevels+1-level_base):
-        level_file_name = "level_" + str(i+level_base).rjust(2,'0')
-        level_files.append(level_file_name)
-
-        # KML Document for each level
-        doc_levels.append(KML.kml(KML.Document()))
-
-        # Styles for levels
-        styles.append(KML.Style(
-            KML.LineStyle(
-                KML.color(colors[i % len(colors)]),   # cycle through colors
-                KML.width(width)),
-            KML.PolyStyle(KML.color("00000000")),
-            id="patchborder"))
-
-
-    # Create individual level files in subdirectories
-
-    doc_frames = [[0 for j in range(numframes)] for i in range(0,maxlevels+1-level_base)]
-    for j in range(0,numframes):
-        frameno = framenos[j]
-        for i in range(0,maxlevels+1-level_base):
-            frame_file_name = level_files[i] + "_" + str(frameno).rjust(4,'0') + ".kml"
-            if i == 0:
-                vis = 0  # Don't show first level
-            else:
-                vis = 1
-
-            N = KML.NetworkLink(
-                KML.name("Frame %s" % str(frameno).rjust(4,'0')),
-                KML.visibility(vis),
-                deepcopy(TS[j]),
-                KML.Link(
-                    KML.href(os.path.join(level_files[i],frame_file_name))))
-            doc_levels[i].Document.append(deepcopy(N))
-
-
-            # Create files in each subdirectory
-            doc_frames[i][j] = KML.kml(KML.Document())
-            doc_frames[i][j].Document.append(deepcopy(styles[i]))
-
-    print("     Re-reading output files to get patch information")
+    numlevels = maxlevels+1-level_base
+    level_files = ["level_" + str(i+level_base).rjust(2,'0')
+                   for i in range(numlevels)]
+
+    kml_head = '<?xml version="1.0" encoding="UTF-8"?>\n' \
+               '<kml xmlns="http://www.opengis.net/kml/2.2">\n<Document>\n'
+    kml_tail = '</Document>\n</kml>\n'
+
+    # Level files containing time spans and references to frame files
+    for i in range(numlevels):
+        if i == 0:
+            vis = 0  # Don't show first level
+        else:
+            vis = 1
+        text = [kml_head]
+        for j in range(numframes):
+            frame_file_name = level_files[i] + "_" + str(framenos[j]).rjust(4,'0') + ".kml"
+            c = TS[j].getchildren()
+            text.append('<NetworkLink>\n'
+                        '  <name>Frame %s</name>\n'
+                        '  <visibility>%i</visibility>\n'
+                        '  <TimeSpan><begin>%s</begin><end>%s</end></TimeSpan>\n'
+                        '  <Link><href>%s</href></Link>\n'
+                        '</NetworkLink>\n'
+                        % (str(framenos[j]).rjust(4,'0'), vis, c[0].text,
+                           c[1].text, "%s/%s" % (level_files[i],frame_file_name)))
+        text.append(kml_tail)
+        zip.writestr(os.path.join(kml_dir,level_dir,level_files[i]+".kml"),
+                     ''.join(text))
+
+    # Outlines of the patches of each level in each frame, with adjacent
+    # patches merged, see kmlgeometry.py.  Also written to levels.geojson.
+    print("     Reading patch headers to get patch information")
     print(" ")
+    file_prefix = plotdata.file_prefix or 'fort'
+
+    def patch_boxes(frameno, outdir):
+        # (level, xlower, xupper, ylower, yupper) of each patch, from the
+        # patch headers only, or from the full frame if there are no fort.q
+        # headers to read (e.g. for netcdf or hdf5 output):
+        try:
+            headers = patchstats.read_headers(outdir, frameno, file_prefix)
+        except (IOError, OSError, ValueError, IndexError):
+            framesoln = plotdata.getframe(frameno, outdir)
+            return [(state.patch.level,
+                     state.patch.dimensions[0].lower,
+                     state.patch.dimensions[0].upper,
+                     state.patch.dimensions[1].lower,
+                     state.patch.dimensions[1].upper)
+                    for state in framesoln.states]
+        lower = headers['lower'][:,:2]
+        upper = lower + headers['num_cells'][:,:2] * headers['delta'][:,:2]
+        return [(headers['level'][k], lower[k,0], upper[k,0],
+                 lower[k,1], upper[k,1]) for k in range(len(lower))]
+
+    geojson = kmlgeometry.GeoJSONWriter(in_plotdir("levels.geojson"))
     for j in range(0,numframes):
         frameno = framenos[j]
 
-        framesolns = []
         # loop over all outdirs:
         if len(plotdata._outdirs) == 0:
             plotdata._outdirs = [plotdata.outdir]
 
+        boxes = []
         for outdir in plotdata._outdirs:
-            framesolns.append(plotdata.getframe(frameno, outdir))
-
-        if type(framesolns) is not list:
-            framesolns = [framesolns]
-
-        for k, framesoln in enumerate(framesolns):  # patches?
-            for stateno,state in enumerate(framesoln.states):
-                patch = state.patch
-                xlower = patch.dimensions[0].lower
-                xupper = patch.dimensions[0].upper
-                ylower = patch.dimensions[1].lower
-                yupper = patch.dimensions[1].upper
-                level = patch.level
-
+            for level, xlower, xupper, ylower, yupper in \
+                    patch_boxes(frameno, outdir):
                 if plotdata.kml_map_topo_to_latlong is not None:
                     xlower,ylower = plotdata.kml_map_topo_to_latlong(xlower,ylower)
                     xupper,yupper = plotdata.kml_map_topo_to_latlong(xupper,yupper)
-
-                lv = []
-                if xlower > 180:
-                    for x in [xlower,xupper]:
-                        lv.append(x - 360)
-                elif xupper < -180:
-                    for x in [xlower,xupper]:
-                        lv.append(x + 360)
-                else:
-                    # Not quite sure why this works in the case when x1,x2 cross 180 ...
-                    lv = [xlower,xupper]
-
-                mapping = {}
-                mapping["x1"] = lv[0]
-                mapping["y1"] = ylower
-                mapping["x2"] = lv[1]
-                mapping["y2"] = yupper
-                mapping["elev"] = 0
-
-                border_text = """
-                {x1:10.4f},{y1:10.4f},{elev:10.4f}
-                {x2:10.4f},{y1:10.4f},{elev:10.4f}
-                {x2:10.4f},{y2:10.4f},{elev:10.4f}
-                {x1:10.4f},{y2:10.4f},{elev:10.4f}
-                {x1:10.4f},{y1:10.4f},{elev:10.4f}
-                """.format(**mapping).replace(' ','')
-
-                r = KML.Polygon(
-                    KML.tessellate(1),
-                    KML.altitudeMode("clampToGround"),
-                    KML.outerBoundaryIs(
-                        KML.LinearRing(
-                            KML.coordinates(border_text))))
-
-
-                p = KML.Placemark(
-                    KML.name("Grid %d" % stateno),
-                    KML.visibility(1),
-                    KML.styleUrl(chr(35) + "patchborder"))
-
-                p.append(deepcopy(r))
-
-                try:
-                    doc_frames[level-level_base][j].Document.append(deepcopy(p))
-                except:
-                    import pdb
-                    pdb.set_trace()
-
-
-    # Create directories for each level.
-    for i in range(0,maxlevels+1-level_base):
-        # Directory for storing levels for each time step
-        shutil.rmtree(os.path.join(kml_dir,level_dir,level_files[i]),True)
-        os.mkdir(os.path.join(kml_dir,level_dir,level_files[i]))
-
-
-    # Print out individual frame files for each element
-    for j in range(0,numframes):
-        for i in range(0,maxlevels+1-level_base):
-            frameno = framenos[j]
+                boxes.append((level, xlower, xupper, ylower, yupper))
+
+        boxes = np.array(boxes, dtype=float).reshape(-1, 5)
+        levels = boxes[:,0].astype(int)
+        x1, x2 = kmlgeometry.wrap_longitudes(boxes[:,1], boxes[:,2])
+        c = TS[j].getchildren()
+
+        for i in range(numlevels):
+            level = i + level_base
+            on_level = (levels == level)
+            text = [kml_head,
+                    '<Style id="patchborder">\n'
+                    '  <LineStyle><color>%s</color><width>%s</width></LineStyle>\n'
+                    '  <PolyStyle><color>00000000</color></PolyStyle>\n'
+                    '</Style>\n' % (colors[i % len(colors)], width)]
+            if on_level.any():
+                polygons = kmlgeometry.merge_rectangles(x1[on_level],
+                                x2[on_level], boxes[on_level,3],
+                                boxes[on_level,4])
+                text.append('<Placemark>\n'
+                            '  <name>Level %d</name>\n'
+                            '  <visibility>1</visibility>\n'
+                            '  <styleUrl>#patchborder</styleUrl>\n' % level)
+                text.append(kmlgeometry.kml_multigeometry(polygons,
+                                                          indent='  '))
+                text.append('</Placemark>\n')
+                geojson.write(kmlgeometry.geojson_feature(polygons,
+                              {'frameno': frameno, 't': frametimes[frameno],
+                               'level': level, 'begin': c[0].text,
+                               'end': c[1].text,
+                               'patches': int(on_level.sum())}))
+            text.append(kml_tail)
             level_file_name = level_files[i] + "_" + str(frameno).rjust(4,'0') + ".kml"
-            kml_frame_file = open(os.path.join(kml_dir,level_dir,
-                                               level_files[i],level_file_name),'wt')
-            kml_frame_file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-            kml_text = etree.tostring(etree.ElementTree(doc_frames[i][j]),
-                                                pretty_print=True)
-            kml_frame_file.write(kml_text.decode())
-            kml_frame_file.close()
-
-    # Print out level files containing time stamps and references to frame files
-    for i in range(0,maxlevels+1-level_base):
-        kml_level_file = open(os.path.join(kml_dir,level_dir,level_files[i]+".kml"),'w')
-        kml_level_file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        kml_text = etree.tostring(etree.ElementTree(doc_levels[i]),
-                                                pretty_print=True)
-        kml_level_file.write(kml_text.decode())
-        kml_level_file.close()
+            zip.writestr(os.path.join(kml_dir,level_dir,level_files[i],
+                                      level_file_name), ''.join(text))
+    geojson.close()
 
     # Folders in top level file 'levels.kml'
-    doc_levels_top = KML.kml(KML.Document())
-    for i in range(0,maxlevels+1-level_base):
-        level_file_name = "level_" + str(i+level_base).rjust(2,'0')
-        f = KML.Folder(KML.name("Level " + str(i+level_base)))
-        f.append(KML.NetworkLink(
-            KML.name("Frames"),
-            KML.Link(
-                KML.href(os.path.join(level_dir,level_file_name + ".kml")))))
-
-        doc_levels_top.Document.append(f)
-
-    kml_levels = open(os.path.join(kml_dir,level_kml_file),'wt')
-    kml_levels.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-    kml_text = etree.tostring(etree.ElementTree(doc_levels_top),
-                                    pretty_print=True).decode()
-    kml_levels.write(kml_text)
-    kml_levels.close()
+    text = [kml_head]
+    for i in range(numlevels):
+        text.append('<Folder>\n'
+                    '  <name>Level %d</name>\n'
+                    '  <NetworkLink>\n'
+                    '    <name>Frames</name>\n'
+                    '    <Link><href>%s/%s.kml</href></Link>\n'
+                    '  </NetworkLink>\n'
+                    '</Folder>\n' % (i+level_base, level_dir, level_files[i]))
+    text.append(kml_tail)
+    zip.writestr(os.path.join(kml_dir,level_kml_file), ''.join(text))
 
     # Add to top level KML file
     doc.Document.append(
@@ -1629,8 +1626,6 @@ def plotclaw2kml(plotdata):
 
     # ----------- add user-supplied KML files ------------
     user_dir = "user_files"
-    shutil.rmtree(user_dir,True)
-    os.mkdir(user_dir)
 
     if len(plotdata.kml_user_files) > 0:
         for f in plotdata.kml_user_files:
@@ -1642,7 +1637,7 @@ def plotclaw2kml(plotdata):
             else:
                 vis = 0
 
-            shutil.copy(os.path.join("..",f[0]),user_dir)
+            zip.write(in_plotdir(os.pardir,f[0]), os.path.join(user_dir,f[0]))
             doc.Document.append(
                 KML.NetworkLink(
                     KML.name(fname),
@@ -1651,34 +1646,24 @@ def plotclaw2kml(plotdata):
 
 
     # ----------- zip additional directories and clean up ------------
-    dir_list = [kml_dir, img_dir, user_dir]
+    dir_list = [kml_dir, img_dir]
     for d in dir_list:
-        for dirname, subdirs, files in os.walk(d):
-            zip.write(dirname)
-            for filename in files:
-                zip.write(os.path.join(dirname, filename))
-
-        shutil.rmtree(d)
+        zip.write_tree(in_plotdir(d), d)
+        shutil.rmtree(in_plotdir(d))
 
     # ----------- Write doc.kml file --------------------
-    # Top level KML file
-    docfile = open("doc.kml",'wt')
-    docfile.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-
+    # Top level KML file, stored in the zip file only
     kml_text = etree.tostring(etree.ElementTree(doc),pretty_print=True).decode()
     kml_text = kml_text.replace('&gt;','>')  # needed for CDATA blocks
     kml_text = kml_text.replace('&lt;','<')
-    docfile.write(kml_text)
-
-    #docfile.write(etree.tostring(etree.ElementTree(doc),pretty_print=True))
-    docfile.close()
-
-    # Store this in the zip file and remove it.
-    zip.write("doc.kml")   # Root KML file
-    os.remove("doc.kml")
+    zip.writestr("doc.kml", '<?xml version="1.0" encoding="UTF-8"?>\n'
+                 + kml_text)   # Root KML file
 
     zip.close()
 
+    for png in png_to_remove:
+        os.remove(png)
+
     if plotdata.kml_publish is not None:
         print(" ")
         print("KML ===> Creating file %s.kml" % plotdata.kml_index_fname)
@@ -1700,7 +1685,7 @@ def plotclaw2kml(plotdata):
                     KML.refreshMode("onInterval"),
                              KML.refreshInterval(update_time*60)))))
 
-        file = open(plotdata.kml_index_fname + ".kml",'wt')
+        file = open(in_plotdir(plotdata.kml_index_fname + ".kml"),'wt')
         file.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n")
         kml_text = etree.tostring(etree.ElementTree(doc),pretty_print=True)
         file.write(kml_text.decode())
@@ -1710,38 +1695,51 @@ def plotclaw2kml(plotdata):
     print("KML ===> Done creating files for Google Earth.  Open " \
         "%s.kmz in the Google Earth browser" % plotdata.kml_index_fname)
     print(" ")
-    os.chdir(startdir)
 
 #   end of plotclaw2kml
 
 
 #======================================================================
-def cd_with_mkdir(newdir, overwrite=False, verbose=True):
+def prepare_plotdir(newdir, overwrite=False, verbose=True):
 #======================================================================
+    """
+    Create the directory newdir if it does not exist, or check that it may
+    be overwritten if it does, and return its absolute path.  Unlike
+    cd_with_mkdir the current working directory is not changed, so this
+    can be used by plotting jobs running at the same time.
+    """
 
     newdir = os.path.abspath(newdir)
     if os.path.isfile(newdir):
-        print("*** Error in cd_with_mkdir: directory specified is a file")
-        raise
+        print("*** Error in prepare_plotdir: directory specified is a file")
+        raise OSError("%s is a file" % newdir)
     elif (os.path.isdir(newdir) & overwrite):
         if verbose:
             print("Directory '%s' " % newdir)
             print("    already exists, files may be overwritten ")
     elif (os.path.isdir(newdir) & (not overwrite)):
-        print("*** Error in cd_with_mkdir")
+        print("*** Error in prepare_plotdir")
         print("Directory already exists:\n  ",newdir)
         print("Remove directory with \n '  rm -r %s' " % newdir)
         print("  and try again, or set overwrite=True ")
-        raise
+        raise OSError("%s already exists" % newdir)
     else:
         try:
-            os.mkdir(newdir)
+            os.makedirs(newdir, exist_ok=True)
             if verbose:
                 print("Created directory:\n   ", newdir)
         except:
-            print("*** Error in cd_with_mkdir")
+            print("*** Error in prepare_plotdir")
             print("Cannot make directory: \n  ",newdir)
             raise
+    return newdir
+
+
+#======================================================================
+def cd_with_mkdir(newdir, overwrite=False, verbose=True):
+#======================================================================
+
+    newdir = prepare_plotdir(newdir, overwrite, verbose)
     try:
         os.chdir(newdir)
     except:
@@ -1749,6 +1747,88 @@ def cd_with_mkdir(newdir, overwrite=False, verbose=True):
         print("Cannot change directory to \n  ",newdir)
 
 
+# Code that must run in a particular working directory, e.g. the jobs of
+# the plot server, holds this lock while it does, so that plotting jobs
+# running in threads of one process do not interfere.  The plotting drivers
+# themselves do not change the working directory.
+_chdir_lock = threading.RLock()
+
+@contextmanager
+def in_directory(path):
+    """
+    Context manager running the enclosed code with working directory path,
+    holding a lock so that only one thread at a time changes directory.
+    """
+
+    with _chdir_lock:
+        startdir = os.getcwd()
+        os.chdir(path)
+        try:
+            yield path
+        finally:
+            os.chdir(startdir)
+
+
+class _ThreadOutput(object):
+    """
+    Stream written to by print that sends the output of each thread to the
+    file set for that thread by redirect_output, or else to the stream it
+    replaced.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def _target(self):
+        target = getattr(self._local, 'target', None)
+        if target is None:
+            target = self._stream
+        return target
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+_output_lock = threading.Lock()
+
+@contextmanager
+def redirect_output(msgfile):
+    """
+    Context manager writing everything printed by this thread, to stdout
+    or stderr, to the file msgfile (if msgfile is not '' or None).  Output of
+    other threads, e.g. other plotting jobs, is not affected.
+    """
+
+    if not msgfile:
+        yield
+        return
+
+    with _output_lock:
+        if not isinstance(sys.stdout, _ThreadOutput):
+            sys.stdout = _ThreadOutput(sys.stdout)
+        if not isinstance(sys.stderr, _ThreadOutput):
+            sys.stderr = _ThreadOutput(sys.stderr)
+        stdout, stderr = sys.stdout, sys.stderr
+
+    with open(msgfile, 'w') as f:
+        stdout_target = getattr(stdout._local, 'target', None)
+        stderr_target = getattr(stderr._local, 'target', None)
+        stdout._local.target = f
+        stderr._local.target = f
+        try:
+            yield
+        finally:
+            stdout._local.target = stdout_target
+            stderr._local.target = stderr_target
+
+
 #======================================================================
 def cd_plotdir(plotdir, overwrite):
 #======================================================================
@@ -1800,11 +1880,11 @@ def massage_frames_data(plot_pages_data):
         print('*** Error: timeframes not set properly')
         return
 
-    startdir = os.getcwd()
-
     if framenos == 'all' or fignos == 'all':
         # need to determine which figures exist
-        files = glob.glob('%s*.png' % prefix)
+        plotdir = getattr(ppd, 'plotdir', '.')
+        files = [os.path.basename(f) for f in
+                 glob.glob(os.path.join(plotdir, '%s*.png' % prefix))]
         np = len(prefix)
         if framenos == 'all':
             framenos = set()
@@ -1891,11 +1971,9 @@ def timeframes2latex(plot_pages_data):
     print('\n-----------------------------------\n')
     print('Creating latex file...')
 
-    startdir = os.getcwd()
-
     ppd =plot_pages_data
     try:
-        cd_with_mkdir(ppd.plotdir, ppd.overwrite, ppd.verbose)
+        plotdir = prepare_plotdir(ppd.plotdir, ppd.overwrite, ppd.verbose)
     except:
         print("*** Error, aborting timeframes2latex")
         raise
@@ -1903,8 +1981,6 @@ def timeframes2latex(plot_pages_data):
     creationtime = current_time()
     ppd = massage_frames_data(ppd)
 
-    plotdir = ppd.plotdir
-
     framenos = ppd.timeframes_framenos
     frametimes = ppd.timeframes_frametimes
     fignos = ppd.timeframes_fignos
@@ -1914,7 +1990,7 @@ def timeframes2latex(plot_pages_data):
     numframes = len(framenos)
     numfigs = len(fignos)
 
-    latexfile = open(ppd.latex_fname + '.tex', 'w')
+    latexfile = open(os.path.join(plotdir, ppd.latex_fname + '.tex'), 'w')
 
     # latex header
     #-------------
@@ -1937,7 +2013,7 @@ def timeframes2latex(plot_pages_data):
         \verb+%s+
         \end{center}
         \vskip 5pt
-        """ % (creationtime, startdir))
+        """ % (creationtime, plotdir))
 
     # latex layout
     #-------------
@@ -1992,13 +2068,14 @@ def timeframes2latex(plot_pages_data):
     print("\nUse pdflatex to create pdf file")
     if ppd.latex & ppd.latex_makepdf:
         try:
-            os.system('pdflatex %s' % ppd.latex_fname)
+            import subprocess
+            subprocess.call('pdflatex %s' % ppd.latex_fname, shell=True,
+                            cwd=plotdir)
         except:
             print('*** pdflatex command failed')
         print("\nSuccessfully created pdf file:  %s/%s.pdf" \
                 % (plotdir, ppd.latex_fname))
 
-    os.chdir(startdir)
     # end of timeframes2latex
 
 
@@ -2093,6 +2170,49 @@ def current_time(addtz=False):
     return current_time
 
 
+#======================================================================
+def write_lazy_movies(plotdata):
+#======================================================================
+    """
+    Write the html movie pages moviefigJ.html for each figure, with a
+    viewer that loads the png files as needed, see movieviewer.py.
+    Requires massage_frames_data to have been applied to plotdata.
+    """
+
+    from clawpack.visclaw import movieviewer
+
+    framenos = plotdata.timeframes_framenos
+    if len(framenos) == 0:
+        return
+    for figno in plotdata.timeframes_fignos:
+        manifest = movieviewer.make_manifest(
+                    [plotdata._pngfile[frameno,figno] for frameno in framenos],
+                    [plotdata._frametimef[frameno].strip()
+                     for frameno in framenos],
+                    title=plotdata.timeframes_fignames[figno],
+                    index_url=plotdata.html_index_fname)
+        movieviewer.write_viewer(os.path.join(plotdata.plotdir,
+                                 '%sfig%s.html' \
+                                 % (plotdata.movie_name_prefix, figno)),
+                                 manifest)
+
+
+#======================================================================
+def reduced_src(plotdata, pngfile, display_width=None):
+#======================================================================
+    """
+    Return the URL to use in html pages for the png file pngfile shown
+    display_width pixels wide: the smallest of the reduced copies made for
+    plotdata.html_reduced_widths that is wide enough, or the largest one if
+    display_width is None, or pngfile itself if there is none.
+    """
+
+    from clawpack.visclaw import plotindex
+
+    manifest = {'reduced': getattr(plotdata, 'html_reduced_widths', None) or []}
+    return plotindex.image_src(manifest, pngfile, display_width)
+
+
 #======================================================================
 def plotclaw2html(plotdata):
 #======================================================================
@@ -2117,16 +2237,23 @@ def plotclaw2html(plotdata):
       plotdata.eachrun_fignos  is list of figs to use,
       plotdata.eachrun_fignames  is dictionary of fig names for index.
 
+    If plotdata.html_single_page is True, a single index page is made by
+    plotindex.plotclaw2index instead.
     """
 
+    if getattr(plotdata, 'html_single_page', False) \
+            and not getattr(plotdata, 'html_eagle', False):
+        from clawpack.visclaw import plotindex
+        plotindex.plotclaw2index(plotdata)
+        return
+
 
     print('\n-----------------------------------\n')
     print('\nCreating html pages for figures...\n')
 
-    startdir = os.getcwd()
-
     try:
-        cd_with_mkdir(plotdata.plotdir, plotdata.overwrite, plotdata.verbose)
+        plotdir = prepare_plotdir(plotdata.plotdir, plotdata.overwrite,
+                                  plotdata.verbose)
     except:
         print("*** Error, aborting plotclaw2html")
         raise
@@ -2159,7 +2286,7 @@ def plotclaw2html(plotdata):
     # Create the index page:
     #-----------------------
 
-    html = open(plotdata.html_index_fname,'w')
+    html = open(os.path.join(plotdir, plotdata.html_index_fname),'w')
 
     if eagle:
         html.write("""
@@ -2288,21 +2415,8 @@ def plotclaw2html(plotdata):
         for name in plotdata.otherfigure_dict.keys():
             otherfigure = plotdata.otherfigure_dict[name]
             fname = otherfigure.fname
-            makefig = otherfigure.makefig
-            if makefig:
-                if type(makefig)==str:
-                    try:
-                        exec((makefig), globals(), locals())
-                    except:
-                        print("*** Problem executing makefig ")
-                        print("    for otherfigure ",name)
-                else:
-                    try:
-                        makefig(plotdata)
-                    except:
-                        print("*** Problem executing makefig function")
-                        print("    for otherfigure ",name)
-                        raise
+            if name not in plotdata._parallel_otherfignames:
+                plot_otherfigure(name, plotdata)
 
             html.write('<p><li><a href="%s">%s</a>\n' %(fname,name))
         html.write('<p></ul>\n')
@@ -2318,7 +2432,7 @@ def plotclaw2html(plotdata):
     # allframesfigJ.html
     #-------------------
     for figno in fignos:
-        html = open(allframesfile[figno], 'w')
+        html = open(os.path.join(plotdir, allframesfile[figno]), 'w')
         html.write('<html><meta http-equiv="expires" content="0">')
         html.write('<title>Plots</title>')
         html.write('<body>\n<center><h1>All Frames -- %s</h1>\n' \
@@ -2332,7 +2446,8 @@ def plotclaw2html(plotdata):
 
         for frameno in framenos:
             html.write('  <a href="%s"><img src="%s" width=400></a>\n' \
-                % (htmlfile[frameno,figno], pngfile[frameno,figno]))
+                % (htmlfile[frameno,figno],
+                   reduced_src(plotdata, pngfile[frameno,figno], 400)))
 
         html.write('\n</center></body></html>\n')
         html.close()
@@ -2343,7 +2458,7 @@ def plotclaw2html(plotdata):
     if numfigs > 1:
         for iframe in range(numframes):
             frameno = framenos[iframe]
-            html = open(allfigsfile[frameno], 'w')
+            html = open(os.path.join(plotdir, allfigsfile[frameno]), 'w')
             html.write('<html><meta http-equiv="expires" content="0">')
             html.write('<title>Plots</title>')
             html.write('<body>\n<center><h3>All Figures -- Frame %s' \
@@ -2389,7 +2504,8 @@ def plotclaw2html(plotdata):
 
             for figno in fignos:
                 html.write('  <a href="%s"><img src="%s" width=400></a>\n' \
-                        % (htmlfile[frameno,figno], pngfile[frameno,figno]))
+                        % (htmlfile[frameno,figno],
+                           reduced_src(plotdata, pngfile[frameno,figno], 400)))
 
             # list of all frames at bottom:
 
@@ -2412,7 +2528,7 @@ def plotclaw2html(plotdata):
     for iframe in range(numframes):
         frameno = framenos[iframe]
         for figno in fignos:
-            html = open(htmlfile[frameno,figno],'w')
+            html = open(os.path.join(plotdir, htmlfile[frameno,figno]),'w')
             html.write('<html><meta http-equiv="expires" content="0">\n')
             html.write('<title>Plots</title>')
             html.write('<body><center>\n')
@@ -2454,11 +2570,12 @@ def plotclaw2html(plotdata):
             html.write('&#062; &#062;</a>  \n')
 
             # image:
-            html.write('\n\n <p><img src="%s"><p>  \n ' \
-                        % pngfile[frameno,figno])
+            html.write('\n\n <p><a href="%s"><img src="%s"></a><p>  \n ' \
+                        % (pngfile[frameno,figno],
+                           reduced_src(plotdata, pngfile[frameno,figno])))
 
             html.write('\n\nImage source: &nbsp; %s'  \
-                   % os.path.join(os.getcwd(),pngfile[frameno,figno]))
+                   % os.path.join(plotdir,pngfile[frameno,figno]))
 
             # list of all figures at bottom of page:
 
@@ -2503,11 +2620,14 @@ def plotclaw2html(plotdata):
 
         # original style still used if plotdata.html_movie == "4.x":
         for figno in fignos:
-            html = open('movie%s' % allframesfile[figno], 'w')
+            html = open(os.path.join(plotdir, 'movie%s' % allframesfile[figno]), 'w')
             text = htmlmovie(plotdata.html_index_fname,pngfile,framenos,figno)
             html.write(text)
             html.close()
 
+    if plotdata.html_movie == "lazy":
+        write_lazy_movies(plotdata)
+
 
 
     #----------------------------------------------------------------------
@@ -2519,7 +2639,7 @@ def plotclaw2html(plotdata):
     if fignos is None:
         fignos = []
     for figno in fignos:
-        html = open('allgaugesfig%s.html' % figno, 'w')
+        html = open(os.path.join(plotdir, 'allgaugesfig%s.html' % figno), 'w')
         html.write('<html><meta http-equiv="expires" content="0">')
         html.write('<title>Plots</title>')
         html.write('<body>\n<center><h1>All Gauges -- %s</h1>\n' \
@@ -2533,7 +2653,8 @@ def plotclaw2html(plotdata):
 
         for gaugeno in gaugenos:
             html.write('  <a href="%s"><img src="%s" width=400></a>\n' \
-                % (gauge_htmlfile[gaugeno,figno], gauge_pngfile[gaugeno,figno]))
+                % (gauge_htmlfile[gaugeno,figno],
+                   reduced_src(plotdata, gauge_pngfile[gaugeno,figno], 400)))
 
         html.write('\n</center></body></html>\n')
         html.close()
@@ -2545,7 +2666,7 @@ def plotclaw2html(plotdata):
         if numfigs > 1:
             for igauge in range(numgauges):
                 gaugeno = gaugenos[igauge]
-                html = open(gauge_allfigsfile[gaugeno], 'w')
+                html = open(os.path.join(plotdir, gauge_allfigsfile[gaugeno]), 'w')
                 html.write('<html><meta http-equiv="expires" content="0">')
                 html.write('<title>Plots</title>')
                 html.write('<body>\n<center><h3>All Figures -- Gauge %s' \
@@ -2590,7 +2711,8 @@ def plotclaw2html(plotdata):
 
                 for figno in fignos:
                     html.write('  <a href="%s"><img src="%s" width=400></a>\n' \
-                            % (gauge_htmlfile[gaugeno,figno], gauge_pngfile[gaugeno,figno]))
+                            % (gauge_htmlfile[gaugeno,figno],
+                               reduced_src(plotdata, gauge_pngfile[gaugeno,figno], 400)))
 
                 # list of all gauges at bottom:
 
@@ -2613,7 +2735,7 @@ def plotclaw2html(plotdata):
         for igauge in range(numgauges):
             gaugeno = gaugenos[igauge]
             for figno in fignos:
-                html = open(gauge_htmlfile[gaugeno,figno],'w')
+                html = open(os.path.join(plotdir, gauge_htmlfile[gaugeno,figno]),'w')
                 html.write('<html><meta http-equiv="expires" content="0">\n')
                 html.write('<title>Plots</title>')
                 html.write('<body><center>\n')
@@ -2654,11 +2776,12 @@ def plotclaw2html(plotdata):
                 html.write('&#062; &#062;</a>  \n')
 
                 # image:
-                html.write('\n\n <p><img src="%s"><p>  \n ' \
-                            % gauge_pngfile[gaugeno,figno])
+                html.write('\n\n <p><a href="%s"><img src="%s"></a><p>  \n ' \
+                            % (gauge_pngfile[gaugeno,figno],
+                               reduced_src(plotdata, gauge_pngfile[gaugeno,figno])))
 
                 html.write('\n\nImage source: &nbsp; %s'  \
-                       % os.path.join(os.getcwd(),gauge_pngfile[gaugeno,figno]))
+                       % os.path.join(plotdir,gauge_pngfile[gaugeno,figno]))
 
                 # list of all figures at bottom of page:
 
@@ -2695,10 +2818,84 @@ def plotclaw2html(plotdata):
                 html.write('</center></body></html>')
                 html.close()
 
-    os.chdir(startdir)
     # end of plotclaw2html
 
 
+#======================================================================
+def plot_otherfigure(name, plotdata):
+#======================================================================
+    """
+    Create the figure for plotdata.otherfigure_dict[name] by executing its
+    makefig attribute, which may be a string or a function of plotdata.
+    makefig should save the figure in plotdata.plotdir.  The working
+    directory is not changed, but a figure that makefig saves under the
+    relative file name otherfigure.fname in the working directory, as
+    figures were saved when plotclaw changed into the plot directory, is
+    moved into plotdata.plotdir.
+    """
+
+    import shutil
+
+    otherfigure = plotdata.otherfigure_dict[name]
+    makefig = otherfigure.makefig
+    fname = otherfigure.fname
+    moved = fname and (not os.path.isabs(fname)) \
+            and (os.path.abspath(fname) != os.path.join(plotdata.plotdir, fname))
+    if moved:
+        # only move a figure saved by makefig, not an older file:
+        if os.path.exists(fname):
+            mtime = os.path.getmtime(fname)
+        else:
+            mtime = None
+    if makefig:
+        if type(makefig)==str:
+            try:
+                exec((makefig), globals(), locals())
+            except:
+                print("*** Problem executing makefig ")
+                print("    for otherfigure ",name)
+        else:
+            try:
+                makefig(plotdata)
+            except:
+                print("*** Problem executing makefig function")
+                print("    for otherfigure ",name)
+                raise
+    if moved and os.path.exists(fname) \
+            and (os.path.getmtime(fname) != mtime):
+        shutil.move(fname, os.path.join(plotdata.plotdir, fname))
+
+
+#======================================================================
+def get_gaugenos(plotdata):
+#======================================================================
+    """
+    Return the list of gauge numbers to plot, as specified by
+    plotdata.print_gaugenos.  If this is 'all', the gauge numbers are read
+    from gauges.data in plotdata.outdir.
+    """
+
+    from clawpack.visclaw import gaugetools
+
+    gaugenos = plotdata.print_gaugenos
+    if isinstance(plotdata.print_gaugenos, str):
+        if plotdata.print_gaugenos.lower() == 'all':
+            setgauges = gaugetools.read_setgauges(plotdata.outdir)
+            gaugenos = setgauges.gauge_numbers
+        elif plotdata.print_gaugenos.lower() == 'none':
+            plotdata.print_gaugenos = []
+            gaugenos = []
+        else:
+            raise ValueError(f"Unknown option {plotdata.print_gaugenos}" +
+                              "given for print_gaugenos.")
+    elif not plotdata.print_gaugenos:
+        # Handle None, also handles False, but not True
+        plotdata.print_gaugenos = []
+        gaugenos = []
+
+    return gaugenos
+
+
 #=====================================
 def massage_gauges_data(plot_pages_data):
 #=====================================
@@ -2713,8 +2910,6 @@ def massage_gauges_data(plot_pages_data):
         print('*** Error: gauges not set properly')
         return
 
-    startdir = os.getcwd()
-
     for figno in fignos:
         if figno not in fignames:
             fignames[figno] = 'Solution'
@@ -2758,8 +2953,68 @@ def redirect_stdouts(f):
             sys.stderr = stderr_save
     return wrapper
 
+#======================================================================
+def start_movie_streams(plotdata, fignos, framenos):
+#======================================================================
+    """
+    Start an ffmpeg stream for the mp4 movie of each figure in fignos,
+    so that plotframe pipes each frame to ffmpeg as it is plotted rather
+    than the movie being made from the png files afterwards.  The frames
+    must then be plotted in order.
+
+    The png files are not written for these figures unless something else
+    uses them: the html or latex pages, kml, or the other movies.
+    """
+
+    from clawpack.visclaw import animation_tools
+
+    plotdata._movie_streams = {}
+    if len(framenos) == 0:
+        return
+    if animation_tools.ffmpeg_path() is None:
+        print('*** Warning: ffmpeg not found, cannot stream mp4 movies')
+        return
+
+    plotdata._movie_pngs = plotdata.html or plotdata.latex or plotdata.kml \
+                           or plotdata.gif_movie \
+                           or (plotdata.html_movie in [True, "4.x", "JSAnimation",
+                                                       "lazy", "sprites"])
+    extra_args = ['-pix_fmt', 'yuv420p']
+    if plotdata.mp4_crf is not None:
+        extra_args += ['-crf', str(plotdata.mp4_crf)]
+    movie_prefix = os.path.join(plotdata.plotdir, plotdata.movie_name_prefix)
+    for figno in fignos:
+        fname = movie_prefix + 'fig%s.mp4' % figno
+        plotdata._movie_streams[figno] = animation_tools.FFmpegStream(fname,
+                                 fps=5, codec=plotdata.mp4_codec,
+                                 extra_args=extra_args)
+
+
+#======================================================================
+def finish_movie_streams(plotdata):
+#======================================================================
+    """
+    Close the streams started by start_movie_streams and return the list
+    of figure numbers for which the mp4 movie was created.
+    """
+
+    streamed_fignos = []
+    for figno, stream in plotdata._movie_streams.items():
+        if stream.close():
+            print('Created %s' % stream.file_name)
+            streamed_fignos.append(figno)
+        else:
+            print('*** Error creating %s' % stream.file_name)
+            if plotdata._movie_pngs:
+                print('    Will make it from the png files instead')
+            else:
+                streamed_fignos.append(figno)   # no png files to use
+    plotdata._movie_streams = {}
+    plotdata._movie_pngs = True
+    return streamed_fignos
+
+
 #============================================
-@redirect_stdouts
 def plotclaw_driver(plotdata, verbose=False, format='ascii'):
 #============================================
     """
@@ -2773,11 +3028,29 @@ def plotclaw_driver(plotdata, verbose=False, format='ascii'):
     a module to import that contains the function setplot.
 
     If plotdata.setplot is a function then this function will be used.
+
+    The working directory is not changed, and output is written to
+    plotdata.msgfile only for this thread, so several plotting jobs with
+    different plotdata objects can run at the same time in one process.
     """
 
+    with redirect_output(getattr(plotdata, 'msgfile', '')):
+        return _plotclaw_driver(plotdata, verbose, format)
+
+
+def _plotclaw_driver(plotdata, verbose=False, format='ascii'):
+
     import glob, sys, os
     from clawpack.visclaw.data import ClawPlotData
     from clawpack.visclaw import frametools, gaugetools
+    from clawpack.visclaw import animation_tools
+
+    try:
+        import matplotlib
+    except ImportError:
+        print('*** Error: matplotlib not found, no plots will be done')
+        return plotdata
+    set_figure_dpi()
 
     # doing plots in parallel?
     _parallel = plotdata.parallel and (plotdata.num_procs > 1)
@@ -2787,6 +3060,7 @@ def plotclaw_driver(plotdata, verbose=False, format='ascii'):
         for frameno in plotdata.print_framenos:
             frametools.plotframe(frameno, plotdata, verbose)
             print('Creating png for Frame %i' % frameno)
+        animation_tools.wait_for_reduced_images()
         return
 
     plotdata.save_frames = False
@@ -2799,12 +3073,6 @@ def plotclaw_driver(plotdata, verbose=False, format='ascii'):
     if plotdata.file_prefix is None:
         plotdata.file_prefix = 'fort'
 
-    datadir = os.getcwd()  # assume data files in this directory
-
-    if 'matplotlib' not in sys.modules:
-        print('*** Error: matplotlib not found, no plots will be done')
-        return plotdata
-
     if not isinstance(plotdata,ClawPlotData):
         print('*** Error, plotdata must be an object of type ClawPlotData')
         return plotdata
@@ -2827,7 +3095,6 @@ def plotclaw_driver(plotdata, verbose=False, format='ascii'):
         outdir = plotdata.outdir       # directory containing fort.* files
         plotdir = plotdata.plotdir     # where to put png and html files
         overwrite = plotdata.overwrite # ok to overwrite?
-        msgfile = plotdata.msgfile     # where to write error messages
 
     except:
         print('*** Error in printframes: plotdata missing attribute')
@@ -2863,23 +3130,12 @@ def plotclaw_driver(plotdata, verbose=False, format='ascii'):
             fignos_each_run.append(figno)
 
 
-    rootdir = os.getcwd()
-
-    try:
-        os.chdir(rundir)
-    except:
-        print('*** Error: cannot move to run directory ',rundir)
-        print('rootdir = ',rootdir)
+    if not os.path.isdir(rundir):
+        print('*** Error: cannot find run directory ',rundir)
         return plotdata
 
-
-    if msgfile != '':
-        sys.stdout = open(msgfile, 'w')
-        sys.stderr = sys.stdout
-
-
     try:
-        cd_plotdir(plotdata.plotdir, plotdata.overwrite)
+        prepare_plotdir(plotdir, overwrite, verbose=False)
     except:
         print("*** Error, aborting plotframes")
         return plotdata
@@ -2888,7 +3144,10 @@ def plotclaw_driver(plotdata, verbose=False, format='ascii'):
     framefiles = glob.glob(os.path.join(plotdir,'frame*.png')) + \
                     glob.glob(os.path.join(plotdir,'frame*.html'))
 
-    if (not _parallel) or (plotdata._parallel_todo=='initialize'):
+    if plotdata._parallel_resume:
+        # keep figures from the earlier run, only missing ones are redone
+        pass
+    elif (not _parallel) or (plotdata._parallel_todo=='initialize'):
         if overwrite:
             # remove any old versions:
             for file in framefiles:
@@ -2900,28 +3159,28 @@ def plotclaw_driver(plotdata, verbose=False, format='ascii'):
                 return plotdata
 
     if plotdata._parallel_todo=='initialize':
-        os.chdir(rundir)
         return plotdata
 
-    try:
-        os.chdir(outdir)
-    except:
-        print('*** Error plotclaw_driver: cannot move to outdir = ',outdir)
+    if not os.path.isdir(outdir):
+        print('*** Error plotclaw_driver: cannot find outdir = ',outdir)
         return plotdata
 
 
     fortfile = {}
     pngfile = {}
     frametimes = {}
+    streamed_fignos = []    # figures with mp4 movies made by ffmpeg streams
 
-    for file in glob.glob(plotdata.file_prefix + '.'+file_extension+r'\d{4}'):
+    for file in glob.glob(os.path.join(outdir, plotdata.file_prefix + '.'
+                                       + file_extension + '[0-9]'*4)):
+        file = os.path.basename(file)
         frameno = int(file[-4:])
         fortfile[frameno] = file
         for figno in fignos_each_frame:
             pngfile[frameno,figno] = 'frame' + file[-4:] + 'fig%s.png' % figno
 
     if len(fortfile) == 0:
-        print('*** Warning: No fort.q or claw.pkl files found in directory ', os.getcwd())
+        print('*** Warning: No fort.q or claw.pkl files found in directory ', outdir)
         #return plotdata
 
     # Discard frames that are not from latest run, based on
@@ -2959,20 +3218,7 @@ def plotclaw_driver(plotdata, verbose=False, format='ascii'):
     # Gauges:
     # -------
     if os.path.exists(os.path.join(plotdata.outdir,"gauges.data")):
-        if isinstance(plotdata.print_gaugenos, str):
-            if plotdata.print_gaugenos.lower() == 'all':
-                setgauges = gaugetools.read_setgauges(plotdata.outdir)
-                gaugenos = setgauges.gauge_numbers
-            elif plotdata.print_gaugenos.lower() == 'none':
-                plotdata.print_gaugenos = []
-                gaugenos = []
-            else:
-                raise ValueError(f"Unknown option {plotdata.print_gaguenos}" +
-                                  "given for print_gaugenos.")
-        elif not plotdata.print_gaugenos:
-            # Handle None, also handles False, but not True
-            plotdata.print_gaugenos = []
-            gaugenos = []
+        gaugenos = get_gaugenos(plotdata)
 
         plotdata.gauges_gaugenos = gaugenos
         plotdata.gauges_fignos = fignos_each_gauge
@@ -2992,8 +3238,6 @@ def plotclaw_driver(plotdata, verbose=False, format='ascii'):
             print("    Switching to 4.x style animation")
             plotdata.html_movie = "4.x"
 
-    os.chdir(plotdir)
-
     if plotdata.html:
         plotclaw2html(plotdata)
         pass
@@ -3009,21 +3253,34 @@ def plotclaw_driver(plotdata, verbose=False, format='ascii'):
         if not _parallel:
             # don't create the png for frames when run in parallel
             # (unless plotdata._parallell_todo=='frames', handled earlier)
-            for frameno in framenos:
-                frametools.plotframe(frameno, plotdata, verbose)
-                print('Frame %i at time t = %s' % (frameno, frametimes[frameno]))
-
-        gaugenos_input = tuple(gaugenos)
-        gaugenos = []
-        for gaugeno in gaugenos_input:
+            if plotdata.mp4_movie and plotdata.mp4_stream:
+                start_movie_streams(plotdata, fignos_each_frame, framenos)
             try:
-                gaugetools.plotgauge(gaugeno, plotdata, verbose)
-                print('Found data for Gauge %i ' % gaugeno)
-                gaugenos.append(gaugeno)
-            except:
-                print('*** Warning: Unable to plot Gauge %i' \
-                        % gaugeno)
+                for frameno in framenos:
+                    frametools.plotframe(frameno, plotdata, verbose)
+                    print('Frame %i at time t = %s' % (frameno, frametimes[frameno]))
+            finally:
+                streamed_fignos = finish_movie_streams(plotdata)
+        elif plotdata.mp4_movie and plotdata.mp4_stream:
+            print('*** Warning: mp4_stream is not used when plotting in parallel')
+
+        if _parallel and (plotdata._parallel_gaugenos is not None):
+            # gauges were already plotted by the worker processes
+            gaugenos = plotdata._parallel_gaugenos
+        else:
+            gaugenos_input = tuple(gaugenos)
+            gaugenos = []
+            for gaugeno in gaugenos_input:
+                try:
+                    gaugetools.plotgauge(gaugeno, plotdata, verbose)
+                    print('Found data for Gauge %i ' % gaugeno)
+                    gaugenos.append(gaugeno)
+                except:
+                    print('*** Warning: Unable to plot Gauge %i' \
+                            % gaugeno)
 
+        # reduced copies of the png files for the html pages:
+        animation_tools.wait_for_reduced_images()
 
     if plotdata.latex:
         timeframes2latex(plotdata)
@@ -3031,13 +3288,14 @@ def plotclaw_driver(plotdata, verbose=False, format='ascii'):
     if plotdata.kml:
         plotclaw2kml(plotdata)
 
-    if ((plotdata.html_movie == "JSAnimation") or plotdata.mp4_movie) and (len(framenos) > 0):
+    if ((plotdata.html_movie in ["JSAnimation", "sprites"]) or plotdata.mp4_movie) \
+            and (len(framenos) > 0):
 
         # Create Animations
     
         for figno in fignos_each_frame:
             fname = '*fig' + str(figno) + '.png'
-            filenames=sorted(glob.glob(fname))
+            filenames=sorted(glob.glob(os.path.join(plotdir, fname)))
 
             # RJL: This way gives better resolution although it basically does
             # the same thing as the code I removed, so not sure why
@@ -3060,14 +3318,26 @@ def plotclaw_driver(plotdata, verbose=False, format='ascii'):
             if figsize is None:
                 figsize = (8,6)  # reasonable for browser?
 
-            # make animations
-            if plotdata.mp4_movie:
+            # make animations, written to plotdir:
+            movie_prefix = os.path.join(plotdir, plotdata.movie_name_prefix)
+            if plotdata.mp4_movie and (figno not in streamed_fignos) \
+                    and not plotdata.mp4_resample:
+                # encode the png files at their own resolution:
+                pngfiles = frametools.png_filenames(framenos, figno,
+                                                    plotdata.file_prefix,
+                                                    plotdir)
+                animation_tools.make_mp4_from_pngs(pngfiles,
+                                movie_prefix + 'fig%s.mp4' % figno,
+                                codec=plotdata.mp4_codec,
+                                crf=plotdata.mp4_crf)
+
+            elif plotdata.mp4_movie and (figno not in streamed_fignos):
                 # use default dpi or get from plotdata
                 # this ensures that if it was set, dpi of mp4 is same as frames.
                 dpi = figkwargs.get('dpi', html_movie_dpi)
                 animation_tools.make_anim_outputs_from_plotdir(plotdir=plotdir,
                                 #file_name_prefix='movieframe_allframes',
-                                file_name_prefix=plotdata.movie_name_prefix,
+                                file_name_prefix=movie_prefix,
                                 png_prefix=png_prefix,
                                 figsize=figsize,
                                 dpi=dpi,
@@ -3078,13 +3348,38 @@ def plotclaw_driver(plotdata, verbose=False, format='ascii'):
                 # use different dpi so that plots do not take over browser width.
                 animation_tools.make_anim_outputs_from_plotdir(plotdir=plotdir,
                                 #file_name_prefix='movieframe_allframes',
-                                file_name_prefix=plotdata.movie_name_prefix,
+                                file_name_prefix=movie_prefix,
                                 png_prefix=png_prefix,
                                 figsize=figsize,
                                 dpi=plotdata.html_movie_dpi,
                                 fignos=[figno], outputs=['html'],
                                 raw_html=raw_html)
 
+            if plotdata.html_movie == "sprites":
+                # frames scaled to html_movie_width and packed in sprite
+                # sheets, shown by a movieviewer page:
+                from clawpack.visclaw import movieviewer
+                movie_framenos = [frameno for frameno in framenos
+                                  if frametools.png_filenames([frameno], figno,
+                                        plotdata.file_prefix, plotdir)]
+                pngfiles = frametools.png_filenames(movie_framenos, figno,
+                                                    plotdata.file_prefix,
+                                                    plotdir)
+                sprites = animation_tools.make_sprite_sheets(pngfiles,
+                                movie_prefix + 'fig%s_sheet' % figno,
+                                width=plotdata.html_movie_width)
+                if sprites is not None:
+                    frametimef = massage_frames_data(plotdata)._frametimef
+                    manifest = movieviewer.make_sprite_manifest(sprites,
+                            [frametimef[frameno].strip()
+                             for frameno in movie_framenos],
+                            title=plotdata._figname_from_num[figno],
+                            index_url=plotdata.html_index_fname)
+                    movieviewer.write_viewer(movie_prefix + 'fig%s.html' \
+                                             % figno, manifest)
+                    print('Created %sfig%s.html with %i sprite sheets' \
+                          % (movie_prefix, figno, len(sprites['sheets'])))
+
             # Note: setting figsize=None above chooses figsize with aspect
             # ratio based on .png files read in, may fit better on page
             # 3/21/24 - For MP4 size and dpi are taken from plotdata for
@@ -3100,15 +3395,18 @@ def plotclaw_driver(plotdata, verbose=False, format='ascii'):
         for figno in fignos_each_frame:
             fname_gif = '%sfig%s.gif' \
                         % (plotdata.movie_name_prefix, figno)
+            pngfiles = frametools.png_filenames(framenos, figno,
+                                                plotdata.file_prefix, plotdir)
             try:
-                os.system('convert -delay 20 frame*fig%s.png %s' \
-                   % (figno,fname_gif))
-                print('    Created %s' % fname_gif)
+                created = animation_tools.make_gif_from_pngs(pngfiles,
+                                os.path.join(plotdir, fname_gif))
             except:
+                created = False
+            if created:
+                print('    Created %s' % fname_gif)
+            else:
                 print('*** Error creating %s' % fname_gif)
 
-    os.chdir(rootdir)
-
     # print out pointers to html index page:
     path_to_html_index = os.path.join(os.path.abspath(plotdata.plotdir), \
                                plotdata.html_index_fname)
@@ -0,0 +1,416 @@
+"""
+Module plotserver: a long-lived local plotting server.
+
+Importing matplotlib, pyclaw and setplot and calling setplot takes a few
+seconds every time plots are made.  When only a few frames are plotted at
+a time, e.g. by a pipeline that updates the plots as a run progresses, this
+startup cost dominates.  The server keeps matplotlib imported and the
+ClawPlotData objects configured by setplot, and accepts plot jobs over a
+Unix socket.  setplot is called again only if the setplot file changed.
+
+Start the server with
+    $ python -m clawpack.visclaw.plotserver serve &
+
+and plot frames with
+    $ python -m clawpack.visclaw.plotserver plot _output _plots setplot.py 3 4 5
+
+The client uses the server if one is running on the socket and otherwise
+plots the frames itself, so the same command works in both cases.  The
+socket defaults to a file unique to the user in XDG_RUNTIME_DIR, or in the
+temporary directory if that is not set, and can be set with --socket or
+the environment variable VISCLAW_PLOTSERVER_SOCKET.  Since jobs run the
+setplot file they name, only the user that started the server may connect
+to the socket.
+
+From Python:
+    >>> from clawpack.visclaw import plotserver
+    >>> reply = plotserver.plot_frames([3,4,5], outdir='_output')
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import traceback
+import argparse
+import socketserver
+
+
+def default_socket():
+    """
+    Return the path of the server socket.
+    """
+
+    path = os.environ.get('VISCLAW_PLOTSERVER_SOCKET', None)
+    if path is None:
+        if hasattr(os, 'getuid'):
+            user = str(os.getuid())
+        else:
+            user = 'user'
+        # prefer the runtime directory only the user can access:
+        directory = os.environ.get('XDG_RUNTIME_DIR', None)
+        if (directory is None) or not os.path.isdir(directory):
+            directory = tempfile.gettempdir()
+        path = os.path.join(directory, 'visclaw_plotserver_%s.sock' % user)
+    return path
+
+
+class _PlotdataCache(object):
+    """
+    ClawPlotData objects configured by setplot, one for each setplot file,
+    format and outdir, reconfigured only when the setplot file has changed.
+    """
+
+    def __init__(self):
+        self._cache = {}
+
+    def get(self, setplot, format, outdir):
+
+        from clawpack.visclaw.data import ClawPlotData
+        from clawpack.visclaw import frametools
+
+        setplot = os.path.abspath(setplot)
+        outdir = os.path.abspath(outdir)
+        key = (setplot, format, outdir)
+        mtime = os.path.getmtime(setplot)
+        if (key not in self._cache) or (self._cache[key][0] != mtime):
+            plotdata = ClawPlotData(file_format=format)
+            plotdata.outdir = outdir   # e.g. for setplots reading gauges
+            plotdata.setplot = setplot
+            plotdata.format = format
+            plotdata = frametools.call_setplot(setplot, plotdata,
+                                               verbose=False)
+            self._cache[key] = (mtime, plotdata)
+        return self._cache[key][1]
+
+
+def run_job(job, cache=None):
+    """
+    Plot the frames of a job in this process and return the reply.
+
+    job is a dictionary with keys
+        'frames': list of frame numbers,
+        'outdir', 'plotdir', 'setplot', 'format': as in plotclaw,
+        'fignos': list of figure numbers to plot, or 'all',
+        'cwd': working directory of the client, in which setplot is
+               called and relative paths are taken (default: the current
+               directory).
+    The reply is a dictionary with keys
+        'status': 'ok' or 'error',
+        'error': error message if the job could not be done,
+        'plotted': frame numbers plotted,
+        'failed': dictionary of error messages for frames that failed,
+        'elapsed': time in seconds.
+    """
+
+    from clawpack.visclaw import plotpages
+
+    if cache is None:
+        cache = _PlotdataCache()
+
+    t_start = time.time()
+    reply = {'status': 'ok', 'plotted': [], 'failed': {}}
+    try:
+        cwd = job.get('cwd', None)
+        if cwd is None:
+            _plot_job(job, cache, reply)
+        else:
+            with plotpages.in_directory(cwd):
+                _plot_job(job, cache, reply)
+    except Exception as e:
+        traceback.print_exc()
+        reply['status'] = 'error'
+        reply['error'] = '%s: %s' % (type(e).__name__, e)
+    reply['elapsed'] = time.time() - t_start
+    return reply
+
+
+def _plot_job(job, cache, reply):
+    # plot the frames of job, see run_job, recording them in reply:
+
+    from clawpack.visclaw import frametools, plotpages
+
+    outdir = os.path.abspath(job.get('outdir', '_output'))
+    try:
+        plotdata = cache.get(job.get('setplot', 'setplot.py'),
+                             job.get('format', 'ascii'), outdir)
+    except Exception as e:
+        raise RuntimeError('setplot failed, %s: %s' % (type(e).__name__, e))
+
+    plotdata.outdir = outdir
+    plotdata.plotdir = os.path.abspath(job.get('plotdir', '_plots'))
+    if not os.path.isdir(plotdata.plotdir):
+        os.makedirs(plotdata.plotdir)
+
+    print_fignos = plotdata.print_fignos
+    if job.get('fignos', 'all') != 'all':
+        plotdata.print_fignos = job['fignos']
+    plotdata._mode = 'printframes'
+    plotdata.save_frames = False
+    plotpages.set_figure_dpi()
+
+    try:
+        for frameno in job.get('frames', []):
+            try:
+                frametools.plotframe(frameno, plotdata, refresh=True)
+                reply['plotted'].append(frameno)
+            except Exception as e:
+                traceback.print_exc()
+                reply['failed'][str(frameno)] = '%s: %s' \
+                                                % (type(e).__name__, e)
+    finally:
+        plotdata.print_fignos = print_fignos
+        import matplotlib.pyplot as plt
+        plt.close('all')
+
+
+class _PlotRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handle one request: a single line of JSON, answered with a single line
+    of JSON.  Requests are either a plot job, see run_job, or a command
+    {'command': 'ping'} or {'command': 'shutdown'}.
+    """
+
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            job = json.loads(line.decode('utf-8'))
+        except ValueError:
+            self._reply({'status': 'error', 'error': 'invalid request'})
+            return
+
+        try:
+            reply = self._handle_job(job)
+        except Exception as e:
+            # always answer, so the client reports the error:
+            traceback.print_exc()
+            reply = {'status': 'error',
+                     'error': '%s: %s' % (type(e).__name__, e)}
+        self._reply(reply)
+
+    def _handle_job(self, job):
+        command = job.get('command', 'plot')
+        if command == 'ping':
+            return {'status': 'ok', 'pid': os.getpid(),
+                    'jobs': self.server.num_jobs}
+        elif command == 'shutdown':
+            self.server.stop_requested = True
+            return {'status': 'ok'}
+        elif command == 'plot':
+            reply = run_job(job, self.server.cache)
+            self.server.num_jobs += 1
+            print('Plotted frames %s in %.2f seconds' \
+                  % (reply['plotted'], reply['elapsed']))
+            return reply
+        else:
+            return {'status': 'error',
+                    'error': 'unknown command %s' % command}
+
+    def _reply(self, reply):
+        self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+
+class PlotServer(socketserver.UnixStreamServer):
+    """
+    Server plotting the jobs sent over the Unix socket socket_path one at a
+    time, since pyplot cannot be used from several threads.
+    """
+
+    def __init__(self, socket_path=None):
+        if socket_path is None:
+            socket_path = default_socket()
+        if os.path.exists(socket_path):
+            if ping(socket_path) is not None:
+                raise RuntimeError("A plot server is already running on %s" \
+                                   % socket_path)
+            os.remove(socket_path)    # left over from a server that died
+
+        # import matplotlib, and pyclaw through frametools, now so that the
+        # first job does not pay for it:
+        import importlib
+        import matplotlib
+        matplotlib.use('Agg')
+        importlib.import_module('clawpack.visclaw.frametools')
+
+        self.socket_path = socket_path
+        self.cache = _PlotdataCache()
+        self.num_jobs = 0
+        self.stop_requested = False
+        socketserver.UnixStreamServer.__init__(self, socket_path,
+                                               _PlotRequestHandler)
+
+    def server_bind(self):
+        # jobs name setplot files that are run, so only the user may
+        # connect to the socket:
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+        os.chmod(self.socket_path, 0o600)
+
+    def serve(self):
+        """
+        Handle requests until a shutdown command is received.
+        """
+
+        print('Plot server listening on %s' % self.socket_path)
+        try:
+            while not self.stop_requested:
+                self.handle_request()
+        finally:
+            self.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        print('Plot server stopped after %i jobs' % self.num_jobs)
+
+
+def _send(request, socket_path=None, timeout=None):
+    """
+    Send a request to the server and return the reply, or None if no
+    server is running on socket_path.
+    """
+
+    if socket_path is None:
+        socket_path = default_socket()
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(socket_path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        sock.close()
+        return None
+
+    try:
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        reply = sock.makefile('rb').readline()
+    finally:
+        sock.close()
+    try:
+        return json.loads(reply.decode('utf-8'))
+    except ValueError:
+        # e.g. the server died while plotting:
+        return {'status': 'error',
+                'error': 'no valid reply from the plot server on %s'
+                         % socket_path}
+
+
+def ping(socket_path=None):
+    """
+    Return the server status, or None if no server is running.
+    """
+    return _send({'command': 'ping'}, socket_path, timeout=10.)
+
+
+def shutdown(socket_path=None):
+    """
+    Stop the server running on socket_path, if any.
+    """
+    return _send({'command': 'shutdown'}, socket_path, timeout=10.)
+
+
+def plot_frames(frames, outdir='_output', plotdir='_plots',
+                setplot='setplot.py', format='ascii', fignos='all',
+                socket_path=None, use_server=True):
+    """
+    Plot the frames using the plot server if one is running, otherwise in
+    this process.  Returns the reply described in run_job, with the
+    additional key 'server' set to True if the server was used.
+    """
+
+    job = {'command': 'plot',
+           'frames': [int(frameno) for frameno in frames],
+           'outdir': os.path.abspath(outdir),
+           'plotdir': os.path.abspath(plotdir),
+           'setplot': os.path.abspath(setplot),
+           'format': format,
+           'fignos': fignos,
+           'cwd': os.getcwd()}
+
+    reply = None
+    if use_server:
+        reply = _send(job, socket_path)
+    if reply is None:
+        reply = run_job(job)
+        reply['server'] = False
+    else:
+        reply['server'] = True
+    return reply
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+                description="Long-lived plotting server for Clawpack output")
+    parser.add_argument("--socket", default=None, type=str,
+                        help="path of the Unix socket")
+    subparsers = parser.add_subparsers(dest="action")
+    subparsers.add_parser("serve", help="run the server")
+    subparsers.add_parser("status", help="check if a server is running")
+    subparsers.add_parser("stop", help="stop the server")
+    plot = subparsers.add_parser("plot", help="plot frames")
+    plot.add_argument("outdir", default="_output", type=str, nargs="?")
+    plot.add_argument("plotdir", default="_plots", type=str, nargs="?")
+    plot.add_argument("setplot", default="setplot.py", type=str, nargs="?")
+    plot.add_argument("frames", type=int, nargs="*")
+    plot.add_argument("--format", default="ascii", type=str)
+    plot.add_argument("--fignos", default=None, type=int, nargs="+")
+    plot.add_argument("--no-server", action="store_true",
+                      help="plot in this process even if a server is running")
+    args = parser.parse_args(argv)
+
+    if args.action == 'serve':
+        PlotServer(args.socket).serve()
+
+    elif args.action == 'status':
+        reply = ping(args.socket)
+        if reply is None:
+            print('No plot server running')
+            return 1
+        if reply['status'] != 'ok':
+            print('*** Error: %s' % reply['error'])
+            return 1
+        print('Plot server running with pid %i, %i jobs done' \
+              % (reply['pid'], reply['jobs']))
+
+    elif args.action == 'stop':
+        if shutdown(args.socket) is None:
+            print('No plot server running')
+            return 1
+
+    elif args.action == 'plot':
+        if args.fignos is None:
+            fignos = 'all'
+        else:
+            fignos = args.fignos
+        reply = plot_frames(args.frames, args.outdir, args.plotdir,
+                            args.setplot, args.format, fignos,
+                            socket_path=args.socket,
+                            use_server=not args.no_server)
+        if reply['status'] != 'ok':
+            print('*** Error: %s' % reply['error'])
+            return 1
+        if reply['server']:
+            where = 'plot server'
+        else:
+            where = 'this process'
+        print('Plotted frames %s in %.2f seconds using %s' \
+              % (reply['plotted'], reply['elapsed'], where))
+        for frameno, error in reply['failed'].items():
+            print('*** Warning: Unable to plot Frame %s, %s' \
+                  % (frameno, error))
+        if len(reply['failed']) > 0:
+            return 1
+
+    else:
+        parser.print_help()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
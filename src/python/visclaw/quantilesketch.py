@@ -0,0 +1,196 @@
+"""
+Module quantilesketch: approximate quantiles of data seen in pieces.
+
+Color limits from the minimum and maximum of a variable are easily spoiled
+by a few extreme cells, e.g. near a shock or a wet/dry front, while exact
+quantiles over all frames need all the values at once.  A QuantileSketch
+counts the values in logarithmically spaced bins instead, as in DDSketch
+(Masson, Rim and Lee, VLDB 2019): every quantile it returns is within a
+relative error relative_accuracy of a value with that rank.  Values are
+added one array at a time (e.g. a patch), and sketches of different patches,
+levels, frames or processes are combined exactly with merge, so quantiles
+over all frames take a single pass over the data and memory that only grows
+with the logarithm of the range of the values.
+
+Sketches are stored as dictionaries of lists with to_dict, e.g. in the
+statistics kept by framestats.py, and made again with from_dict.
+"""
+
+import math
+
+import numpy as np
+
+
+class _Bins(object):
+    # counts of bins with consecutive indices from offset
+
+    def __init__(self, offset=0, counts=None):
+        self.offset = offset
+        if counts is None:
+            counts = np.zeros(0, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+
+    def add(self, index, counts):
+        if len(counts) == 0:
+            return
+        if len(self.counts) == 0:
+            self.offset = index
+            self.counts = np.array(counts, dtype=np.int64)
+            return
+        start = min(self.offset, index)
+        end = max(self.offset + len(self.counts), index + len(counts))
+        if (start, end) != (self.offset, self.offset + len(self.counts)):
+            grown = np.zeros(end - start, dtype=np.int64)
+            grown[self.offset - start:self.offset - start
+                  + len(self.counts)] = self.counts
+            self.offset = start
+            self.counts = grown
+        self.counts[index - start:index - start + len(counts)] += counts
+
+    def add_indices(self, indices):
+        if len(indices) > 0:
+            first = int(indices.min())
+            self.add(first, np.bincount(indices - first))
+
+
+class QuantileSketch(object):
+    """
+    Approximate quantiles of the values added, with relative error at most
+    relative_accuracy.  Values with magnitude below min_value are counted
+    as zero.  NaN and masked values are ignored, e.g.
+
+        >>> sketch = QuantileSketch()
+        >>> for state in solution.states:
+        ...     sketch.add(state.q[0,...])
+        >>> q2, q98 = sketch.quantile([0.02, 0.98])
+
+    The exact minimum, maximum, count and sum are kept as well.
+    """
+
+    def __init__(self, relative_accuracy=0.01, min_value=1e-12):
+        if not (0 < relative_accuracy < 1):
+            raise ValueError('relative_accuracy must be between 0 and 1')
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._positive = _Bins()
+        self._negative = _Bins()
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _indices(self, magnitudes):
+        return np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64)
+
+    def add(self, values):
+        """Add the values in the array values (of any shape)."""
+
+        values = np.ma.compressed(np.ma.masked_invalid(values))
+        if values.size == 0:
+            return
+        values = values.astype(float, copy=False)
+        positive = values[values > self.min_value]
+        negative = -values[values < -self.min_value]
+        self._positive.add_indices(self._indices(positive))
+        self._negative.add_indices(self._indices(negative))
+        self.zero_count += values.size - positive.size - negative.size
+        self.count += values.size
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def _check(self, other):
+        if (other.relative_accuracy != self.relative_accuracy) or \
+                (other.min_value != self.min_value):
+            raise ValueError('cannot merge sketches with different '
+                             'relative_accuracy or min_value')
+
+    def merge(self, other):
+        """Add the values counted in the sketch other to this one."""
+
+        self._check(other)
+        self._positive.add(other._positive.offset, other._positive.counts)
+        self._negative.add(other._negative.offset, other._negative.counts)
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """
+        The approximate quantile q (between 0 and 1) of the values added,
+        or an array of them if q is a list; NaN if there are no values.
+        """
+
+        qs = np.atleast_1d(np.asarray(q, dtype=float))
+        if self.count == 0:
+            result = np.full(qs.shape, np.nan)
+        else:
+            # bins in increasing order of their values:
+            g = self._gamma
+            neg = self._negative
+            pos = self._positive
+            values = np.concatenate([
+                -2 * g**(neg.offset + np.arange(len(neg.counts)))[::-1]
+                        / (g + 1),
+                [0.],
+                2 * g**(pos.offset + np.arange(len(pos.counts))) / (g + 1)])
+            counts = np.concatenate([neg.counts[::-1], [self.zero_count],
+                                     pos.counts])
+            ranks = np.clip(qs, 0, 1) * (self.count - 1)
+            k = np.searchsorted(np.cumsum(counts), ranks, side='right')
+            result = np.clip(values[np.minimum(k, len(values) - 1)],
+                             self.min, self.max)
+            result[qs <= 0] = self.min
+            result[qs >= 1] = self.max
+        if np.ndim(q) == 0:
+            return float(result[0])
+        return result
+
+    def to_dict(self):
+        """The sketch as a dictionary of numbers and lists, e.g. for json."""
+
+        return {'relative_accuracy': self.relative_accuracy,
+                'min_value': self.min_value,
+                'count': int(self.count),
+                'sum': float(self.sum),
+                'zero_count': int(self.zero_count),
+                'min': float(self.min) if self.count > 0 else None,
+                'max': float(self.max) if self.count > 0 else None,
+                'positive': [int(self._positive.offset),
+                             self._positive.counts.tolist()],
+                'negative': [int(self._negative.offset),
+                             self._negative.counts.tolist()]}
+
+    @classmethod
+    def from_dict(cls, d):
+        """The sketch stored in the dictionary d made by to_dict."""
+
+        sketch = cls(d['relative_accuracy'], d['min_value'])
+        sketch._positive = _Bins(*d['positive'])
+        sketch._negative = _Bins(*d['negative'])
+        sketch.zero_count = d['zero_count']
+        sketch.count = d['count']
+        sketch.sum = d['sum']
+        if sketch.count > 0:
+            sketch.min = d['min']
+            sketch.max = d['max']
+        return sketch
+
+
+def merge(sketches):
+    """A new sketch with the values of all the sketches in the list."""
+
+    sketches = list(sketches)
+    if len(sketches) == 0:
+        return QuantileSketch()
+    result = QuantileSketch(sketches[0].relative_accuracy,
+                            sketches[0].min_value)
+    for sketch in sketches:
+        result.merge(sketch)
+    return result
@@ -0,0 +1,75 @@
+"""
+Benchmark the time needed to import visclaw modules.
+
+Each module is imported in a fresh Python interpreter, so that the time
+includes everything the module imports.  The time beyond importing numpy,
+which every module needs, is also reported, and modules that should not
+import pyplot are checked.
+
+Run from any directory with
+    $ python benchmark_imports.py
+or
+    $ python benchmark_imports.py gridtools frametools
+to time only some modules.  The target for gridtools is a few tens of
+milliseconds.
+"""
+
+import sys
+import subprocess
+
+modules = ['gridtools', 'data', 'colormaps', 'frametools', 'gaugetools',
+           'animation_tools', 'plotpages', 'plotclaw']
+
+# Modules that should be importable without importing matplotlib.pyplot:
+no_pyplot = ['gridtools', 'data', 'colormaps', 'frametools', 'gaugetools',
+             'animation_tools', 'plotpages']
+
+_timer = """
+import sys, time
+t0 = time.perf_counter()
+import numpy
+t1 = time.perf_counter()
+import clawpack.visclaw.%s
+t2 = time.perf_counter()
+print(t2 - t0, t2 - t1, 'matplotlib.pyplot' in sys.modules)
+"""
+
+
+def time_import(module, repeats=5):
+    """
+    Return (total, beyond_numpy, imports_pyplot) for importing
+    clawpack.visclaw.module, with the times in seconds the best of repeats.
+    """
+
+    best = None
+    for n in range(repeats):
+        out = subprocess.check_output([sys.executable, '-c', _timer % module])
+        total, beyond_numpy, pyplot = out.decode().split()
+        times = (float(total), float(beyond_numpy))
+        if best is None or times[0] < best[0]:
+            best = times
+    return best[0], best[1], pyplot == 'True'
+
+
+def main(argv):
+    if len(argv) > 0:
+        names = argv
+    else:
+        names = modules
+
+    print('%-18s %12s %14s  %s' % ('module', 'total (ms)', 'no numpy (ms)',
+                                  'pyplot'))
+    ok = True
+    for name in names:
+        total, beyond_numpy, pyplot = time_import(name)
+        flag = ''
+        if pyplot and name in no_pyplot:
+            flag = '  *** imports pyplot'
+            ok = False
+        print('%-18s %12.1f %14.1f  %s%s' % (name, 1000*total,
+              1000*beyond_numpy, pyplot, flag))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
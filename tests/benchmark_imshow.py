@@ -0,0 +1,140 @@
+"""
+Benchmark the memory allocated and the time taken by the imshow and
+hillshade plots of plotitem2 on a large uniform grid.
+
+The hillshade of each patch is computed in place in its gradient arrays
+by frametools.hillshade_intensity, and both plots pass var.T, a view,
+to imshow with origin='lower'.  For comparison the hillshade is also
+computed as plotitem2 did before, through an array of normal vectors,
+and imshow is also given np.flipud(var.T) with the default origin.
+Both are views, and matplotlib copies the array given to imshow either
+way, so the imshow cases are expected to allocate about the same.
+
+The peak memory allocated (measured with tracemalloc) is reported in MB
+and as a multiple of the size of the plotted array.
+
+Run from any directory with
+    $ python benchmark_imshow.py
+or
+    $ python benchmark_imshow.py 4000
+for a 4000 x 4000 grid (default 2000 x 2000).
+"""
+
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+
+def hillshade_before(var, dx, dy, ve=1., azdeg=315, altdeg=45):
+    """The hillshade intensity as computed in plotitem2 before."""
+    from matplotlib.colors import LightSource
+
+    ls = LightSource(azdeg=azdeg, altdeg=altdeg)
+    z = np.flipud(var.T)
+    e_dy, e_dx = np.gradient(ve * z, -dy, dx)
+    normal = np.empty(z.shape + (3,)).view(type(z))
+    normal[..., 0] = -e_dx
+    normal[..., 1] = -e_dy
+    normal[..., 2] = 1
+    sum_sq = 0
+    for i in range(normal.shape[-1]):
+        sum_sq += np.square(normal[..., i, np.newaxis])
+    normal /= np.sqrt(sum_sq)
+    intensity = normal.dot(ls.direction)
+    return np.clip(intensity, 0, 1)
+
+
+def measure(fun, *args):
+    """
+    Return (seconds, peak bytes allocated) for calling fun(*args).
+    """
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    t0 = time.perf_counter()
+    fun(*args)
+    seconds = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def make_solution(n):
+    from clawpack import pyclaw
+
+    x = pyclaw.Dimension(0., 1., n, name='x')
+    y = pyclaw.Dimension(0., 1., n, name='y')
+    domain = pyclaw.Domain([x, y])
+    state = pyclaw.State(domain, 1)
+    X, Y = state.grid.p_centers
+    state.q[0] = np.sin(8*X) * np.cos(6*Y)
+    return pyclaw.Solution(state, domain)
+
+
+def plot_frame(solution, plot_type):
+    """plot_frame for one item of type plot_type, drawn to a canvas."""
+    import matplotlib.pyplot as plt
+    from clawpack.visclaw.data import ClawPlotData
+    from clawpack.visclaw import frametools
+
+    plotdata = ClawPlotData()
+    plotdata.printfigs = False
+    plotfigure = plotdata.new_plotfigure(name='bench', figno=0)
+    plotaxes = plotfigure.new_plotaxes()
+    plotitem = plotaxes.new_plotitem(plot_type=plot_type)
+    plotitem.plot_var = 0
+    frametools.plot_frame([solution], plotdata, 0)
+    plotaxes._handle.figure.canvas.draw()
+    plt.close('all')
+
+
+def imshow(var, flip):
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    if flip:
+        ax.imshow(np.flipud(var.T), extent=(0, 1, 0, 1),
+                  interpolation='nearest')
+    else:
+        ax.imshow(var.T, origin='lower', extent=(0, 1, 0, 1),
+                  interpolation='nearest')
+    fig.canvas.draw()
+    plt.close(fig)
+
+
+def main(argv):
+    import matplotlib
+    matplotlib.use('Agg')
+    from clawpack.visclaw.frametools import hillshade_intensity
+
+    n = int(argv[0]) if len(argv) > 0 else 2000
+    solution = make_solution(n)
+    var = solution.state.q[0]
+    size = var.nbytes
+    dx = dy = 1. / n
+
+    cases = [('hillshade, before', hillshade_before, (var, dx, dy)),
+             ('hillshade_intensity', hillshade_intensity, (var.T, dx, dy)),
+             ('imshow, flipud(var.T)', imshow, (var, True)),
+             ("imshow, var.T, origin='lower'", imshow, (var, False)),
+             ('plot_frame, 2d_imshow', plot_frame, (solution, '2d_imshow')),
+             ('plot_frame, 2d_hillshade', plot_frame,
+              (solution, '2d_hillshade'))]
+
+    # the first figure drawn also loads fonts etc., so draw one first:
+    imshow(np.zeros((2, 2)), False)
+
+    print('%i x %i grid, %.1f MB per array' % (n, n, size / 1e6))
+    print('%-32s %10s %12s %10s' % ('case', 'time (s)', 'peak (MB)',
+                                    'arrays'))
+    for name, fun, args in cases:
+        seconds, peak = measure(fun, *args)
+        print('%-32s %10.3f %12.1f %10.1f' % (name, seconds, peak / 1e6,
+                                              peak / float(size)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
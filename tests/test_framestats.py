@@ -0,0 +1,97 @@
+"""
+Tests of the statistics stored in the outdir by framestats.update_stats.
+
+Run with
+    $ python -m pytest test_framestats.py
+"""
+
+import os
+import json
+
+import numpy as np
+
+from clawpack import pyclaw
+from clawpack.visclaw import framestats
+
+
+def write_frame(outdir, frameno, scale):
+    # a single 2d patch with q[0] = scale * x * y, written as ascii output:
+    x = pyclaw.Dimension(0., 1., 10, name='x')
+    y = pyclaw.Dimension(0., 2., 10, name='y')
+    patch = pyclaw.geometry.Patch([x, y])
+    state = pyclaw.State(patch, 1)
+    X, Y = patch.grid.p_centers
+    state.q[0] = scale * X * Y
+    solution = pyclaw.Solution(state, pyclaw.Domain(patch))
+    solution.t = float(frameno)
+    solution.write(frameno, path=outdir, file_format='ascii',
+                   write_aux=False)
+
+
+def count_reads(monkeypatch):
+    # frame numbers read by update_stats:
+    read = []
+    frame_stats = framestats.frame_stats
+
+    def counting_frame_stats(outdir, frameno, *args, **kwargs):
+        read.append(frameno)
+        return frame_stats(outdir, frameno, *args, **kwargs)
+
+    monkeypatch.setattr(framestats, 'frame_stats', counting_frame_stats)
+    return read
+
+
+def touch_later(outdir, frameno):
+    # make sure the change of the files is seen even with coarse mtimes:
+    for fname in os.listdir(outdir):
+        if fname.endswith(str(frameno).zfill(4)):
+            fname = os.path.join(outdir, fname)
+            mtime = os.path.getmtime(fname) + 10.
+            os.utime(fname, (mtime, mtime))
+
+
+def test_stats_are_stored(tmp_path):
+    outdir = str(tmp_path)
+    write_frame(outdir, 0, 1.)
+    stats = framestats.update_stats(outdir, [0], [0], verbose=False)
+    entry = framestats.var_stats(stats, 0, 0)
+    q = 0.05 * 0.1 * np.arange(1, 20, 2)[:, None] * np.arange(1, 20, 2)
+    assert np.isclose(entry['max'], q.max())
+    assert np.isclose(entry['min'], q.min())
+    assert entry['count'] == 100
+    with open(os.path.join(outdir, framestats.stats_file)) as f:
+        assert json.load(f)['frames']['0']['vars']['0']['all'] == entry
+
+
+def test_changed_frame_is_read_again(tmp_path, monkeypatch):
+    outdir = str(tmp_path)
+    for frameno in [0, 1]:
+        write_frame(outdir, frameno, 1.)
+    read = count_reads(monkeypatch)
+    framestats.update_stats(outdir, [0, 1], [0], verbose=False)
+    assert sorted(read) == [0, 1]
+
+    # nothing changed, nothing is read:
+    del read[:]
+    framestats.update_stats(outdir, [0, 1], [0], verbose=False)
+    assert read == []
+
+    # frame 1 changed, only frame 1 is read and its statistics replaced:
+    max0 = framestats.var_stats(framestats.read_stats(outdir), 0, 0)['max']
+    write_frame(outdir, 1, 2.)
+    touch_later(outdir, 1)
+    stats = framestats.update_stats(outdir, [0, 1], [0], verbose=False)
+    assert read == [1]
+    assert np.isclose(framestats.var_stats(stats, 0, 1)['max'], 2*max0)
+    assert framestats.var_stats(stats, 0, 0)['max'] == max0
+
+
+def test_frame_10001_does_not_change_frame_1(tmp_path, monkeypatch):
+    outdir = str(tmp_path)
+    write_frame(outdir, 1, 1.)
+    framestats.update_stats(outdir, [1], [0], verbose=False)
+    read = count_reads(monkeypatch)
+    write_frame(outdir, 10001, 1.)
+    touch_later(outdir, 10001)
+    framestats.update_stats(outdir, [1], [0], verbose=False)
+    assert read == []
@@ -0,0 +1,82 @@
+"""
+Tests of the outlines of AMR patches made by kmlgeometry.merge_rectangles.
+
+Run with
+    $ python -m pytest test_kmlgeometry.py
+"""
+
+import numpy as np
+
+from clawpack.visclaw import kmlgeometry
+
+
+def grid_cells(cells, dx=1., dy=1.):
+    # rectangles (x1, x2, y1, y2) of the cells (i, j) of a uniform grid:
+    i, j = np.array(cells, dtype=float).T
+    return i*dx, (i+1)*dx, j*dy, (j+1)*dy
+
+
+def polygon_area(polygon):
+    # holes are clockwise, so their areas are negative:
+    return sum([kmlgeometry._area(ring) for ring in polygon])
+
+
+def check_rings(polygons):
+    for polygon in polygons:
+        assert kmlgeometry._area(polygon[0]) > 0
+        for ring in polygon:
+            assert np.all(ring[0] == ring[-1])
+        for hole in polygon[1:]:
+            assert kmlgeometry._area(hole) < 0
+
+
+def test_adjacent_patches_make_one_polygon():
+    x1, x2, y1, y2 = grid_cells([(0, 0), (1, 0), (0, 1), (1, 1)], 0.5, 0.25)
+    polygons = kmlgeometry.merge_rectangles(x1, x2, y1, y2)
+    check_rings(polygons)
+    assert len(polygons) == 1
+    assert len(polygons[0]) == 1
+    # only the 4 corners are left:
+    assert polygons[0][0].shape == (5, 2)
+    assert sorted(map(tuple, polygons[0][0][:-1])) == \
+           [(0., 0.), (0., 0.5), (1., 0.), (1., 0.5)]
+
+
+def test_separate_patches():
+    x1, x2, y1, y2 = grid_cells([(0, 0), (2, 0), (5, 5)])
+    polygons = kmlgeometry.merge_rectangles(x1, x2, y1, y2)
+    check_rings(polygons)
+    assert len(polygons) == 3
+    assert [polygon_area(p) for p in polygons] == [1., 1., 1.]
+
+
+def test_hole():
+    cells = [(i, j) for i in range(3) for j in range(3) if (i, j) != (1, 1)]
+    x1, x2, y1, y2 = grid_cells(cells)
+    polygons = kmlgeometry.merge_rectangles(x1, x2, y1, y2)
+    check_rings(polygons)
+    assert len(polygons) == 1
+    assert len(polygons[0]) == 2
+    assert kmlgeometry._area(polygons[0][0]) == 9.
+    assert kmlgeometry._area(polygons[0][1]) == -1.
+
+
+def test_area_of_random_patches():
+    # patches of different sizes, made of the cells of a random subset of
+    # a coarse grid, cover the same area as the polygons:
+    rng = np.random.default_rng(7)
+    x1 = []; x2 = []; y1 = []; y2 = []
+    for i in range(12):
+        for j in range(12):
+            if rng.random() < 0.6:
+                n = rng.integers(1, 4)      # split into n x n patches
+                for k in range(n):
+                    for l in range(n):
+                        x1.append(i + k/n); x2.append(i + (k+1)/n)
+                        y1.append(j + l/n); y2.append(j + (l+1)/n)
+    polygons = kmlgeometry.merge_rectangles(np.array(x1), np.array(x2),
+                                            np.array(y1), np.array(y2))
+    check_rings(polygons)
+    area = np.sum((np.array(x2) - np.array(x1))
+                  * (np.array(y2) - np.array(y1)))
+    assert np.isclose(sum([polygon_area(p) for p in polygons]), area)
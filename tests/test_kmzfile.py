@@ -0,0 +1,81 @@
+"""
+Tests that kmzfile.KMZFile writes zip files that zipfile can read.
+
+Run with
+    $ python -m pytest test_kmzfile.py
+"""
+
+import os
+import zipfile
+
+import numpy as np
+import pytest
+
+from clawpack.visclaw.kmzfile import KMZFile
+
+
+def test_entries(tmp_path):
+    rng = np.random.default_rng(3)
+    png = rng.integers(0, 256, 100000).astype(np.uint8).tobytes()
+    kml = '<kml>\n' + 1000 * '  <Placemark>é</Placemark>\n' + '</kml>\n'
+
+    source = tmp_path / 'plots'
+    os.makedirs(str(source / 'fig1' / 'images'))
+    (source / 'fig1' / 'frame0000fig1.png').write_bytes(png)
+    (source / 'fig1' / 'images' / 'colorbar.png').write_bytes(png[:100])
+    (source / 'fig1' / 'doc.kml').write_text(kml, encoding='utf-8')
+    (source / 'empty.txt').write_bytes(b'')
+
+    fname = str(tmp_path / 'test.kmz')
+    with KMZFile(fname, num_threads=2) as kmz:
+        kmz.writestr('doc.kml', kml)
+        kmz.write(str(source / 'fig1' / 'frame0000fig1.png'),
+                  'fig1/frame0000fig1.png')
+        kmz.write(str(source / 'empty.txt'), 'empty.txt')
+        kmz.write_tree(str(source / 'fig1'), 'tree')
+        for k in range(20):
+            kmz.writestr('many/%i.txt' % k, str(k) * (k + 1))
+
+    with zipfile.ZipFile(fname) as z:
+        assert z.testzip() is None
+        names = z.namelist()
+        assert names[:4] == ['doc.kml', 'fig1/frame0000fig1.png',
+                             'empty.txt', 'tree/']
+        assert set(names[4:8]) == set(['tree/doc.kml',
+                                       'tree/frame0000fig1.png',
+                                       'tree/images/',
+                                       'tree/images/colorbar.png'])
+        assert z.read('doc.kml').decode('utf-8') == kml
+        assert z.read('tree/doc.kml').decode('utf-8') == kml
+        assert z.read('fig1/frame0000fig1.png') == png
+        assert z.read('tree/images/colorbar.png') == png[:100]
+        assert z.read('empty.txt') == b''
+        for k in range(20):
+            assert z.read('many/%i.txt' % k) == (str(k) * (k + 1)).encode()
+        # png files are stored, text deflated:
+        assert z.getinfo('fig1/frame0000fig1.png').compress_type == \
+               zipfile.ZIP_STORED
+        assert z.getinfo('doc.kml').compress_type == zipfile.ZIP_DEFLATED
+        assert z.getinfo('doc.kml').compress_size < len(kml)
+        assert z.getinfo('tree/images/').is_dir()
+
+
+def test_duplicate_name(tmp_path):
+    with KMZFile(str(tmp_path / 'test.kmz')) as kmz:
+        kmz.writestr('doc.kml', '<kml/>')
+        with pytest.raises(ValueError):
+            kmz.writestr('doc.kml', '<kml/>')
+
+
+def test_zip64_entry_count(tmp_path):
+    # more entries than the 65535 of a plain zip file:
+    fname = str(tmp_path / 'test.kmz')
+    num_entries = 70000
+    with KMZFile(fname, num_threads=2) as kmz:
+        for k in range(num_entries):
+            kmz.writestr('%i.png' % k, b'')
+    with zipfile.ZipFile(fname) as z:
+        names = z.namelist()
+        assert len(names) == num_entries
+        assert names[-1] == '%i.png' % (num_entries - 1)
+        assert z.read(names[-1]) == b''
@@ -0,0 +1,119 @@
+"""
+Tests of the patch headers read by patchstats, compared to those read by
+pyclaw.Solution.
+
+Run with
+    $ python -m pytest test_patchstats.py
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from clawpack import pyclaw
+from clawpack.visclaw import patchstats
+
+
+def write_frame(outdir, frameno, file_format='ascii', level_base=1):
+    # a coarse 2d patch and 6 finer patches of different sizes:
+    states = []
+
+    def add(x1, x2, y1, y2, mx, my, level):
+        x = pyclaw.Dimension(x1, x2, mx, name='x')
+        y = pyclaw.Dimension(y1, y2, my, name='y')
+        patch = pyclaw.geometry.Patch([x, y])
+        patch.level = level
+        patch.patch_index = len(states) + 1
+        state = pyclaw.State(patch, 2)
+        state.q[0] = 1.
+        state.q[1] = -1.
+        states.append(state)
+
+    add(-1., 1., 0., 3., 20, 30, level_base)
+    for k in range(6):
+        add(-1. + 0.2*k, -0.8 + 0.2*k, 0.5, 0.5 + 0.1*(k+1), 4, 2*(k+1),
+            level_base + 1)
+    solution = pyclaw.Solution(states, pyclaw.Domain(states[0].patch))
+    solution.t = 0.5 * frameno
+    solution.write(frameno, path=outdir, file_format='ascii',
+                   write_aux=False)
+    if file_format == 'binary64':
+        to_binary(outdir, frameno, solution)
+
+
+def to_binary(outdir, frameno, solution):
+    # replace ascii output with binary output as AMRClaw writes it, with
+    # only the patch headers (with grid_number) in fort.q:
+    name = os.path.join(outdir, 'fort.%s' + str(frameno).zfill(4))
+    with open(name % 'q', 'w') as f:
+        for state in solution.states:
+            patch = state.patch
+            f.write('%6i                 grid_number\n' % patch.patch_index)
+            f.write('%6i                 AMR_level\n' % patch.level)
+            for n, label in zip(patch.num_cells_global, ['mx', 'my']):
+                f.write('%6i                 %s\n' % (n, label))
+            for x, label in zip(patch.lower_global, ['xlow', 'ylow']):
+                f.write('%18.8e     %s\n' % (x, label))
+            for d, label in zip(patch.delta, ['dx', 'dy']):
+                f.write('%18.8e     %s\n' % (d, label))
+            f.write('\n')
+    with open(name % 'b', 'wb') as f:
+        for state in solution.states:
+            f.write(state.q.astype(np.float64).tobytes(order='F'))
+    with open(name % 't') as f:
+        lines = f.readlines()
+    with open(name % 't', 'w') as f:
+        f.writelines([line.replace('ascii', 'binary64') for line in lines])
+
+
+@pytest.mark.parametrize('file_format', ['ascii', 'binary64'])
+def test_read_headers_matches_solution(tmp_path, file_format):
+    outdir = str(tmp_path)
+    write_frame(outdir, 3, file_format)
+    headers = patchstats.read_headers(outdir, 3)
+    solution = pyclaw.Solution(3, path=outdir, file_format=file_format)
+
+    assert headers['t'] == solution.t
+    assert headers['num_dim'] == 2
+    patches = [state.patch for state in solution.states]
+    assert len(headers['level']) == len(patches)
+    for k, patch in enumerate(patches):
+        assert headers['patch_number'][k] == patch.patch_index
+        assert headers['level'][k] == patch.level
+        assert list(headers['num_cells'][k]) == patch.num_cells_global
+        assert np.allclose(headers['lower'][k], patch.lower_global)
+        assert np.allclose(headers['delta'][k], patch.delta)
+
+
+def test_scan_frames(tmp_path):
+    outdir = str(tmp_path)
+    for frameno in [0, 1, 10000]:
+        write_frame(outdir, frameno)
+    stats = patchstats.scan_frames(outdir, num_procs=1, verbose=False)
+    assert list(stats.framenos) == [0, 1, 10000]
+    assert np.allclose(stats.t, [0., 0.5, 5000.])
+    assert stats.level_base == 1
+    assert stats.num_levels == 2
+    assert np.all(stats.patches == [1, 6])
+    cells = [20*30, sum([4*2*(k+1) for k in range(6)])]
+    assert np.all(stats.cells == cells)
+    assert np.allclose(stats.area, [6., sum([0.2*0.1*(k+1)
+                                             for k in range(6)])])
+    assert '10000' in stats.table()
+
+
+def test_level_base(tmp_path):
+    outdir = str(tmp_path)
+    write_frame(outdir, 0, level_base=0)
+    headers = patchstats.read_headers(outdir, 0)
+    with pytest.raises(ValueError):
+        patchstats.level_stats(headers)
+    patches, cells, area = patchstats.level_stats(headers, level_base=0)
+    assert list(patches) == [1, 6]
+
+    stats = patchstats.scan_frames(outdir, num_procs=1, verbose=False,
+                                   level_base=0)
+    assert stats.level_base == 0
+    assert np.all(stats.patches == [1, 6])
+    assert stats.table().splitlines()[1].split()[2] == '0'
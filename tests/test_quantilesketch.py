@@ -0,0 +1,71 @@
+"""
+Tests of the quantiles returned by quantilesketch.QuantileSketch.
+
+Run with
+    $ python -m pytest test_quantilesketch.py
+"""
+
+import numpy as np
+
+from clawpack.visclaw.quantilesketch import QuantileSketch, merge
+
+
+quantiles = [0.001, 0.02, 0.1, 0.25, 0.5, 0.75, 0.9, 0.98, 0.999]
+
+
+def check_accuracy(sketch, values, relative_accuracy=0.01):
+    # each quantile is within the relative accuracy of the value with
+    # that rank:
+    exact = np.percentile(values, 100*np.array(quantiles), method='lower')
+    approx = sketch.quantile(quantiles)
+    assert np.all(np.abs(approx - exact)
+                  <= relative_accuracy * np.abs(exact) + 1e-12)
+
+
+def test_accuracy():
+    rng = np.random.default_rng(12345)
+    for values in [rng.lognormal(0., 3., 100000),
+                   rng.normal(0., 1., 100000),
+                   -rng.exponential(1e-4, 100000),
+                   np.concatenate([np.zeros(1000),
+                                   rng.uniform(-1e6, 1e3, 50000)])]:
+        sketch = QuantileSketch(relative_accuracy=0.01)
+        sketch.add(values)
+        check_accuracy(sketch, values)
+        assert sketch.quantile(0.) == values.min()
+        assert sketch.quantile(1.) == values.max()
+        assert sketch.count == len(values)
+
+
+def test_ignores_nan_and_masked():
+    values = np.ma.masked_greater(np.array([1., 2., np.nan, 3., 100.]), 10.)
+    sketch = QuantileSketch()
+    sketch.add(values)
+    assert sketch.count == 3
+    assert sketch.max == 3.
+    assert np.isnan(QuantileSketch().quantile(0.5))
+
+
+def test_merge_matches_single_sketch():
+    rng = np.random.default_rng(2)
+    pieces = [rng.normal(10.*k, 1. + k, 1000 + 500*k) for k in range(6)]
+    single = QuantileSketch()
+    for piece in pieces:
+        single.add(piece)
+    sketches = []
+    for piece in pieces:
+        sketches.append(QuantileSketch())
+        sketches[-1].add(piece)
+    merged = merge(sketches)
+    assert merged.to_dict() == single.to_dict()
+    assert np.all(merged.quantile(quantiles) == single.quantile(quantiles))
+    check_accuracy(merged, np.concatenate(pieces))
+
+
+def test_to_dict_round_trip():
+    sketch = QuantileSketch(relative_accuracy=0.02)
+    sketch.add(np.linspace(-5., 50., 1001))
+    copy = QuantileSketch.from_dict(sketch.to_dict())
+    assert np.all(copy.quantile(quantiles) == sketch.quantile(quantiles))
+    assert (copy.min, copy.max, copy.count) == \
+           (sketch.min, sketch.max, sketch.count)